@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
 
+# Imported first, import times of everything below are measured
+from footprint.footprint import footprint, rss
+footprint.start()
+
 import os
 import sys
 import atexit
@@ -7,12 +11,16 @@ import signal
 import logging
 import threading
 import logging.handlers
-from time import sleep
-from sps30 import SPS30
-from sht40 import SHT40
-from bmp280 import BMP280
+from time import sleep, time, monotonic
+from loader.loader import driver, driver_module, sink
+from acquisition.acquisition import Acquisition
 #from myIoT.myIoT import myIOT
-from sensorComm.sensorComm import sensorCommunity
+from uploadQueue.uploadQueue import UploadQueue, check_response
+from uploadQueue.worker import UploadWorker
+from tsdb.tsdb import TSDB
+from metrics.metrics import registry as metrics
+from tracer.tracer import tracer
+from devcache.devcache import DeviceCache
 
 PERIOD = 3
 
@@ -20,12 +28,27 @@ PERIOD = 3
 SHT_BUS = 4
 SHT_PRECISION = 'hi' # [ 'hi' | 'mid' | 'low' ]
 SPS_BUS = 3
+SPS_ADDRESS = 0x69
 SPS_AUTO_CLEANING_DAYS = 5
+BMP_ADDRESS = 0x77
+STARTUP_TIMEOUT = 30          # [s] max wait for valid data from all sensors
+STARTUP_DIAGNOSTICS = None    # dump sensor registers at start, None = only when started from terminal
 
 # Path settings
 BASE_DIR     = "/home/pi/AirQmonitor"
 LOG_FILENAME = "/var/log/airqmon.log"     # File name, set propper chmod
 LOG_LEVEL    = logging.INFO               # Could be e.g. "INFO", DEBUG" or "WARNING"
+QUEUE_FILENAME = BASE_DIR + "/upload.db"  # Offline upload journal
+UPLOAD_TIMEOUT = 10                       # [s] per request
+DATA_DIR       = BASE_DIR + "/data"       # Local time-series store
+CAPTURE_FILENAME = ""                     # Raw I2C frame log (see replay/replay.py), "" = off
+METRICS_PORT   = 9105                     # Prometheus text endpoint /metrics, 0 = off
+METRICS_ADDRESS = "127.0.0.1"             # "" = all interfaces (no authentication, trusted network only)
+METRICS_FILENAME = BASE_DIR + "/metrics.json"  # Snapshot written every loop
+TRACE_FILENAME = ""                       # Chrome trace JSON of loop phases, "" = off
+DEVICE_CACHE_FILENAME = BASE_DIR + "/devices.json"  # Sensor identity and BMP280 calibration
+LOW_FOOTPRINT  = False                    # Pi Zero: no metrics endpoint/snapshot and rollups, RSS logged every loop
+DATA_FIELDS    = ["pm1", "pm2", "pm4", "pm10", "nc0", "nc1", "nc2", "nc4", "nc10", "tps", "t", "h", "t1", "p"]
 
 #API keys etc.
 # SensorsCommunity
@@ -74,6 +97,9 @@ def create_daemon():
 
 
 if __name__ == "__main__":
+    diagnostics = STARTUP_DIAGNOSTICS
+    if diagnostics is None:
+        diagnostics = notDaemon() and sys.stdout.isatty()
     os.chdir(BASE_DIR)
     create_daemon()
     PID=os.getpid()
@@ -82,99 +108,193 @@ if __name__ == "__main__":
     def sps_stop():
         print("===========  STOP MEASUREMENT AND EXIT  ===========")
         sps_sensor.stop_measurement_and_close()
+        upload_worker.stop(UPLOAD_TIMEOUT)
+        db.close()
+        if rollup is not None:
+            rollup.close()
 
-    def sigusr1_handler(signum, frame):
+    def sps_clean():
         print("===========  START CLEANING for 10sec  ===========")
         sps_sensor.start_fan_cleaning()
         print("===========  CLEANING FINISHED  ===========")
 
-    def sigusr2_handler(signum, frame):
+    def sps_cleaning_interval():
         print("===========  GET AUTO CLEAINING INTERVAL  ===========")
         print(sps_sensor.read_auto_cleaning_interval('s'))
 
+    # I2C is not touched from signal handler (main thread may hold or wait for bus lock)
+    def sigusr1_handler(signum, frame):
+        threading.Thread(target=sps_clean).start()
+
+    def sigusr2_handler(signum, frame):
+        threading.Thread(target=sps_cleaning_interval).start()
+
 
     atexit.register(sps_stop)
     signal.signal(signal.SIGUSR1, sigusr1_handler)
     signal.signal(signal.SIGUSR2, sigusr2_handler)
 
-    sps_sensor = SPS30(SPS_BUS)
-    sht_sensor = SHT40(SHT_BUS)
-    bmp_sensor = BMP280(SHT_BUS)
+    if TRACE_FILENAME:
+        tracer.enable()
+
+    if CAPTURE_FILENAME:
+        from i2c.capture import Capture
+        capture = Capture(CAPTURE_FILENAME)
+        capture.install(SPS_BUS)
+        capture.install(SHT_BUS)
+    metrics.instrument_bus(SPS_BUS)
+    metrics.instrument_bus(SHT_BUS)
+
+    # Identity/calibration of previous run, revalidated by one short read per device
+    devices = DeviceCache(DEVICE_CACHE_FILENAME)
+    sps_sensor = driver("sps30")(SPS_BUS, SPS_ADDRESS, cached = devices.get(SPS_BUS, SPS_ADDRESS))
+    sht_sensor = driver("sht40")(SHT_BUS)
+    bmp_sensor = driver("bmp280")(SHT_BUS, BMP_ADDRESS)
+    devices.put(SPS_BUS, SPS_ADDRESS, sps_sensor.identity())
+    devices.put(SHT_BUS, BMP_ADDRESS,
+                {"calib": bmp_sensor.load_calib(devices.get(SHT_BUS, BMP_ADDRESS).get("calib"))})
+    devices.save()
 #    iot = myIOT(PERIOD, IOT_USER_AGENT)
-    sc = sensorCommunity(SC_SENSOR_ID)
-
-    print("===========  SHT40  ===========")
-    sht_serial_number   = sht_sensor.serial_number()
-    print(f"SHT Serial number: {sht_serial_number}")
-    print(f"SHT data HI RES  : {sht_sensor.read_measurement('hi')}")
-    print(f"SHT data MID RES : {sht_sensor.read_measurement('mid')}")
-    print(f"SHT data LO RES  : {sht_sensor.read_measurement('low')}")
-    print("")
-
-    print("===========  SPS30  ===========")
-    sps_firmware_version = sps_sensor.firmware_version()
-    sps_product_type     = sps_sensor.product_type()
-    sps_serial_number    = sps_sensor.serial_number()
-    print(f"SPS Firmware version: {sps_firmware_version}")
-    print(f"SPS Product type    : {sps_product_type}")
-    print(f"SPS Serial number   : {sps_serial_number}")
-    sps_status_register  = sps_sensor.read_status_register()
-    print(f"SPS Status register : {sps_status_register}")
-    print(f"SPS Set auto cleaning interval: {sps_sensor.write_auto_cleaning_interval_days(SPS_AUTO_CLEANING_DAYS)} sec")
+    sc = sink("sc")(SC_SENSOR_ID)
+
+    # Uploads go through persistent journal, nothing is lost during network outage
+    # Sending runs in background worker, loop timing does not depend on network
+    uq = UploadQueue(QUEUE_FILENAME)
+    sc_post = tracer.wrap("sc.post", sc.post)
+    def sc_send(p: dict, timeout: float) -> bool:
+        if sc_post(p["pin"], p["data"], timeout) is not None:
+            return True
+        check_response(sc.last_response)    # 4xx, payload moved to dead rows
+        return False
+    uq.register("sc", metrics.timed_sink("sc", sc_send), UPLOAD_TIMEOUT)
+    upload_worker = UploadWorker(uq)
+    upload_worker.start()
+
+    # Readings are kept locally, records are written in batches (SD card friendly)
+    db = TSDB(DATA_DIR, DATA_FIELDS)
+    # 1m/5m/1h/1d aggregates, open buckets are rebuilt from stored readings
+    rollup = None
+    if not LOW_FOOTPRINT:
+        from rollup.rollup import Rollup
+        rollup = Rollup(DATA_DIR + "/rollup", DATA_FIELDS)
+        rollup.catch_up(db)
+
+    if diagnostics:
+        print("===========  SHT40  ===========")
+        print(f"SHT Serial number: {sht_sensor.sn}")
+        print(f"SHT data HI RES  : {sht_sensor.read_measurement('hi')}")
+        print(f"SHT data MID RES : {sht_sensor.read_measurement('mid')}")
+        print(f"SHT data LO RES  : {sht_sensor.read_measurement('low')}")
+        print("")
+
+        print("===========  SPS30  ===========")
+        print(f"SPS Firmware version: {sps_sensor.fw}")
+        print(f"SPS Product type    : {sps_sensor.type}")
+        print(f"SPS Serial number   : {sps_sensor.sn}")
+        print(f"SPS Status register : {sps_sensor.read_status_register()}")
+        print("")
+
+        print("===========  BMP280 ============")
+        print(f"BMP Device ID    : {bmp_sensor.device_id()}")
+        print(f"BMP MEAS_REG     : {bmp_sensor.meas_reg()}")
+        print(f"BMP CTRL_REG     : {bmp_sensor.ctrl_reg()}")
+        print(f"BMPCALIB_REG     : {bmp_sensor.calib_reg()}")
+        print("")
+
+    # Interval is kept by sensor, written only when it differs
     sps_auto_cleaning_interval = sps_sensor.read_auto_cleaning_interval('d')
+    if sps_auto_cleaning_interval != SPS_AUTO_CLEANING_DAYS:
+        sps_sensor.write_auto_cleaning_interval_days(SPS_AUTO_CLEANING_DAYS)
+        sps_auto_cleaning_interval = sps_sensor.read_auto_cleaning_interval('d')
     print(f"SPS Auto cleaning interval    : {sps_auto_cleaning_interval} days")
 
     sps_sensor.start_measurement()
-    print(f"SPS data: {sps_sensor.read_measurement()}")
-
-    print("")
-
-    print("===========  BMP280 ============")
-    print(f"BMP Device ID    : {bmp_sensor.device_id()}")
-    print(f"BMP MEAS_REG     : {bmp_sensor.meas_reg()}")
-    print(f"BMP CTRL_REG     : {bmp_sensor.ctrl_reg()}")
-    print(f"BMP SET MEAS_REG : {bmp_sensor.set_meas_reg()}")
-    print(f"BMP SET CTRL_REG : {bmp_sensor.set_ctrl_reg()}")
-    print(f"BMP MEAS_REG     : {bmp_sensor.meas_reg()}")
-    print(f"BMP CTRL_REG     : {bmp_sensor.ctrl_reg()}")
-    print(f"BMPCALIB_REG     : {bmp_sensor.calib_reg()}")
 
-    sensor_info  = f"SHT40[{sht_serial_number}]+SPS30[{sps_serial_number}/v.{sps_firmware_version}/{sps_product_type}/{sps_auto_cleaning_interval}d]"
+    sensor_info  = f"SHT40[{sht_sensor.sn}]+SPS30[{sps_sensor.sn}/v.{sps_sensor.fw}/{sps_sensor.type}/{sps_auto_cleaning_interval}d]"
 #    for key in sps_status_register:
 #        sensor_info = sensor_info + "-" + sps_status_register[key]
 #    sensor_info = sensor_info + "]"
 
-    bmp_sensor.read_calib_data(bmp_sensor.calib_reg())
-
-    print("")
-    print("=== WAITING 30 sec FOR DATA STABILIZATION ===")
-    sleep(30)
+    # SHT40+BMP280 (bus 4) are read in parallel with SPS30 (bus 3)
+    acq = Acquisition()
+    acq.add("sht40",  sht_sensor, tracer.wrap("sht40.read", lambda: sht_sensor.read_values(SHT_PRECISION)))
+    acq.add("bmp280", bmp_sensor, tracer.wrap("bmp280.read", bmp_sensor.read_values))
+    acq.add("sps30",  sps_sensor, tracer.wrap("sps30.read", sps_sensor.read_values))
+    sps_start = tracer.wrap("sps30.start_measurement", sps_sensor.start_measurement)
+
+    metrics.watch_driver("sps30", sps_sensor, driver_module("sps30").MEASURED_VALUES_FLOAT)
+    metrics.watch_driver("sht40", sht_sensor, driver_module("sht40").MEASURED_VALUES)
+    metrics.watch_driver("bmp280", bmp_sensor)
+    rss_bytes = metrics.gauge("airq_process_rss_bytes", "Resident set size", ("kind",))
+    metrics.collect(lambda: [rss_bytes.set(v, kind = k) for k, v in zip(("current", "peak"), rss())])
+    if METRICS_PORT and not LOW_FOOTPRINT:
+        metrics.serve(METRICS_PORT, METRICS_ADDRESS)
+
+    print("=== WAITING FOR DATA ===")
+    ready_start = monotonic()
+    ready = acq.wait_ready(STARTUP_TIMEOUT)
+    print(f"Sensors ready in {monotonic() - ready_start:.1f} s, errors: {ready.errors}")
+    footprint.stop_imports()
+    for line in footprint.report_lines():
+        print(line)
     print("===========  LOOP  ===========")
 
+    last_start = None
     while True:
         try:
-            while(sps_sensor.is_cleaning() == 1):
-                print("=========== CLEANING IN PROCESS - WAIT ===========")
-                sleep(1)
-
-            sensors_values = dict(sht_sensor.read_values(SHT_PRECISION))
-            sensors_values.update(bmp_sensor.read_values())
-            sc.create_json(sensors_values)
-            print(sc.post(SC_SHT_PIN))
-
-            sensors_values.update(sps_sensor.read_values())
-            sc.create_json(sensors_values)
-            print(sc.post(SC_SPS_PIN))
+            with tracer.span("cleaning.wait"):
+                while(sps_sensor.is_cleaning() == 1):
+                    print("=========== CLEANING IN PROCESS - WAIT ===========")
+                    sleep(1)
+
+            start = monotonic()
+            jitter = None if last_start is None else start - last_start - PERIOD*60
+            last_start = start
+
+            with tracer.span("acquisition"):
+                reading = acq.read()
+            metrics.cycle(reading.cycle, jitter)
+            if LOW_FOOTPRINT:
+                rss_current, rss_peak = rss()
+                print(f"RSS: {rss_current >> 10} kB (peak {rss_peak >> 10} kB)")
+            else:
+                try:
+                    metrics.write_snapshot(METRICS_FILENAME)
+                except OSError as e:
+                    print("Metrics snapshot failed:", repr(e))
+            # Full SD card or write error must not stop acquisition and uploads
+            with tracer.span("store"):
+                ts = time()
+                try:
+                    db.append(ts, reading.values)
+                    if rollup is not None:
+                        rollup.add(ts, reading.values)
+                except OSError as e:
+                    print("Local store failed:", repr(e))
+            with tracer.span("json.build"):
+                sensors_values = dict(reading.device("sht40"))
+                sensors_values.update(reading.device("bmp280"))
+                sc.create_json(sensors_values)
+                upload_worker.submit("sc", {"pin": SC_SHT_PIN, "data": sc.data}, SC_SHT_PIN)
+
+                sensors_values = reading.values
+                sc.create_json(sensors_values)
+                upload_worker.submit("sc", {"pin": SC_SPS_PIN, "data": sc.data}, SC_SPS_PIN)
+            print("Upload:", upload_worker.stats())
 
 #            iot.values_to_query_str(sensors_values)
 #            iot.sensor_status = sps_sensor.read_status()
 #            iot.sensor_info  = sensor_info
 #            print(iot.push())
 
-            sps_sensor.stop_measurement()
-            tim_thr = threading.Timer((int((PERIOD*60)-45)), sps_sensor.start_measurement).start()
+            with tracer.span("sps30.stop_measurement"):
+                sps_sensor.stop_measurement()
+            tim_thr = threading.Timer((int((PERIOD*60)-45)), sps_start).start()
 
-            sleep(PERIOD*60)
+            if TRACE_FILENAME:
+                tracer.export(TRACE_FILENAME)
+            with tracer.span("sleep"):
+                sleep(PERIOD*60)
 
         except KeyboardInterrupt:
             sys.exit()
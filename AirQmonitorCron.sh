@@ -1,17 +1,19 @@
 #!/bin/bash
 
-PROCESS="python3 /home/pi/AirQmonitor/AirQmonitorSEN.py"
-PIDOF="/usr/bin/pidof"
+# SEN5x station runs configuration driven pipeline (see pipeline/pipeline.py)
+CONFIG="/home/pi/AirQmonitor/config/AirQmonitorSEN.json"
+PROCESS="python3 /home/pi/AirQmonitor/pipeline/pipeline.py $CONFIG"
+PGREP="/usr/bin/pgrep -f"
 KILL="/usr/bin/kill"
-AQ="su - pi -c '/home/pi/AirQmonitor/AirQmonitorSEN.py'"
+AQ="su - pi -c '$PROCESS --daemon'"
 
-RUN=`$PIDOF $PROCESS`
+RUN=`$PGREP "$PROCESS"`
 # >/dev/null`
 
 if [ $? != 0 ]; then
   echo "Start AirQmonitor"
   /home/pi/pushover.sh "AirQmonitor.py RESTART"
-  $AQ
+  eval $AQ
 else
   echo "Save VOC algo state"
   $KILL -SIGUSR2 $RUN
@@ -15,3 +15,13 @@ try:
   tmep.push(TMEP_USER_DOMAIN)
 except Exception as e:
   print("=== TMEP PUSH ERROR ===")
+
+# ... or through persistent offline queue, see uploadQueue/uploadQueue.py
+from uploadQueue.uploadQueue import UploadQueue
+
+uq = UploadQueue("upload.db")
+uq.register("tmep", lambda p: tmep.push(TMEP_USER_DOMAIN, query_string = p["query"]) is not None)
+
+tmep.values_to_query_str(TMEP_USER_QSV, sensors_values)
+uq.put("tmep", {"query": tmep.query_string})
+uq.drain()
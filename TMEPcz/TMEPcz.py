@@ -1,47 +1,63 @@
 import os
-import urllib.request
-from urllib.error import HTTPError, URLError
 from socket import timeout
+from httpPool.httpPool import get_pool
 
 TMEP_DOMAIN   = ".tmep.cz/?"
 
+
+# Query string of quantities, e.g. "t=21.5&h=40.2&", pressure over 2000 (Pa) sent in hPa
+def query_str(quantity: list, data: dict, presision: int = 3) -> str:
+    query_string = ""
+    for idx in quantity:
+        value = data[idx]
+        if (idx == 'p' and value > 2000):
+            value = value / 100
+        query_string = query_string + idx + '=' + str(round(value,presision)) + '&'
+    return query_string
+
 class TMEPcz:
 
-    def __init__(self, interval: int = 3, timeout:int = 5) -> None:
+    def __init__(self, interval: int = 3, timeout:int = 5, pool = None) -> None:
         self.query_string  = ""
         self.push_interval = interval
         self.timeout       = timeout
+        self.pool          = get_pool() if pool is None else pool
+        self.last_response = None
 
-    def push(self, sensor_domain:str, sensor_guid:str = '') -> str:
+    # Returns response body, None on failure
+    # Connection is kept open and reused by next push (see httpPool)
+    def push(self, sensor_domain:str, sensor_guid:str = '', query_string: str = None,
+                   request_timeout: float = None) -> str:
+        headers = {}
+        if query_string is None:
+            query_string = self.query_string
+        if request_timeout is None:
+            request_timeout = self.timeout
+        self.last_response = None
         try:
             if (sensor_guid != ''):
-              self.query_string = self.query_string.replace(self.query_string[0:self.query_string.find('=')],sensor_guid)
+              query_string = query_string.replace(query_string[0:query_string.find('=')],sensor_guid)
 
-            url = "http://" + sensor_domain + TMEP_DOMAIN + self.query_string
+            url = "http://" + sensor_domain + TMEP_DOMAIN + query_string
 #            print(url)
             headers = {
-              'User-Agent' : "Python/AirQmonitor("+ os.uname().nodename + "[" + str(os.getpid()) + "])",
-              'Connection' : "close"
+              'User-Agent' : "Python/AirQmonitor("+ os.uname().nodename + "[" + str(os.getpid()) + "])"
             }
 #            print(headers)
-            req = urllib.request.Request(url, headers = headers)
             try:
-              resp = urllib.request.urlopen(req, timeout = self.timeout)
-              return resp.read()
-            except HTTPError as error:
-              print('HTTP Error: %s\nURL: %s', error, url)
-            except URLError as error:
-              if isinstance(error.reason, timeout):
-                print('Timeout Error: %s\nURL: %s', error, url)
-              else:
-                print('URL Error: %s\nURL: %s', error, url)
+              resp = self.pool.request("GET", url, None, headers, timeout = request_timeout)
+              self.last_response = resp
+              if resp.status >= 400:
+                print('HTTP Error: %s\nURL: %s', resp.status, url)
+                return None
+              return resp.body
+            except timeout as error:
+              print('Timeout Error: %s\nURL: %s', error, url)
+            except OSError as error:
+              print('URL Error: %s\nURL: %s', error, url)
         except Exception as e:
             print("Unable to push Info for client", headers['User-Agent'])
             print(str(e))
 
     def values_to_query_str(self, quantity: list, data: dict, presision: int = 3) -> None:
-        self.query_string = ""
-        for idx in quantity:
-            if (idx == 'p' and data[idx] > 2000):
-                data[idx] = data[idx] /100
-            self.query_string = self.query_string + idx + '=' + str(round(data[idx],presision)) + '&'
+        self.query_string = query_str(quantity, data, presision)
@@ -0,0 +1,117 @@
+from time import time, sleep, monotonic
+from concurrent.futures import ThreadPoolExecutor
+
+# Concurrent sensor acquisition
+#
+# Devices on different I2C buses are read in parallel (one worker per bus),
+# devices sharing a bus are read one after another in registration order.
+#
+#   acq = Acquisition()
+#   acq.add("sht40",  sht_sensor, lambda: sht_sensor.read_values('hi'))
+#   acq.add("bmp280", bmp_sensor)
+#   acq.add("sps30",  sps_sensor)
+#   reading = acq.read()
+#   reading.values, reading.ts["sps30"]
+#   reading = acq.wait_ready(30)      # startup: until every device returns valid data
+
+
+class Reading:
+
+    def __init__(self):
+        self.values   = {}    # merged values of all devices
+        self.devices  = {}    # device name -> values
+        self.ts       = {}    # device name -> wall clock timestamp of read
+        self.duration = {}    # device name -> read duration [s]
+        self.errors   = {}    # device name -> exception
+        self.cycle    = 0.0   # wall clock duration of whole read [s]
+
+    def device(self, name: str) -> dict:
+        return self.devices.get(name, {})
+
+
+class Acquisition:
+
+    def __init__(self, raise_errors: bool = True):
+        self.sources      = []
+        self.valid        = {}    # device name -> callable(values) -> bool
+        self.raise_errors = raise_errors
+        self.executor     = None
+
+    # read  - callable returning dict, default device.read_values
+    # bus   - I2C bus number, default device.i2c.bus
+    # valid - callable(values) -> bool, default device.valid_values (drivers substituting
+    #         err values for bad CRC) or non-empty values
+    def add(self, name: str, device, read = None, bus = None, valid = None) -> None:
+        if read is None:
+            read = device.read_values
+        if bus is None:
+            bus = device.i2c.bus
+        if valid is None:
+            valid = getattr(device, "valid_values", bool)
+        self.sources.append((name, bus, read))
+        self.valid[name] = valid
+        self.close()
+
+    def buses(self, names: set = None) -> dict:
+        groups = {}
+        for name, bus, read in self.sources:
+            if names is None or name in names:
+                groups.setdefault(bus, []).append((name, read))
+        return groups
+
+    def read_bus(self, sources: list, reading: Reading) -> None:
+        for name, read in sources:
+            start = monotonic()
+            try:
+                values = read()
+                reading.ts[name]      = time()
+                reading.devices[name] = values if values else {}
+            except Exception as e:
+                reading.errors[name] = e
+            reading.duration[name] = monotonic() - start
+
+    # names - read only these devices (e.g. sensors due in this cycle), default all
+    def read(self, names: set = None) -> Reading:
+        reading = Reading()
+        start   = monotonic()
+        groups  = list(self.buses(names).values())
+        if len(groups) == 1:
+            self.read_bus(groups[0], reading)
+        elif groups:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers = len(self.buses()),
+                                                   thread_name_prefix = "i2c-bus")
+            for future in [self.executor.submit(self.read_bus, g, reading) for g in groups]:
+                future.result()
+        reading.cycle = monotonic() - start
+
+        # merge in registration order, independent of completion order
+        for name, bus, read in self.sources:
+            reading.values.update(reading.device(name))
+
+        if self.raise_errors and reading.errors:
+            raise next(iter(reading.errors.values()))
+        return reading
+
+    # Read until every device returned valid values (data ready, CRC ok, see add()),
+    # returns first complete Reading, or last incomplete one after timeout [s]
+    # ready - optional device name -> callable(values) -> bool replacing valid check
+    def wait_ready(self, timeout: float, ready: dict = None, interval: float = 0.5) -> Reading:
+        ready    = ready or {}
+        deadline = monotonic() + timeout
+        raise_errors, self.raise_errors = self.raise_errors, False
+        try:
+            while True:
+                reading = self.read()
+                if all(ready.get(name, self.valid[name])(reading.device(name)) for name, bus, read in self.sources):
+                    return reading
+                if monotonic() + interval >= deadline:
+                    return reading
+                sleep(interval)
+        finally:
+            self.raise_errors = raise_errors
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait = True)
+            self.executor = None
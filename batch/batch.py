@@ -0,0 +1,153 @@
+import math
+from sensirion.crc import CRC8_TABLE, CRC8_INIT, PACKET_SIZE
+from sensirion.codec import WORD_SIZE
+from bmp280 import BMP280
+import sps30
+import sen5x
+import sht40
+
+# Batch compensation of archived raw data
+#
+# Same results as the scalar driver path (FrameCodec.decode, BMP280.compensate),
+# vectorized with NumPy when installed, plain per-sample loop otherwise.
+#
+#   values = sht40_frames(raw)               # raw = N concatenated 6-byte frames
+#   values["t"], values["h"], values["valid"]
+#   t, p = bmp280_compensate(adc_t, adc_p, calib)
+
+try:
+    import numpy as np
+    # np.round differs from round() in last digit, scalar path uses round()
+    ROUND = np.frompyfunc(lambda value, ndigits: round(float(value), ndigits), 2, 1)
+except ImportError:
+    np = None
+
+# struct format char -> big-endian NumPy dtype
+DTYPES = {
+    'H': '>u2',
+    'h': '>i2',
+    'I': '>u4',
+    'i': '>i4',
+    'f': '>f4'
+}
+
+
+def frame_count(codec, frames) -> int:
+    if len(frames) % codec.nbytes:
+        raise ValueError(f"Frames length {len(frames)} is not multiple of {codec.nbytes}")
+    return len(frames) // codec.nbytes
+
+
+# Raw words -> values, raw is dict name -> array (or list) of raw values
+def convert(codec, raw: dict) -> dict:
+    values = {}
+    for name, offset, gain, scale in codec.convert:
+        column = raw[name]
+        if np is None:
+            column = [v if scale is None else offset + gain * v / scale for v in column]
+            if codec.ndigits is not None:
+                column = [round(v, codec.ndigits) for v in column]
+        else:
+            column = np.asarray(column, dtype = np.float64)
+            if scale is not None:
+                column = offset + gain * column / scale
+            if codec.ndigits is not None:
+                column = ROUND(column, codec.ndigits).astype(np.float64)
+        values[name] = column
+    return values
+
+
+# N concatenated response frames (incl. CRC) -> dict name -> values,
+# "valid" is False for frames dropped by decode() (bad CRC, codec without err),
+# their values are NaN
+def decode_frames(codec, frames) -> dict:
+    count = frame_count(codec, frames)
+    if np is None:
+        return decode_frames_scalar(codec, frames, count)
+
+    words = np.frombuffer(bytes(frames), dtype = np.uint8).reshape(count, codec.words, PACKET_SIZE)
+    table = np.frombuffer(bytes(CRC8_TABLE), dtype = np.uint8)
+    bad   = table[table[CRC8_INIT ^ words[:, :, 0]] ^ words[:, :, 1]] != words[:, :, 2]
+
+    payload = np.ascontiguousarray(words[:, :, :WORD_SIZE]).reshape(count, codec.words * WORD_SIZE)
+    record  = payload.view(np.dtype([(f.name, DTYPES[f.type]) for f in codec.fields])).reshape(count)
+
+    raw   = {}
+    valid = ~bad.any(axis = 1)
+    word  = 0
+    for idx, f in enumerate(codec.fields):
+        column = record[f.name].astype(np.float64 if f.type == 'f' else np.int64)
+        if codec.err is not None:
+            field_bad = bad[:, word:word + f.words].any(axis = 1)
+            column[field_bad] = codec.err_raw[idx]
+        raw[f.name] = column
+        word += f.words
+
+    values = convert(codec, raw)
+    if codec.err is None:
+        for name in values:
+            values[name][~valid] = math.nan
+    else:
+        valid[:] = True
+    values["valid"] = valid
+    return values
+
+
+def decode_frames_scalar(codec, frames, count: int) -> dict:
+    values = {name: [] for name in codec.names}
+    valid  = []
+    for i in range(count):
+        assoc = codec.decode(frames[i * codec.nbytes:(i + 1) * codec.nbytes])
+        valid.append(bool(assoc))
+        for name in codec.names:
+            values[name].append(assoc.get(name, math.nan))
+    values["valid"] = valid
+    return values
+
+
+def sht40_frames(frames) -> dict:
+    return decode_frames(sht40.MEASURED_VALUES, frames)
+
+
+def sps30_frames(frames) -> dict:
+    return decode_frames(sps30.MEASURED_VALUES_FLOAT, frames)
+
+
+def sen5x_frames(frames, sensorType: str = "SEN55") -> dict:
+    if sensorType == "SEN55":
+        return decode_frames(sen5x.MEASURED_VALUES_SEN55, frames)
+    return decode_frames(sen5x.MEASURED_VALUES_SEN54, frames)
+
+
+# BMP280 temperature [°C] and pressure [Pa], same operation order as BMP280.calc_t/calc_p
+def bmp280_compensate(adc_t, adc_p, calib: dict) -> tuple:
+    if np is None:
+        scalar = BMP280.__new__(BMP280)    # formulas only, no I2C
+        scalar.calib_data = dict(calib)
+        result = [scalar.compensate(t, p) for t, p in zip(adc_t, adc_p)]
+        return [r[0] for r in result], [r[1] for r in result]
+
+    c = calib
+    adc_t = np.asarray(adc_t, dtype = np.float64)
+    adc_p = np.asarray(adc_p, dtype = np.float64)
+
+    var1 = ((adc_t / 16384.0) - (c['T1'] / 1024.0)) * c['T2']
+    var2 = ((adc_t / 131072.0) - (c['T1'] / 8192.0)) * ((adc_t / 131072.0) - (c['T1'] / 8192.0)) * c['T3']
+    t_fine = var1 + var2
+    t = (var1 + var2) / 5120.0
+
+    var1 = (t_fine / 2.0) - 64000.0
+    var2 = var1 * var1 * c['P6'] / 32768.0
+    var2 = var2 + var1 * c['P5'] * 2.0
+    var2 = (var2 / 4.0) + (c['P4'] * 65536.0)
+    var1 = (c['P3'] * var1 * var1 / 524288.0 + (c['P2'] * var1)) / 524288.0
+    var1 = (1.0 + (var1 / 32768.0)) * c['P1']
+    zero = var1 == 0
+    var1 = np.where(zero, 1.0, var1)
+    p = 1048576.0 - adc_p
+    p = (p - (var2 / 4096.0)) * 6250.0 / var1
+    var1 = c['P9'] * p * p / 2147483648.0
+    var2 = p * c['P8'] / 32768.0
+    p = p + (var1 + var2 + c['P7']) / 16.0
+    return t, np.where(zero, 0.0, p)
+
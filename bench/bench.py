@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+#
+# Microbenchmarks of decoder, CRC and upload serialization hot paths
+#
+#   python3 bench/bench.py                          # print results
+#   python3 bench/bench.py --save base.json         # store baseline
+#   python3 bench/bench.py --compare base.json      # exit 1 on regression
+#   python3 bench/bench.py --rev baseline --save legacy.json    # drivers of git revision
+#
+# Inputs are synthetic frames in bench/frames.json, generated by simulated devices
+# (i2c/sim.py), not recorded from hardware. Drivers run on simulated bus.
+# bench/baseline-legacy.json holds results of original drivers (--rev b04027f, before
+# shared CRC, frame codec and buffer reuse), --compare with it shows the gain.
+
+import io
+import os
+import sys
+import json
+import shutil
+import tarfile
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import importlib.util
+from time import perf_counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from i2c.sim import SimBus, VirtualSPS30, VirtualSEN5x, VirtualSHT40, VirtualBMP280
+from sensirion.crc import crc8, check_frame
+from sps30 import SPS30
+from sen5x import SEN5x
+from sht40 import SHT40
+from bmp280 import BMP280
+from sensorComm.sensorComm import sensorCommunity
+from TMEPcz.TMEPcz import TMEPcz
+
+FRAMES_FILE = os.path.join(BENCH_DIR, "frames.json")
+FRAMES_NOTE = "synthetic frames from simulated devices, not recorded from hardware"
+SIM_BUS     = 100       # bus number used for simulated devices
+
+DEFAULT_THRESHOLD = 0.20  # allowed slowdown against baseline
+DEFAULT_MIN_TIME  = 0.2   # seconds per measurement round
+DEFAULT_ROUNDS    = 5
+
+
+def load_frames(filename: str = FRAMES_FILE) -> dict:
+    with open(filename) as f:
+        frames = json.load(f)
+    for key in list(frames):
+        if key.startswith("_"):             # comments
+            del frames[key]
+        elif isinstance(frames[key], str):
+            frames[key] = bytes.fromhex(frames[key])
+    return frames
+
+
+def cases(frames: dict) -> dict:
+    bus = SimBus().install(SIM_BUS)
+    bus.attach(0x69, VirtualSPS30())
+    bus.attach(0x6A, VirtualSEN5x())
+    bus.attach(0x44, VirtualSHT40())
+    bus.attach(0x77, VirtualBMP280())
+
+    sps = SPS30(SIM_BUS, 0x69)
+    sen = SEN5x(SIM_BUS, 0x6A)
+    sht = SHT40(SIM_BUS, 0x44)
+    bmp = BMP280(SIM_BUS, 0x77)
+    bus.uninstall(SIM_BUS)
+    bmp.read_calib_data(list(frames["bmp280_calib"]))
+    bmp.calc_t(frames["bmp280_adc_t"])
+
+    sc = sensorCommunity("bench")
+    tmep = TMEPcz()
+    values = frames["sensors_values"]
+    tmep_qsv = ['pm10', 'pm2', 'h', 't', 'p']
+
+    sps_frame = frames["sps30_measured_values_float"]
+    sps_sn    = frames["sps30_serial_number"]
+    sen_frame = frames["sen5x_measured_values"]
+    sht_frame = frames["sht40_measurement"]
+    adc_t     = frames["bmp280_adc_t"]
+    adc_p     = frames["bmp280_adc_p"]
+
+    return {
+        "sps30.values_to_list":           lambda: sps.values_to_list(sps_frame),
+        "sps30.values_to_list[list]":     lambda: sps.values_to_list(list(sps_frame)),
+        "sen5x.values_to_list":           lambda: sen.values_to_list(sen_frame),
+        "sht40.values_to_list":           lambda: sht.values_to_list(sht_frame),
+        "bmp280.calc_t":                  lambda: bmp.calc_t(adc_t),
+        "bmp280.calc_p":                  lambda: bmp.calc_p(adc_p),
+        "bmp280.compensate":              lambda: bmp.compensate(adc_t, adc_p),
+        "crc.crc8":                       lambda: crc8(sps_frame),
+        "crc.check_frame[60]":            lambda: check_frame(sps_frame),
+        "crc.check_frame[48]":            lambda: check_frame(sps_sn),
+        "sps30.crc_calc":                 lambda: sps.crc_calc(sps_frame),
+        "sensorCommunity.create_json":    lambda: sc.create_json(values),
+        "TMEPcz.values_to_query_str":     lambda: tmep.values_to_query_str(tmep_qsv, dict(values))
+    }
+
+
+def load_source(root: str, path: str, name: str):
+    spec   = importlib.util.spec_from_file_location(name, os.path.join(root, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Same cases on drivers of git revision (e.g. before optimizations), objects are
+# created without I2C, cases missing in that revision are skipped
+def revision_cases(frames: dict, rev: str) -> dict:
+    root = tempfile.mkdtemp(prefix = "bench-")
+    try:
+        archive = subprocess.run(["git", "-C", os.path.dirname(BENCH_DIR), "archive", rev],
+                                 check = True, capture_output = True).stdout
+        with tarfile.open(fileobj = io.BytesIO(archive)) as tar:
+            tar.extractall(root)
+        mods = {name: load_source(root, path, f"rev_{name}") for name, path in (
+            ("sps30", "sps30.py"), ("sen5x", "sen5x.py"), ("sht40", "sht40.py"), ("bmp280", "bmp280.py"),
+            ("sc", "sensorComm/sensorComm.py"), ("tmep", "TMEPcz/TMEPcz.py"))}
+    finally:
+        shutil.rmtree(root)
+
+    sps = mods["sps30"].SPS30.__new__(mods["sps30"].SPS30)
+    sen = mods["sen5x"].SEN5x.__new__(mods["sen5x"].SEN5x)
+    sht = mods["sht40"].SHT40.__new__(mods["sht40"].SHT40)
+    bmp = mods["bmp280"].BMP280.__new__(mods["bmp280"].BMP280)
+    bmp.calib_data = dict.fromkeys(['T1', 'T2', 'T3'] + ['P' + str(i) for i in range(1, 10)], 0)
+    bmp.t_fine = 0
+    bmp.read_calib_data(list(frames["bmp280_calib"]))
+    bmp.calc_t(frames["bmp280_adc_t"])
+    sc = mods["sc"].sensorCommunity("bench")
+    tmep = mods["tmep"].TMEPcz()
+    values = frames["sensors_values"]
+    tmep_qsv = ['pm10', 'pm2', 'h', 't', 'p']
+
+    sps_frame = list(frames["sps30_measured_values_float"])
+    sen_frame = list(frames["sen5x_measured_values"])
+    sht_frame = list(frames["sht40_measurement"])
+    adc_t     = frames["bmp280_adc_t"]
+    adc_p     = frames["bmp280_adc_p"]
+
+    return {
+        "sps30.values_to_list":           lambda: sps.values_to_list(sps_frame),
+        "sps30.values_to_list[list]":     lambda: sps.values_to_list(list(sps_frame)),
+        "sen5x.values_to_list":           lambda: sen.values_to_list(sen_frame),
+        "sht40.values_to_list":           lambda: sht.values_to_list(sht_frame),
+        "bmp280.calc_t":                  lambda: bmp.calc_t(adc_t),
+        "bmp280.calc_p":                  lambda: bmp.calc_p(adc_p),
+        "sps30.crc_calc":                 lambda: sps.crc_calc(sps_frame),
+        "sensorCommunity.create_json":    lambda: sc.create_json(values),
+        "TMEPcz.values_to_query_str":     lambda: tmep.values_to_query_str(tmep_qsv, dict(values))
+    }
+
+
+# Best ops/s out of rounds, each round runs for at least min_time
+def ops_per_sec(func, min_time: float, rounds: int) -> float:
+    number = 1
+    while True:
+        start = perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = perf_counter() - start
+        if elapsed >= min_time / 10:
+            break
+        number *= 4
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    best = 0.0
+    for _ in range(rounds):
+        start = perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = perf_counter() - start
+        best = max(best, number / elapsed)
+    return best
+
+
+# Peak bytes allocated by one call, warm call first
+def alloc_bytes(func) -> int:
+    func()
+    tracemalloc.start()
+    try:
+        func()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+
+def run(selected: list = None, min_time: float = DEFAULT_MIN_TIME, rounds: int = DEFAULT_ROUNDS,
+        rev: str = None) -> dict:
+    results = {}
+    frames  = load_frames()
+    for name, func in (cases(frames) if rev is None else revision_cases(frames, rev)).items():
+        if selected and not any(s in name for s in selected):
+            continue
+        results[name] = {
+            "ops": round(ops_per_sec(func, min_time, rounds), 1),
+            "alloc": alloc_bytes(func)
+        }
+    return results
+
+
+# Return list of (name, baseline, result, reason) regressions
+def compare(results: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list:
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if res["ops"] < base["ops"] * (1 - threshold):
+            regressions.append((name, base, res, "ops/s"))
+        elif res["alloc"] > base["alloc"] * (1 + threshold) + 64:
+            regressions.append((name, base, res, "alloc"))
+    return regressions
+
+
+def report(results: dict, baseline: dict = None) -> None:
+    print(f"inputs: {FRAMES_NOTE}")
+    print(f"{'benchmark':<34} {'ops/s':>12} {'alloc B':>8} {'vs base':>8}")
+    for name, res in results.items():
+        ratio = ""
+        if baseline and name in baseline and baseline[name]["ops"]:
+            ratio = f"{res['ops'] / baseline[name]['ops']:.2f}x"
+        print(f"{name:<34} {res['ops']:>12.0f} {res['alloc']:>8} {ratio:>8}")
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="AirQmonitor microbenchmarks")
+    parser.add_argument("--save", metavar="FILE", help="save results as JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare with JSON baseline, exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed regression (0.2 = 20%%)")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME, help="seconds per round")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--rev", metavar="REV", help="benchmark drivers of git revision (e.g. baseline)")
+    parser.add_argument("filter", nargs="*", help="run benchmarks containing this text only")
+    args = parser.parse_args(argv)
+
+    results = run(args.filter, args.min_time, args.rounds, args.rev)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    report(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": sys.version.split()[0], "rev": args.rev or "HEAD",
+                       "inputs": FRAMES_NOTE, "results": results}, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, base, res, reason in regressions:
+            print(f"REGRESSION {name}: {reason} {base} -> {res}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
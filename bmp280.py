@@ -1,6 +1,7 @@
 import sys
 from time import sleep
 from i2c.i2c import I2C
+from sensirion.ready import DataReady, NotReady
 
 # I2C commands
 CMD_CALIB       = [0x88]
@@ -11,6 +12,10 @@ CMD_MEAS        = [0xF4]
 CMD_CONFIG      = [0xF5]
 CMD_PRESSURE    = [0xF7]
 CMD_TEMPERATURE = [0xFA]
+CMD_DATA        = [0xF7]    # burst read press_msb .. temp_xlsb
+
+RESET_VALUE     = 0xB6
+STATUS_MEASURING = 0b1000
 
 # Settings registers
 # Oversampling
@@ -53,11 +58,17 @@ MODE_NORMAL = 0b11 #defsult
 # Length of response in bytes
 NBYTES_CALIB   = 24
 NBYTES_TEMP_P  = 3
+NBYTES_DATA    = 6
+NBYTES_STATUS  = 2          # status + ctrl_meas
 NBYTES_LENGTH  = 1
 
 # Packet size
 CALIB_PACKET_SIZE  = 2
 
+# Timing [s]
+STARTUP_TIME   = 0.002
+POLL_DELAY     = 0.001
+
 class BMP280:
 
 # Init I2C BUS
@@ -84,52 +95,81 @@ class BMP280:
             'P8': 0,
             'P9': 0
         }
+        self.os_p = os_p
+        self.os_t = os_t
+        self.t_sb = t_sb
+        self.iir  = iir
+        self.mode = mode
         self.i2c  = I2C(bus, address)
+        # preallocated response buffers, reused by every ADC read
+        self.buf  = bytearray(NBYTES_TEMP_P)
+        self.data = bytearray(NBYTES_DATA)
+        self.status_buf = bytearray(NBYTES_STATUS)
+        self.data_ready = DataReady(self.measurement_done, 10 * self.measurement_time(),
+                                    min_delay = POLL_DELAY, max_delay = 4 * POLL_DELAY, lead = POLL_DELAY)
         self.type = "BMP280"
         self.sn   = self.device_id()
+        self.configure()
 
 # I2C commands BEGIN
     def device_id(self) -> int:
-        self.i2c.write(CMD_DEVICE_ID)
-        data = self.i2c.read(NBYTES_LENGTH)
+        data = self.i2c.transfer(CMD_DEVICE_ID, NBYTES_LENGTH)
         if (data[0] != 0x58):
             return False
         return data
 
     def reset(self) -> None:
-        self.i2c.write(CMD_RESET)
+        self.i2c.write(CMD_RESET + [RESET_VALUE])
+        sleep(STARTUP_TIME)
 
-    def set_meas_reg(self, os_p: int = OS_P_x1,
-                           os_t: int = OS_T_x1,
-                           mode: int = MODE_FORCED) -> None:
+    # Defaults are settings given to constructor
+    def set_meas_reg(self, os_p: int = None,
+                           os_t: int = None,
+                           mode: int = None) -> None:
+        os_p = self.os_p if os_p is None else os_p
+        os_t = self.os_t if os_t is None else os_t
+        mode = self.mode if mode is None else mode
         self.ctrl_meas_reg = mode + (os_p << 2) + (os_t << 5)
-        cmd = CMD_MEAS
-        cmd.extend([self.ctrl_meas_reg])
+        cmd = CMD_MEAS + [self.ctrl_meas_reg]
         self.i2c.write(cmd)
 
     def meas_reg(self) -> int:
-        self.i2c.write(CMD_MEAS)
-        return self.i2c.read(NBYTES_LENGTH)
+        return self.i2c.transfer(CMD_MEAS, NBYTES_LENGTH)
 
-    def set_ctrl_reg(self, iir: int = IIR_OFF,
-                           t_sb: int = T_SB_1000) -> None:
+    def set_ctrl_reg(self, iir: int = None,
+                           t_sb: int = None) -> None:
+        iir  = self.iir  if iir  is None else iir
+        t_sb = self.t_sb if t_sb is None else t_sb
         self.config_reg = 0b000 + (iir << 2) + (t_sb << 5)
-        cmd = CMD_CONFIG
-        cmd.extend([self.config_reg])
+        cmd = CMD_CONFIG + [self.config_reg]
         self.i2c.write(cmd)
 
     def ctrl_reg(self) -> int:
-        self.i2c.write(CMD_CONFIG)
-        return self.i2c.read(NBYTES_LENGTH)
+        return self.i2c.transfer(CMD_CONFIG, NBYTES_LENGTH)
 
     def calib_reg(self) -> list:
-        self.i2c.write(CMD_CALIB)
-        return self.i2c.read(NBYTES_CALIB)
+        return self.i2c.transfer(CMD_CALIB, NBYTES_CALIB)
 
     def temp_press_reg(self, cmd: int = CMD_TEMPERATURE) -> int:
-        self.i2c.write(cmd)
-        data = self.i2c.read(NBYTES_TEMP_P)
+        data = self.buf
+        self.i2c.transfer_into(cmd, data)
         return (data[0] << 16 | data[1] << 8 | data[2]) >> 4
+
+    # Pressure and temperature ADC in one 6-byte burst (same conversion, datasheet 3.9)
+    def read_adc(self) -> tuple:
+        data = self.data
+        self.i2c.transfer_into(CMD_DATA, data)
+        adc_p = (data[0] << 16 | data[1] << 8 | data[2]) >> 4
+        adc_t = (data[3] << 16 | data[4] << 8 | data[5]) >> 4
+        return adc_t, adc_p
+
+    # Conversion finished: status.measuring clear and (forced mode) back in sleep mode
+    def measurement_done(self) -> bool:
+        status = self.status_buf
+        self.i2c.transfer_into(CMD_STATUS, status)
+        if status[0] & STATUS_MEASURING:
+            return False
+        return self.mode != MODE_FORCED or (status[1] & 0b11) == MODE_SLEEP
 # I2C commands END
 #
 # Helper functions BEGIN
@@ -151,9 +191,21 @@ class BMP280:
             i = i + 1
         return self.calib_data
 
+    # Calibration of previous run is reused if T1..T3 words (6 bytes) still match,
+    # otherwise whole calibration is read. Captured bus always gets whole read, replay
+    # (replay/replay.py) needs calibration in the log. Returns calibration for cache
+    def load_calib(self, cached: dict = None) -> dict:
+        if cached and set(self.calib_data) <= set(cached) and not self.i2c.captured():
+            data = self.i2c.transfer(CMD_CALIB, 3 * CALIB_PACKET_SIZE)
+            words = [(data[i+1] << 8 | data[i]) for i in range(0, len(data), CALIB_PACKET_SIZE)]
+            if words == [cached['T1'], cached['T2'] & 0xFFFF, cached['T3'] & 0xFFFF]:
+                self.calib_data.update(cached)
+                return dict(self.calib_data)
+        return dict(self.read_calib_data(self.calib_reg()))
+
     def calc_t(self, adc_t: int) -> float:
         var1 = ((adc_t / 16384.0) - (self.calib_data['T1'] / 1024.0)) * self.calib_data['T2']
-        var2 = ((adc_t / 131072.0) - (self.calib_data['T1'] / 8192.0)) * ((adc_t / 131072.0) - (self.calib_data['T2'] / 8192.0)) * self.calib_data['T3']
+        var2 = ((adc_t / 131072.0) - (self.calib_data['T1'] / 8192.0)) * ((adc_t / 131072.0) - (self.calib_data['T1'] / 8192.0)) * self.calib_data['T3']
         self.t_fine = var1 + var2
         return (var1+var2) / 5120.0
 
@@ -173,22 +225,55 @@ class BMP280:
         p += (var1 + var2 + self.calib_data['P7']) / 16.0
         return p
 
+    # Temperature [°C] and pressure [Pa] of one conversion
+    def compensate(self, adc_t: int, adc_p: int) -> tuple:
+        t = self.calc_t(adc_t)
+        return t, self.calc_p(adc_p)
+
+    # Max measurement time [s], datasheet 3.8.1
+    def measurement_time(self) -> float:
+        samples = lambda os: 0 if os == OS_T_NONE else 1 << (min(os, OS_T_x16) - 1)
+        t_meas = 1.25 + 2.3 * samples(self.os_t)
+        if self.os_p != OS_P_NONE:
+            t_meas += 2.3 * samples(self.os_p) + 0.575
+        return t_meas / 1000
+
 # Helper functions END
 #
 # Main functions
+    # Write config in sleep mode (datasheet 5.4.6), normal mode starts continuous sampling
+    def configure(self) -> None:
+        self.set_meas_reg(mode = MODE_SLEEP)
+        self.set_ctrl_reg()
+        if self.mode == MODE_NORMAL:
+            self.set_meas_reg()
+            self.data_ready.start()
+            self.data_ready.wait()
+
+    # Forced mode: trigger one conversion and poll status until done
+    # Normal mode: registers hold latest conversion
+    def measure(self) -> tuple:
+        if self.mode == MODE_FORCED:
+            self.set_meas_reg()
+            self.data_ready.start()
+            ready = self.data_ready.wait()
+            if not ready:
+                return ready
+        return self.compensate(*self.read_adc())
+
     def temperature(self) -> float:
-        return self.calc_t(self.temp_press_reg())
+        return self.calc_t(self.read_adc()[0])
 
     def pressure(self) -> float:
-        self.calc_t(self.temp_press_reg())
-        return self.calc_p(self.temp_press_reg(CMD_PRESSURE))
+        return self.compensate(*self.read_adc())[1]
 
     def values_to_list(self) -> dict:
-        self.set_meas_reg()
-        sleep(0.01)
+        res = self.measure()
+        if not res:
+            return {}
         assoc = {
-              "t1": self.temperature(),
-              "p": self.pressure()
+              "t1": res[0],
+              "p": res[1]
         }
         return assoc
 
@@ -0,0 +1,58 @@
+import os
+import json
+import threading
+
+# Device identity / calibration cache
+#
+# Product type, serial number, firmware and BMP280 calibration do not change while
+# the same device is connected. They are kept per bus and address and revalidated
+# by one short read at startup instead of reading everything again.
+#
+#   cache = DeviceCache("/home/pi/AirQmonitor/devices.json")
+#   sps_sensor = SPS30(3, cached = cache.get(3, 0x69))
+#   cache.put(3, 0x69, sps_sensor.identity())
+#   bmp_sensor.load_calib(cache.get(4, 0x77).get("calib"))
+#   cache.save()
+
+
+class DeviceCache:
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.entries  = {}      # "bus:address" -> dict
+        self.dirty    = False
+        self.lock     = threading.Lock()
+        try:
+            with open(filename) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}   # missing or corrupt cache, devices are read again
+
+    def key(self, bus: int, address: int) -> str:
+        return f"{bus}:{address:#04x}"
+
+    def get(self, bus: int, address: int) -> dict:
+        with self.lock:
+            return dict(self.entries.get(self.key(bus, address), {}))
+
+    # Merge entry, saved on next save() only if something changed
+    def put(self, bus: int, address: int, entry: dict) -> None:
+        key = self.key(bus, address)
+        with self.lock:
+            merged = dict(self.entries.get(key, {}))
+            merged.update(entry)
+            if merged != self.entries.get(key):
+                self.entries[key] = merged
+                self.dirty = True
+
+    # Atomic write (tmp + rename)
+    def save(self) -> bool:
+        with self.lock:
+            if not self.dirty:
+                return False
+            tmp = self.filename + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f, indent = 1)
+            os.replace(tmp, self.filename)
+            self.dirty = False
+            return True
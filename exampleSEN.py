@@ -1,7 +1,9 @@
 import sys
 import json
 import atexit
-from time import sleep
+import signal
+import threading
+from time import sleep, monotonic
 
 from sen5x import SEN5x
 from bmp280 import BMP280
@@ -12,6 +14,8 @@ PERIOD = 3  #seconds
 
 SEN_BUS = 4                 # SEN54 i2c bus
 SEN_AUTO_CLEANING_DAYS = 5  # set auto cleaning interval to 5 days
+SEN_STATE_DIR = "."         # VOC algorithm state snapshots, restored on start
+SEN_STATE_INTERVAL = 300    # [s] periodic VOC algorithm state snapshot
 
 BME_BUS = 4
 
@@ -27,11 +31,17 @@ if __name__ == "__main__":
 # Stop measurement before exit
     def sen_stop():
         print("===========  EXIT  ===========")
-        sen_sensor.stop_measurement_and_close()
+        sen_sensor.stop_measurement_and_close()    # saves VOC algo state
     atexit.register(sen_stop)
 
+# Save VOC algo state on SIGUSR2 (AirQmonitorCron.sh), I2C is not touched from signal handler
+    def sigusr2_handler(signum, frame):
+        print("===========  SAVE VOC ALGO STATE  ===========")
+        threading.Thread(target=sen_sensor.save_voc_state).start()
+    signal.signal(signal.SIGUSR2, sigusr2_handler)
+
 # Init SEN class, set i2c bus
-    sen_sensor = SEN5x(SEN_BUS)
+    sen_sensor = SEN5x(SEN_BUS, state_dir=SEN_STATE_DIR)
     sc = sensorCommunity(SC_SENSOR_ID)
 
 # print some info
@@ -46,6 +56,9 @@ if __name__ == "__main__":
     print(f"SEN VOC Algo Tunning param    : {sen_sensor.read_voc_tunning_param()}")
     print(f"SEN Thermo compens param      : {sen_sensor.read_thermo_compensation_param()}")
 
+# Restore VOC algo state of previous run (idle mode only, before start)
+    print(f"SEN VOC algo state restored   : {sen_sensor.restore_voc_state()} s old")
+
 # Start SEN54 meaasurement
     sen_sensor.start_measurement()
     print(f"SEN data                      : {sen_sensor.read_measurement()}")
@@ -56,6 +69,7 @@ if __name__ == "__main__":
     print("===========  LOOP  ===========")
 
 # Load all values in one list/dist and print (or use according to your discretion)
+    last_state = monotonic()
     while True:
         try:
             sensors_values = dist(bmp_sensor.read_values())
@@ -68,6 +82,10 @@ if __name__ == "__main__":
 
             print(json.dumps(sensors_values, indent=2))
 
+            if monotonic() - last_state >= SEN_STATE_INTERVAL:
+                sen_sensor.save_voc_state()
+                last_state = monotonic()
+
             sleep(PERIOD*60)
 
         except KeyboardInterrupt:
@@ -0,0 +1,108 @@
+import os
+import sys
+import builtins
+import _tracemalloc
+from time import perf_counter
+
+# Memory and startup footprint
+#
+#   from footprint.footprint import footprint
+#   footprint.start()                   # first import of main script
+#   ...                                 # imports, setup
+#   footprint.stop_imports()
+#   for line in footprint.report_lines(): print(line)
+#
+# Import times are collected like python3 -X importtime (self / cumulative per
+# module, nested imports included). Python heap is traced only when started with
+# python3 -X tracemalloc (tracing itself costs memory and CPU), tracemalloc module
+# (with pickle, fnmatch, linecache, ~15 ms) is imported only then.
+
+TOP = 10
+
+
+# (current, peak) resident set size [B], /proc on Linux, peak only elsewhere
+def rss() -> tuple:
+    try:
+        values = {}
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":")
+                    values[key] = int(value.split()[0]) * 1024
+        return values["VmRSS"], values["VmHWM"]
+    except (OSError, KeyError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return peak, peak
+
+
+class Footprint:
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.imports = []       # (module, self [s], cumulative [s], depth)
+        self.stack   = []       # time spent in nested imports of running imports
+        self.orig    = None
+
+    # Hook __import__, imports running in other threads during start are attributed
+    # to whatever import is on stack
+    def start(self) -> None:
+        self.started = perf_counter()
+        if self.orig is None:
+            self.orig = builtins.__import__
+            builtins.__import__ = self.hook
+
+    def stop_imports(self) -> None:
+        if self.orig is not None:
+            builtins.__import__ = self.orig
+            self.orig = None
+
+    def hook(self, name, globals = None, locals = None, fromlist = (), level = 0):
+        if level or name in sys.modules:
+            return self.orig(name, globals, locals, fromlist, level)
+        depth = len(self.stack)
+        self.stack.append(0.0)
+        start = perf_counter()
+        try:
+            return self.orig(name, globals, locals, fromlist, level)
+        finally:
+            total  = perf_counter() - start
+            nested = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += total
+            self.imports.append((name, total - nested, total, depth))
+
+    def top_imports(self, n: int = TOP, top_level: bool = True) -> list:
+        imports = [i for i in self.imports if i[3] == 0] if top_level else self.imports
+        return sorted(imports, key = lambda i: i[2], reverse = True)[:n]
+
+    def report(self) -> dict:
+        current, peak = rss()
+        result = {
+            "uptime":   perf_counter() - self.started,
+            "modules":  len(sys.modules),
+            "rss":      current,
+            "rss_peak": peak,
+            "import":   sum(i[2] for i in self.imports if i[3] == 0)
+        }
+        if _tracemalloc.is_tracing():
+            result["traced"], result["traced_peak"] = _tracemalloc.get_traced_memory()
+        return result
+
+    def report_lines(self, n: int = TOP) -> list:
+        r = self.report()
+        lines = [f"Footprint: RSS {r['rss'] >> 10} kB (peak {r['rss_peak'] >> 10} kB), "
+                 f"{r['modules']} modules, imports {r['import'] * 1000:.1f} ms, "
+                 f"startup {r['uptime']:.2f} s"]
+        for name, own, total, depth in self.top_imports(n):
+            lines.append(f"  import {own * 1e6:8.0f} | {total * 1e6:8.0f} us | {name}")
+        if _tracemalloc.is_tracing():
+            import tracemalloc
+            lines.append(f"  python heap {r['traced'] >> 10} kB (peak {r['traced_peak'] >> 10} kB)")
+            for stat in tracemalloc.take_snapshot().statistics("filename")[:n]:
+                lines.append(f"  {stat.size >> 10:6} kB | {stat.traceback[0].filename}")
+        return lines
+
+
+# Footprint of the process
+footprint = Footprint()
@@ -0,0 +1,146 @@
+import threading
+import http.client
+from collections import namedtuple
+from urllib.parse import urlsplit
+from time import monotonic
+
+# Keep-alive HTTP(S) connection pool
+#
+# Connections are kept open per (scheme, host, port) and reused across requests,
+# so repeated uploads to the same API pay TCP+TLS handshake once.
+#
+#   pool = get_pool()
+#   resp = pool.request("POST", "https://api.sensor.community/v1/push-sensor-data/", body, headers)
+#   resp.status, resp.body, pool.stats()
+
+DEFAULT_TIMEOUT  = 10     # [s]
+DEFAULT_MAX_IDLE = 50     # [s] idle connection older than this is not reused
+
+Response = namedtuple('Response', ['status', 'reason', 'headers', 'body', 'latency', 'reused'])
+
+# Errors of reused connection closed by server, request is repeated on new connection
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+
+class HTTPPool:
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT, max_idle: float = DEFAULT_MAX_IDLE,
+                       max_per_host: int = 2):
+        self.timeout      = timeout
+        self.max_idle     = max_idle
+        self.max_per_host = max_per_host
+        self.idle         = {}      # (scheme, host, port) -> [(connection, last used)]
+        self.host_stats   = {}      # host -> counters
+        self.lock         = threading.Lock()
+
+    def key(self, url: str) -> tuple:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        return (parts.scheme, parts.hostname, port), path
+
+    def connect(self, key: tuple, timeout: float):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout = timeout)
+        return http.client.HTTPConnection(host, port, timeout = timeout)
+
+    # Idle connection or None
+    def checkout(self, key: tuple):
+        now = monotonic()
+        with self.lock:
+            conns = self.idle.get(key, [])
+            while conns:
+                conn, used = conns.pop()
+                if now - used <= self.max_idle:
+                    return conn
+                conn.close()
+        return None
+
+    def checkin(self, key: tuple, conn) -> None:
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_per_host:
+                conns.append((conn, monotonic()))
+                return
+        conn.close()
+
+    def count(self, host: str, **values) -> None:
+        with self.lock:
+            stats = self.host_stats.setdefault(host, {
+                "requests": 0, "reused": 0, "connects": 0, "errors": 0,
+                "latency_sum": 0.0, "latency_max": 0.0, "latency_last": 0.0
+            })
+            for name, value in values.items():
+                if name == "latency":
+                    stats["latency_sum"] += value
+                    stats["latency_last"] = value
+                    stats["latency_max"] = max(stats["latency_max"], value)
+                else:
+                    stats[name] += value
+
+    def request(self, method: str, url: str, body: bytes = None, headers: dict = None,
+                      timeout: float = None) -> Response:
+        key, path = self.key(url)
+        timeout = self.timeout if timeout is None else timeout
+        headers = dict(headers or {})
+        start = monotonic()
+
+        conn = self.checkout(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self.connect(key, timeout)
+                self.count(key[1], connects = 1)
+            elif conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request(method, path, body, headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                break
+            except STALE_ERRORS:
+                conn.close()
+                if not reused:
+                    self.count(key[1], requests = 1, errors = 1)
+                    raise
+                conn, reused = None, False
+            except Exception:
+                conn.close()
+                self.count(key[1], requests = 1, errors = 1)
+                raise
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self.checkin(key, conn)
+        latency = monotonic() - start
+        self.count(key[1], requests = 1, reused = int(reused), latency = latency)
+        return Response(resp.status, resp.reason, dict(resp.getheaders()), data, latency, reused)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {host: dict(values) for host, values in self.host_stats.items()}
+
+    def close(self) -> None:
+        with self.lock:
+            for conns in self.idle.values():
+                for conn, used in conns:
+                    conn.close()
+            self.idle = {}
+
+
+# Pool shared by all uploaders of the process
+pool      = None
+pool_lock = threading.Lock()
+
+
+def get_pool() -> HTTPPool:
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = HTTPPool()
+        return pool
@@ -0,0 +1,128 @@
+import struct
+import threading
+from time import time, monotonic
+from i2c.i2c import wrap_transport, release_bus
+
+# Raw I2C traffic capture
+#
+#   capture = Capture("/home/pi/AirQmonitor/i2c.cap")
+#   capture.install(3)          # before drivers of bus 3 are created
+#   sps_sensor = SPS30(3)
+#   ...
+#   capture.close()
+#
+# Every transaction is appended to binary log, see replay/replay.py to decode it.
+# Log: MAGIC, then records of REC header + command bytes + response bytes
+#   wall time [s], monotonic time [s], bus, address, op, command length, response length
+# Command of plain read is last command written to the same address (e.g. SHT40
+# measure command followed by read after conversion time).
+
+MAGIC = b'AQCAP1\n'
+REC   = struct.Struct('<ddBBBBH')
+
+OP_WRITE    = 0
+OP_READ     = 1
+OP_TRANSFER = 2
+
+
+class CaptureTransport:
+
+    def __init__(self, transport, capture, bus: int):
+        self.transport = transport
+        self.capture   = capture
+        self.bus       = bus
+        self.last_cmd  = {}     # address -> last written command
+
+    @property
+    def capturing(self) -> bool:
+        return self.capture.file is not None
+
+    def write(self, address: int, data: list) -> None:
+        self.transport.write(address, data)
+        self.last_cmd[address] = bytes(data)
+        self.capture.record(self.bus, address, OP_WRITE, self.last_cmd[address], b'')
+
+    def readinto(self, address: int, buf) -> int:
+        nbytes = self.transport.readinto(address, buf)
+        self.capture.record(self.bus, address, OP_READ, self.last_cmd.get(address, b''), buf)
+        return nbytes
+
+    def transfer_into(self, address: int, data: list, buf) -> int:
+        nbytes = self.transport.transfer_into(address, data, buf)
+        self.capture.record(self.bus, address, OP_TRANSFER, bytes(data), buf)
+        return nbytes
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class Capture:
+
+    # writes - log plain writes (commands without response) too
+    def __init__(self, filename: str, writes: bool = True):
+        self.filename = filename
+        self.writes   = writes
+        self.records  = 0
+        self.handles  = []
+        self.lock     = threading.Lock()
+        self.file     = open(filename, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    # Wrap transport of bus number, drivers created afterwards are captured
+    # Transport of closed capture is replaced, that of open one is kept
+    def install(self, number: int) -> CaptureTransport:
+        def wrap(transport):
+            if isinstance(transport, CaptureTransport):
+                if transport.capturing:
+                    return transport
+                transport = transport.transport
+            return CaptureTransport(transport, self, number)
+        handle = wrap_transport(number, wrap)
+        self.handles.append(handle)
+        return handle.transport
+
+    def record(self, bus: int, address: int, op: int, cmd: bytes, data) -> None:
+        if op == OP_WRITE and not self.writes:
+            return
+        header = REC.pack(time(), monotonic(), bus, address, op, len(cmd), len(data))
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(header)
+            self.file.write(cmd)
+            self.file.write(data)
+            self.records += 1
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    # Captured buses keep working, traffic is no longer logged
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        for handle in self.handles:
+            release_bus(handle)
+        self.handles = []
+
+
+# Yields (wall, mono, bus, address, op, cmd, data) from log bytes
+def records(log: bytes, offset: int = None, end: int = None):
+    if offset is None:
+        if log[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a capture log")
+        offset = len(MAGIC)
+    end = len(log) if end is None else end
+    while offset + REC.size <= end:
+        wall, mono, bus, address, op, ncmd, ndata = REC.unpack_from(log, offset)
+        offset += REC.size
+        if offset + ncmd + ndata > end:
+            break                   # torn tail record
+        cmd  = log[offset:offset + ncmd]
+        data = log[offset + ncmd:offset + ncmd + ndata]
+        offset += ncmd + ndata
+        yield wall, mono, bus, address, op, cmd, data
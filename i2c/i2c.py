@@ -1,26 +1,238 @@
-import io
-from fcntl import ioctl
-
-I2C_SLAVE = 0x0703
-
-
-class I2C:
-
-    def __init__(self, bus: int, address: int):
-
-        self.fr = io.open("/dev/i2c-"+str(bus), "rb", buffering=0)
-        self.fw = io.open("/dev/i2c-"+str(bus), "wb", buffering=0)
-
-        # set device address
-        ioctl(self.fr, I2C_SLAVE, address)
-        ioctl(self.fw, I2C_SLAVE, address)
-
-    def write(self, data: list):
-        self.fw.write(bytearray(data))
-
-    def read(self, nbytes: int) -> list:
-        return list(self.fr.read(nbytes))
-
-    def close(self):
-        self.fw.close()
-        self.fr.close()
+import io
+import ctypes
+import threading
+from time import sleep
+from fcntl import ioctl
+
+I2C_SLAVE = 0x0703
+I2C_RDWR  = 0x0707
+
+# i2c_msg flags
+I2C_M_RD  = 0x0001
+
+
+# struct i2c_msg from <linux/i2c.h>
+class i2c_msg(ctypes.Structure):
+    _fields_ = [
+        ('addr',  ctypes.c_uint16),
+        ('flags', ctypes.c_uint16),
+        ('len',   ctypes.c_uint16),
+        ('buf',   ctypes.POINTER(ctypes.c_uint8))
+    ]
+
+
+# struct i2c_rdwr_ioctl_data from <linux/i2c-dev.h>
+class i2c_rdwr_ioctl_data(ctypes.Structure):
+    _fields_ = [
+        ('msgs',  ctypes.POINTER(i2c_msg)),
+        ('nmsgs', ctypes.c_uint32)
+    ]
+
+
+# Bus manager
+#
+# One shared Bus handle (one transport / file descriptor) per bus number, handed
+# to drivers by get_bus(). Transactions on a bus are serialized by its FIFO lock,
+# device address is selected per transaction.
+# Bus with custom transport (e.g. simulated bus, see i2c/sim.py) is registered by
+# set_transport(), other buses are opened as /dev/i2c-N on first use.
+buses         = {}
+registry_lock = threading.Lock()
+
+
+class BusLock:
+
+    # Lock granted in arrival order (ticket lock), re-entrant only for nesting
+    # within one call chain (transaction() around write/read). Signal handlers
+    # must not do I2C, they run on thread that may be holding or waiting for
+    # the lock - hand the work to a thread instead.
+    def __init__(self):
+        self.cond    = threading.Condition(threading.RLock())
+        self.ticket  = 0
+        self.serving = 0
+        self.owner   = None
+        self.depth   = 0
+        self.waiting = 0
+
+    def acquire(self) -> None:
+        me = threading.get_ident()
+        with self.cond:
+            if self.owner == me:
+                self.depth += 1
+                return
+            ticket = self.ticket
+            self.ticket += 1
+            self.waiting += 1
+            while ticket != self.serving:
+                self.cond.wait()
+            self.waiting -= 1
+            self.owner = me
+            self.depth = 1
+
+    def release(self) -> None:
+        with self.cond:
+            self.depth -= 1
+            if self.depth == 0:
+                self.owner = None
+                self.serving += 1
+                self.cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class Bus:
+
+    def __init__(self, number: int, transport, own: bool = True):
+        self.number    = number
+        self.transport = transport
+        self.own       = own
+        self.lock      = BusLock()
+        self.users     = 0
+
+
+def get_bus(number: int) -> Bus:
+    with registry_lock:
+        if number not in buses:
+            buses[number] = Bus(number, LinuxBus(number))
+        bus = buses[number]
+        bus.users += 1
+        return bus
+
+
+def release_bus(bus: Bus) -> None:
+    with registry_lock:
+        bus.users -= 1
+        if bus.users <= 0 and bus.own:
+            bus.transport.close()
+            if buses.get(bus.number) is bus:
+                del buses[bus.number]
+
+
+def set_transport(number: int, transport) -> None:
+    with registry_lock:
+        buses[number] = Bus(number, transport, own = False)
+
+
+def remove_transport(number: int) -> None:
+    with registry_lock:
+        if number in buses and not buses[number].own:
+            del buses[number]
+
+
+# Replace transport of bus by wrap(transport) (capture, metrics), drivers created
+# afterwards use wrapped transport. Returned handle is released by release_bus().
+def wrap_transport(number: int, wrap) -> Bus:
+    bus = get_bus(number)
+    with registry_lock:
+        bus.transport = wrap(bus.transport)
+    return bus
+
+
+# Transport interface:
+#   write(address, data)
+#   readinto(address, buf) -> int
+#   transfer_into(address, data, buf) -> int
+#   close()
+class LinuxBus:
+
+    def __init__(self, bus: int):
+        self.bus     = bus
+        self.address = None
+
+        # one file descriptor for both directions
+        self.fd = io.open("/dev/i2c-"+str(bus), "r+b", buffering=0)
+
+        # reused I2C_RDWR request [write, read]
+        self.msgs  = (i2c_msg * 2)()
+        self.rdwr  = i2c_rdwr_ioctl_data(self.msgs, 2)
+        self.msgs[0].flags = 0
+        self.msgs[1].flags = I2C_M_RD
+
+    # set device address for plain read()/write()
+    def select(self, address: int) -> None:
+        if address != self.address:
+            ioctl(self.fd, I2C_SLAVE, address)
+            self.address = address
+
+    def write(self, address: int, data: list) -> None:
+        self.select(address)
+        self.fd.write(bytearray(data))
+
+    # Read len(buf) bytes into writable buffer (bytearray/memoryview), no allocation
+    def readinto(self, address: int, buf) -> int:
+        self.select(address)
+        return self.fd.readinto(buf)
+
+    # Write command and read len(buf) bytes into buf in one I2C_RDWR ioctl (repeated start)
+    def transfer_into(self, address: int, data: list, buf) -> int:
+        wbuf = (ctypes.c_uint8 * len(data))(*data)
+        rbuf = (ctypes.c_uint8 * len(buf)).from_buffer(buf)
+        self.msgs[0].addr = address
+        self.msgs[0].len  = len(data)
+        self.msgs[0].buf  = wbuf
+        self.msgs[1].addr = address
+        self.msgs[1].len  = len(buf)
+        self.msgs[1].buf  = rbuf
+        ioctl(self.fd, I2C_RDWR, self.rdwr)
+        return len(buf)
+
+    def close(self) -> None:
+        self.fd.close()
+
+
+class I2C:
+
+    def __init__(self, bus: int, address: int):
+        self.bus       = bus
+        self.address   = address
+        self.handle    = get_bus(bus)
+        self.transport = self.handle.transport
+        self.lock      = self.handle.lock
+
+    # Hold the bus for several operations: with i2c.transaction(): ...
+    def transaction(self) -> BusLock:
+        return self.lock
+
+    # Traffic is logged by i2c/capture.py (installed before driver was created)
+    def captured(self) -> bool:
+        return getattr(self.transport, "capturing", False)
+
+    def write(self, data: list):
+        with self.lock:
+            self.transport.write(self.address, data)
+
+    # Read len(buf) bytes into writable buffer (bytearray/memoryview), no allocation
+    def readinto(self, buf) -> int:
+        with self.lock:
+            return self.transport.readinto(self.address, buf)
+
+    # Write command and read len(buf) bytes into buf in one transaction (repeated start)
+    # delay - command execution time [s], response is read after it by separate read
+    #         (device NACKs read straight after command), bus is held meanwhile
+    def transfer_into(self, data: list, buf, delay: float = 0) -> int:
+        with self.lock:
+            if not delay:
+                return self.transport.transfer_into(self.address, data, buf)
+            self.transport.write(self.address, data)
+            sleep(delay)
+            return self.transport.readinto(self.address, buf)
+
+    def read(self, nbytes: int) -> list:
+        buf = bytearray(nbytes)
+        self.readinto(buf)
+        return list(buf)
+
+    def transfer(self, data: list, nbytes: int, delay: float = 0) -> list:
+        buf = bytearray(nbytes)
+        self.transfer_into(data, buf, delay)
+        return list(buf)
+
+    def close(self):
+        if self.handle is not None:
+            release_bus(self.handle)
+            self.handle = None
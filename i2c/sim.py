@@ -0,0 +1,480 @@
+import errno
+import random
+import struct
+from time import sleep, monotonic
+from i2c.i2c import set_transport, remove_transport
+from sensirion.crc import add_crc, check_frame, PACKET_SIZE
+
+# Simulated I2C bus with virtual SPS30, SEN5x, SHT40 and BMP280
+#
+#   bus = SimBus(latency = 0.001)
+#   bus.attach(0x69, VirtualSPS30())
+#   bus.install(3)              # SPS30(3) now talks to the virtual device
+#
+# Virtual devices answer the command sets used by sps30.py, sen5x.py, sht40.py and
+# bmp280.py with CRC-correct frames. Not connected address / not ready data is NACKed
+# with OSError(EREMOTEIO) as on real bus.
+
+
+def nack(msg: str) -> OSError:
+    return OSError(errno.EREMOTEIO, msg)
+
+
+class SimBus:
+
+    def __init__(self, latency: float = 0.0):
+        self.devices      = {}
+        self.latency      = latency
+        self.transactions = 0
+
+    def attach(self, address: int, device):
+        self.devices[address] = device
+        return device
+
+    def detach(self, address: int) -> None:
+        self.devices.pop(address, None)
+
+    # Register as transport of bus number, I2C(bus, ...) then uses this bus
+    def install(self, bus: int):
+        set_transport(bus, self)
+        return self
+
+    def uninstall(self, bus: int) -> None:
+        remove_transport(bus)
+
+    def device(self, address: int):
+        self.transactions += 1
+        if self.latency:
+            sleep(self.latency)
+        if address not in self.devices:
+            raise nack("No device at 0x%02x" % address)
+        return self.devices[address]
+
+    def write(self, address: int, data: list) -> None:
+        self.device(address).write(bytes(data))
+
+    def readinto(self, address: int, buf) -> int:
+        buf[:] = self.device(address).read(len(buf))
+        return len(buf)
+
+    def transfer_into(self, address: int, data: list, buf) -> int:
+        dev = self.device(address)
+        dev.write(bytes(data))
+        buf[:] = dev.read(len(buf))
+        return len(buf)
+
+    def close(self) -> None:
+        pass
+
+
+class VirtualDevice:
+
+    def __init__(self, clock = monotonic):
+        self.clock    = clock
+        self.response = b''
+
+    def write(self, data: bytes) -> None:
+        pass
+
+    # Idle lines read as 0xFF
+    def read(self, nbytes: int) -> bytes:
+        data = self.response[:nbytes]
+        return data + b'\xff' * (nbytes - len(data))
+
+
+# Sensirion devices with 16 bit commands and CRC protected words
+class SensirionDevice(VirtualDevice):
+
+    def __init__(self, crc_error_rate: float = 0.0, seed: int = None, clock = monotonic):
+        super().__init__(clock)
+        self.commands       = {}
+        self.crc_error_rate = crc_error_rate
+        self.crc_errors     = 0
+        self.random         = random.Random(seed)
+
+    # Corrupt CRC of next count response words
+    def inject_crc_errors(self, count: int = 1) -> None:
+        self.crc_errors += count
+
+    def frame(self, payload: bytes) -> bytes:
+        data = bytearray(add_crc(payload))
+        for i in range(2, len(data), PACKET_SIZE):
+            if self.crc_errors > 0:
+                self.crc_errors -= 1
+                data[i] ^= 0xFF
+            elif self.crc_error_rate and self.random.random() < self.crc_error_rate:
+                data[i] ^= 0xFF
+        return bytes(data)
+
+    def write(self, data: bytes) -> None:
+        if len(data) < 2:
+            raise nack("Incomplete command")
+        cmd  = data[0] << 8 | data[1]
+        args = data[2:]
+        if cmd not in self.commands:
+            raise nack("Unknown command 0x%04x" % cmd)
+        if args and check_frame(args):
+            raise nack("CRC mismatch in command 0x%04x" % cmd)
+        payload = self.commands[cmd](bytes(b for i, b in enumerate(args) if i % PACKET_SIZE != 2))
+        self.response = self.frame(payload) if payload is not None else b''
+
+    def string(self, text: str, nbytes: int = 32) -> bytes:
+        return text.encode('ascii').ljust(nbytes, b'\x00')
+
+
+# SPS30/SEN5x measurement and data-ready timing
+class SensirionPMDevice(SensirionDevice):
+
+    def __init__(self, ready_interval: float = 1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.ready_interval   = ready_interval
+        self.measuring        = False
+        self.last_read        = 0.0
+        self.reads_not_ready  = 0
+        self.cleaning_until   = 0.0
+        self.status           = 0
+        self.auto_cleaning    = 604800
+        self.commands.update({
+            0x0104: self.cmd_stop,
+            0x0202: self.cmd_data_ready,
+            0x5607: self.cmd_fan_cleaning,
+            0x8004: self.cmd_auto_cleaning,
+            0xD206: lambda args: struct.pack('>I', self.status),
+            0xD210: self.cmd_clear_status,
+            0xD304: self.cmd_stop
+        })
+
+    def data_ready(self) -> bool:
+        return self.measuring and self.clock() - self.last_read >= self.ready_interval
+
+    def start(self) -> None:
+        self.measuring = True
+        self.last_read = self.clock()
+
+    def cmd_stop(self, args: bytes) -> None:
+        self.measuring = False
+
+    def cmd_data_ready(self, args: bytes) -> bytes:
+        return bytes([0x00, 0x01 if self.data_ready() else 0x00])
+
+    def measured(self) -> None:
+        if not self.data_ready():
+            self.reads_not_ready += 1
+        self.last_read = self.clock()
+
+    def cmd_fan_cleaning(self, args: bytes) -> None:
+        self.cleaning_until = self.clock() + 10
+
+    def cmd_auto_cleaning(self, args: bytes) -> bytes:
+        if args:
+            self.auto_cleaning = struct.unpack('>I', args[:4])[0]
+            return None
+        return struct.pack('>I', self.auto_cleaning)
+
+    def cmd_clear_status(self, args: bytes) -> None:
+        self.status = 0
+
+
+class VirtualSPS30(SensirionPMDevice):
+
+    DEFAULT_VALUES = {
+        "pm1":  1.285,
+        "pm2":  5.262,
+        "pm4":  9.045,
+        "pm10": 10.969,
+        "nc0":  1.5,
+        "nc1":  2.0,
+        "nc2":  4.473,
+        "nc4":  5.034,
+        "nc10": 5.11,
+        "tps":  1.63
+    }
+
+    def __init__(self, values: dict = None, serial: str = "9B7E4B5F1B8B5A1E",
+                       firmware: tuple = (2, 2), **kwargs):
+        super().__init__(**kwargs)
+        self.values   = dict(self.DEFAULT_VALUES if values is None else values)
+        self.serial   = serial
+        self.firmware = firmware
+        self.float    = True
+        self.sleeping = False
+        self.commands.update({
+            0x0010: self.cmd_start,
+            0x0300: self.cmd_read_values,
+            0x1001: self.cmd_sleep,
+            0x1103: self.cmd_wakeup,
+            0xD002: lambda args: self.string("00080000", 8),
+            0xD033: lambda args: self.string(self.serial),
+            0xD100: lambda args: bytes(self.firmware)
+        })
+
+    def cmd_start(self, args: bytes) -> None:
+        self.float = (args[:1] != b'\x05')
+        self.start()
+
+    def cmd_read_values(self, args: bytes) -> bytes:
+        self.measured()
+        values = [self.values[key] for key in self.DEFAULT_VALUES]
+        if self.float:
+            return struct.pack('>10f', *values)
+        return struct.pack('>10H', *[min(int(v), 0xFFFF) for v in values])
+
+    def cmd_sleep(self, args: bytes) -> None:
+        self.measuring = False
+        self.sleeping  = True
+
+    def cmd_wakeup(self, args: bytes) -> None:
+        self.sleeping = False
+
+
+class VirtualSEN5x(SensirionPMDevice):
+
+    DEFAULT_VALUES = {
+        "pm1":  1.2,
+        "pm2":  5.2,
+        "pm4":  9.4,
+        "pm10": 10.6,
+        "h":    51.0,
+        "t":    21.0,
+        "voc":  101.9,
+        "nox":  1.0
+    }
+    SCALE = {"pm1": 10, "pm2": 10, "pm4": 10, "pm10": 10, "h": 100, "t": 200, "voc": 10, "nox": 10}
+
+    def __init__(self, product: str = "SEN55", values: dict = None,
+                       serial: str = "E4A8C7F0D1B2A3C4", firmware: tuple = (2, 0), **kwargs):
+        super().__init__(**kwargs)
+        self.product  = product
+        self.values   = dict(self.DEFAULT_VALUES if values is None else values)
+        self.serial   = serial
+        self.firmware = firmware
+        self.rht_only = False
+        self.params   = {
+            0x60B2: bytes(6),                                       # thermo compensation
+            0x60C6: bytes(2),                                       # warm start
+            0x60D0: bytes.fromhex("00640000000c00b4003200e6"),      # VOC tuning
+            0x60E1: bytes.fromhex("00010000000c02d0003200e6"),      # NOx tuning
+            0x60F7: bytes(2),                                       # RH/T acceleration mode
+        }
+        self.voc_state = bytes(8)
+        self.commands.update({
+            0x0021: self.cmd_start,
+            0x0037: self.cmd_start_rht,
+            0x03C4: self.cmd_read_values,
+            0xD014: lambda args: self.string(self.product),
+            0xD033: lambda args: self.string(self.serial),
+            0xD100: lambda args: bytes(self.firmware),
+            0x6181: self.cmd_voc_state
+        })
+        for cmd in self.params:
+            self.commands[cmd] = self.param_handler(cmd)
+
+    def param_handler(self, cmd: int):
+        def handler(args: bytes) -> bytes:
+            if args:
+                self.params[cmd] = args
+                return None
+            return self.params[cmd]
+        return handler
+
+    def cmd_start(self, args: bytes) -> None:
+        self.rht_only = False
+        self.start()
+
+    def cmd_start_rht(self, args: bytes) -> None:
+        self.rht_only = True
+        self.start()
+
+    # VOC algorithm state can be written in idle mode only
+    def cmd_voc_state(self, args: bytes) -> bytes:
+        if args:
+            if self.measuring:
+                raise nack("VOC algorithm state can't be written in measurement mode")
+            self.voc_state = args[:8]
+            return None
+        return self.voc_state
+
+    def cmd_read_values(self, args: bytes) -> bytes:
+        self.measured()
+        raw = []
+        for key in self.DEFAULT_VALUES:
+            if (key == "nox" and self.product != "SEN55") or (self.rht_only and key.startswith("pm")):
+                raw.append(0x7FFF if key in ("h", "t", "voc", "nox") else 0xFFFF)
+            else:
+                raw.append(int(round(self.values[key] * self.SCALE[key])))
+        return struct.pack('>4H4h', *raw)
+
+
+class VirtualSHT40(VirtualDevice):
+
+    # conversion time [s]
+    MEASURE = {
+        0xFD: 0.0083,
+        0xF6: 0.0045,
+        0xE0: 0.0016,
+        0x39: 1.1,
+        0x32: 0.11,
+        0x2F: 1.1,
+        0x24: 0.11,
+        0x1E: 1.1,
+        0x15: 0.11
+    }
+
+    def __init__(self, t: float = 22.5, h: float = 41.5, serial: int = 0x12345678,
+                       crc_error_rate: float = 0.0, seed: int = None, clock = monotonic):
+        super().__init__(clock)
+        self.t        = t
+        self.h        = h
+        self.serial   = serial
+        self.ready_at = 0.0
+        self.sensirion = SensirionDevice(crc_error_rate, seed, clock)
+
+    def inject_crc_errors(self, count: int = 1) -> None:
+        self.sensirion.inject_crc_errors(count)
+
+    def write(self, data: bytes) -> None:
+        cmd = data[0]
+        if cmd in self.MEASURE:
+            raw_t = min(max(int(round((self.t + 45) * 65535 / 175)), 0), 0xFFFF)
+            raw_h = min(max(int(round((self.h + 6) * 65535 / 125)), 0), 0xFFFF)
+            self.response = self.sensirion.frame(struct.pack('>HH', raw_t, raw_h))
+            self.ready_at = self.clock() + self.MEASURE[cmd]
+        elif cmd == 0x89:
+            self.response = self.sensirion.frame(struct.pack('>I', self.serial))
+            self.ready_at = self.clock()
+        elif cmd == 0x94:
+            self.response = b''
+        else:
+            raise nack("Unknown command 0x%02x" % cmd)
+
+    # Read during conversion is NACKed
+    def read(self, nbytes: int) -> bytes:
+        if self.clock() < self.ready_at:
+            raise nack("Measurement in progress")
+        return super().read(nbytes)
+
+
+# BMP280 calibration from datasheet example (chapter 3.11.3)
+BMP280_CALIB = {
+    'T1': 27504, 'T2': 26435, 'T3': -1000,
+    'P1': 36477, 'P2': -10685, 'P3': 3024, 'P4': 2855, 'P5': 140,
+    'P6': -7, 'P7': 15500, 'P8': -14600, 'P9': 6000
+}
+
+
+class VirtualBMP280(VirtualDevice):
+
+    def __init__(self, t: float = 25.08, p: float = 100653.27, calib: dict = None,
+                       chip_id: int = 0x58, clock = monotonic):
+        super().__init__(clock)
+        self.calib       = dict(BMP280_CALIB if calib is None else calib)
+        self.chip_id     = chip_id
+        self.regs        = bytearray(256)
+        self.ptr         = 0
+        self.pending     = False
+        self.done_at     = 0.0
+        self.conversions = 0
+        self.reset()
+        self.set_values(t, p)
+
+    def reset(self) -> None:
+        self.regs[:] = bytes(256)
+        self.regs[0xD0] = self.chip_id
+        calib = b''
+        for key in self.calib:
+            calib += struct.pack('<H' if key in ('T1', 'P1') else '<h', self.calib[key])
+        self.regs[0x88:0x88+len(calib)] = calib
+        self.regs[0xF7:0xFD] = bytes([0x80, 0x00, 0x00, 0x80, 0x00, 0x00])
+
+    def set_values(self, t: float, p: float) -> None:
+        self.t = t
+        self.p = p
+        self.adc_t = self.bisect(lambda adc: self.compensate(adc, 0)[0], t, True)
+        self.adc_p = self.bisect(lambda adc: self.compensate(self.adc_t, adc)[1], p, False)
+
+    def bisect(self, func, target: float, rising: bool) -> int:
+        lo, hi = 0, (1 << 20) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (func(mid) < target) == rising:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # Floating point compensation from datasheet, returns (t, p)
+    def compensate(self, adc_t: int, adc_p: int) -> tuple:
+        c = self.calib
+        var1 = (adc_t / 16384.0 - c['T1'] / 1024.0) * c['T2']
+        var2 = (adc_t / 131072.0 - c['T1'] / 8192.0) * (adc_t / 131072.0 - c['T1'] / 8192.0) * c['T3']
+        t_fine = var1 + var2
+        var1 = t_fine / 2.0 - 64000.0
+        var2 = var1 * var1 * c['P6'] / 32768.0
+        var2 = var2 + var1 * c['P5'] * 2.0
+        var2 = var2 / 4.0 + c['P4'] * 65536.0
+        var1 = (c['P3'] * var1 * var1 / 524288.0 + c['P2'] * var1) / 524288.0
+        var1 = (1.0 + var1 / 32768.0) * c['P1']
+        if var1 == 0:
+            return (t_fine / 5120.0, 0)
+        p = 1048576.0 - adc_p
+        p = (p - var2 / 4096.0) * 6250.0 / var1
+        var1 = c['P9'] * p * p / 2147483648.0
+        var2 = p * c['P8'] / 32768.0
+        return (t_fine / 5120.0, p + (var1 + var2 + c['P7']) / 16.0)
+
+    def mode(self) -> int:
+        return self.regs[0xF4] & 0b11
+
+    # Typical measurement time [s], datasheet chapter 3.8.1
+    def measure_time(self) -> float:
+        os_t = (self.regs[0xF4] >> 5) & 0b111
+        os_p = (self.regs[0xF4] >> 2) & 0b111
+        samples = lambda os: 0 if os == 0 else 1 << (min(os, 5) - 1)
+        return (1.0 + 2.0 * samples(os_t) + 2.0 * samples(os_p) + (0.5 if os_p else 0)) / 1000
+
+    # Normal mode standby time [s]
+    def standby_time(self) -> float:
+        return (0.0005, 0.0625, 0.125, 0.25, 0.5, 1.0, 2.0, 4.0)[(self.regs[0xF5] >> 5) & 0b111]
+
+    def start_conversion(self) -> None:
+        self.pending = True
+        self.done_at = self.clock() + self.measure_time()
+
+    # Finish conversions due by now, keep status.measuring (bit 3) up to date
+    def update(self) -> None:
+        now = self.clock()
+        if self.pending and now >= self.done_at:
+            self.conversions += 1
+            self.regs[0xF7:0xFD] = struct.pack('>I', self.adc_p << 4)[1:] + struct.pack('>I', self.adc_t << 4)[1:]
+            if self.mode() == 0b11:
+                while self.done_at <= now:
+                    self.done_at += self.standby_time() + self.measure_time()
+            else:
+                self.pending = False
+                self.regs[0xF4] &= 0b11111100
+        if self.pending and now >= self.done_at - self.measure_time():
+            self.regs[0xF3] |= 0b1000
+        else:
+            self.regs[0xF3] &= 0b11110111
+
+    def write(self, data: bytes) -> None:
+        self.update()
+        self.ptr = data[0]
+        pairs = [(data[0], data[1])] if len(data) > 1 else []
+        pairs += list(zip(data[2::2], data[3::2]))
+        for reg, value in pairs:
+            if reg == 0xE0:
+                if value == 0xB6:
+                    self.reset()
+            elif reg in (0xF4, 0xF5):
+                self.regs[reg] = value
+                if reg == 0xF4:
+                    if self.mode() != 0b00:
+                        self.start_conversion()
+                    else:
+                        self.pending = False
+
+    # Register read with auto-increment
+    def read(self, nbytes: int) -> bytes:
+        self.update()
+        return bytes(self.regs[self.ptr:self.ptr+nbytes])
@@ -0,0 +1,66 @@
+import sys
+from time import perf_counter
+
+# Lazy driver / sink registry
+#
+# Modules are imported on first use only, unused drivers and sinks (and their
+# dependencies like http.client) never get loaded. Saves only what a station does
+# not use, see footprint report at loop start for the actual startup path.
+#
+#   from loader.loader import driver, sink
+#   SPS30 = driver("sps30")             # imports sps30.py now
+#   sc    = sink("sc")(SC_SENSOR_ID)
+#   body  = sink_module("sc").sensor_json(values)
+#   loaded()                            # {"sps30": 0.0041, ...} import time [s]
+
+DRIVERS = {
+    "sps30":  ("sps30",  "SPS30"),
+    "sen5x":  ("sen5x",  "SEN5x"),
+    "sht40":  ("sht40",  "SHT40"),
+    "bmp280": ("bmp280", "BMP280"),
+}
+
+SINKS = {
+    "sc":   ("sensorComm.sensorComm", "sensorCommunity"),
+    "tmep": ("TMEPcz.TMEPcz",         "TMEPcz"),
+}
+
+import_times = {}       # module -> import time incl. dependencies [s]
+
+
+def load_module(module: str):
+    if module not in sys.modules:
+        start = perf_counter()
+        __import__(module)
+        import_times[module] = perf_counter() - start
+    return sys.modules[module]
+
+
+def load(table: dict, name: str):
+    if name not in table:
+        raise KeyError(f"Unknown {name!r}, known: {', '.join(sorted(table))}")
+    module, attr = table[name]
+    return getattr(load_module(module), attr)
+
+
+# Driver class, e.g. driver("sps30") -> SPS30
+def driver(name: str):
+    return load(DRIVERS, name)
+
+
+# Driver module (codecs, constants), e.g. driver_module("sps30").MEASURED_VALUES_FLOAT
+def driver_module(name: str):
+    return load_module(DRIVERS[name][0])
+
+
+def sink(name: str):
+    return load(SINKS, name)
+
+
+# Sink module (payload helpers), e.g. sink_module("sc").sensor_json
+def sink_module(name: str):
+    return load_module(SINKS[name][0])
+
+
+def loaded() -> dict:
+    return dict(import_times)
@@ -0,0 +1,304 @@
+import os
+import json
+import threading
+from time import time, perf_counter
+from i2c.i2c import wrap_transport, release_bus
+
+# Metrics: counters, gauges and histograms with labels
+#
+#   from metrics.metrics import registry
+#   registry.instrument_bus(3)                        # before drivers are created
+#   registry.watch_driver("sps30", sps_sensor, sps30.MEASURED_VALUES_FLOAT)
+#   uq.register("sc", registry.timed_sink("sc", send), timeout)
+#   registry.serve(9105)                              # Prometheus text at http://127.0.0.1:9105/metrics
+#   registry.write_snapshot("/home/pi/AirQmonitor/metrics.json")
+
+I2C_BUCKETS    = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+UPLOAD_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CYCLE_BUCKETS  = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def label_str(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, values)) + "}"
+
+
+class Metric:
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name   = name
+        self.help   = help
+        self.labels = tuple(labels)
+        self.values = {}        # label values -> value
+        self.lock   = threading.Lock()
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def samples(self) -> list:
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Counter(Metric):
+
+    type = "counter"
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    # Mirror of counter kept elsewhere (driver, DataReady)
+    def set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Gauge(Metric):
+
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = CYCLE_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            hist = self.values.get(key)
+            if hist is None:
+                hist = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist[0][i] += 1
+                    break
+            hist[1] += value
+            hist[2] += 1
+
+    def samples(self) -> list:
+        result = []
+        with self.lock:
+            items = [(key, list(h[0]), h[1], h[2]) for key, h in self.values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                result.append((self.name + "_bucket", key + (repr(float(bound)),), cumulative))
+            result.append((self.name + "_bucket", key + ("+Inf",), count))
+            result.append((self.name + "_sum", key, total))
+            result.append((self.name + "_count", key, count))
+        return result
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {label_str(self.labels, key): {
+                        "buckets": dict(zip(map(str, self.buckets), h[0])), "sum": h[1], "count": h[2]}
+                    for key, h in self.values.items()}
+
+
+class InstrumentedTransport:
+
+    def __init__(self, transport, registry, bus: int):
+        self.transport = transport
+        self.registry  = registry
+        self.bus       = bus
+
+    def timed(self, func, address: int, cmd: str, *args):
+        start = perf_counter()
+        try:
+            return func(address, *args)
+        except OSError:
+            self.registry.i2c_errors.inc(bus = self.bus, address = hex(address), cmd = cmd)
+            raise
+        finally:
+            self.registry.i2c_seconds.observe(perf_counter() - start,
+                                              bus = self.bus, address = hex(address), cmd = cmd)
+
+    def write(self, address: int, data: list) -> None:
+        return self.timed(self.transport.write, address, bytes(data[:2]).hex(), data)
+
+    def readinto(self, address: int, buf) -> int:
+        return self.timed(self.transport.readinto, address, "read", buf)
+
+    def transfer_into(self, address: int, data: list, buf) -> int:
+        return self.timed(self.transport.transfer_into, address, bytes(data[:2]).hex(), data, buf)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics    = {}
+        self.collectors = []    # called before render / snapshot
+        self.handles    = []
+        self.server     = None
+        self.lock       = threading.Lock()
+
+        self.i2c_seconds     = self.histogram("airq_i2c_transaction_seconds", "I2C transaction latency",
+                                              ("bus", "address", "cmd"), I2C_BUCKETS)
+        self.i2c_errors      = self.counter("airq_i2c_errors_total", "I2C transactions failed (NACK, bus error)",
+                                            ("bus", "address", "cmd"))
+        self.crc_errors      = self.counter("airq_crc_errors_total", "Responses with CRC mismatch", ("driver",))
+        self.frames          = self.counter("airq_frames_total", "Measured value frames decoded", ("driver",))
+        self.ready_polls     = self.counter("airq_data_ready_polls_total", "Data-ready flag reads", ("driver",))
+        self.ready_misses    = self.counter("airq_data_ready_misses_total", "Data-ready flag reads returning not ready",
+                                            ("driver",))
+        self.ready_timeouts  = self.counter("airq_data_ready_timeouts_total", "Reads without data before deadline",
+                                            ("driver",))
+        self.upload_seconds  = self.histogram("airq_upload_seconds", "Upload request latency", ("sink",), UPLOAD_BUCKETS)
+        self.upload_failures = self.counter("airq_upload_failures_total", "Failed uploads", ("sink",))
+        self.cycle_seconds   = self.histogram("airq_cycle_seconds", "Sensor acquisition duration", (), CYCLE_BUCKETS)
+        self.cycle_jitter    = self.histogram("airq_cycle_jitter_seconds", "Loop period deviation from nominal",
+                                              (), CYCLE_BUCKETS)
+        self.last_cycle      = self.gauge("airq_last_cycle_timestamp_seconds", "Wall clock time of last loop cycle")
+
+    def add(self, metric: Metric) -> Metric:
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self.add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = CYCLE_BUCKETS) -> Histogram:
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def collect(self, func) -> None:
+        self.collectors.append(func)
+
+    # Time every transaction of bus number, drivers created afterwards are measured
+    def instrument_bus(self, number: int) -> None:
+        wrap = lambda transport: transport if isinstance(transport, InstrumentedTransport) \
+                                 else InstrumentedTransport(transport, self, number)
+        self.handles.append(wrap_transport(number, wrap))
+
+    # CRC errors of driver and its codecs, data-ready counters
+    def watch_driver(self, name: str, device, *codecs) -> None:
+        def collect():
+            errors = getattr(device, "crc_errors", 0) + sum(c.crc_errors for c in codecs)
+            self.crc_errors.set(errors, driver = name)
+            if codecs:
+                self.frames.set(sum(c.frames for c in codecs), driver = name)
+            ready = getattr(device, "data_ready", None)
+            if ready is not None:
+                self.ready_polls.set(ready.polls, driver = name)
+                self.ready_misses.set(ready.misses, driver = name)
+                self.ready_timeouts.set(ready.timeouts, driver = name)
+        self.collect(collect)
+
+    # Wrap UploadQueue send callable, measures latency and failures
+    def timed_sink(self, sink: str, send):
+        def timed(*args):
+            start = perf_counter()
+            ok = False
+            try:
+                ok = send(*args)
+                return ok
+            finally:
+                self.upload_seconds.observe(perf_counter() - start, sink = sink)
+                if not ok:
+                    self.upload_failures.inc(sink = sink)
+        return timed
+
+    def cycle(self, duration: float, jitter: float = None) -> None:
+        self.cycle_seconds.observe(duration)
+        if jitter is not None:
+            self.cycle_jitter.observe(abs(jitter))
+        self.last_cycle.set(time())
+
+    def run_collectors(self) -> None:
+        for func in self.collectors:
+            try:
+                func()
+            except Exception:
+                pass
+
+    # Prometheus text exposition format 0.0.4
+    def render(self) -> str:
+        self.run_collectors()
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, key, value in metric.samples():
+                labels = metric.labels + (("le",) if name.endswith("_bucket") else ())
+                lines.append(f"{name}{label_str(labels, key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        self.run_collectors()
+        result = {"ts": time()}
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            if isinstance(metric, Histogram):
+                result[metric.name] = metric.snapshot()
+            else:
+                with metric.lock:
+                    result[metric.name] = {label_str(metric.labels, k): v for k, v in metric.values.items()}
+        return result
+
+    # Atomic write (tmp + rename), readers never see partial file
+    def write_snapshot(self, filename: str) -> None:
+        tmp = filename + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f, indent = 1)
+        os.replace(tmp, filename)
+
+    # http.server is imported here, not loaded at all when endpoint is off
+    # Endpoint is not authenticated, address "" (all interfaces) only on trusted network
+    def serve(self, port: int, address: str = "127.0.0.1"):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((address, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target = self.server.serve_forever, name = "metrics", daemon = True).start()
+        return self.server
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for handle in self.handles:
+            release_bus(handle)
+        self.handles = []
+
+
+# Registry shared by the process
+registry = Registry()
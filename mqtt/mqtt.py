@@ -0,0 +1,368 @@
+import select
+import socket
+import struct
+import threading
+from collections import deque, OrderedDict
+from time import monotonic
+
+# Minimal MQTT 3.1.1 publisher (QoS 0/1)
+#
+# One persistent connection served by IO thread. publish() only appends to local
+# buffer and never blocks. IO thread writes queued PUBLISH packets in batches
+# (one sendall per batch) without waiting for PUBACK of previous ones, up to
+# max_inflight unacknowledged messages. After reconnect, unacknowledged messages
+# are sent again (DUP flag) before buffered ones, so nothing accepted is lost.
+#
+#   client = MQTTClient("localhost", client_id = "airq-raspi")
+#   client.start()
+#   client.publish("airq/sps30-9B7E4B5F/pm2", b"5.26")
+#   client.flush(5)                   # wait until everything is acknowledged
+#   client.close()
+
+CONNECT     = 0x10
+CONNACK     = 0x20
+PUBLISH     = 0x30
+PUBACK      = 0x40
+PINGREQ     = 0xC0
+PINGRESP    = 0xD0
+DISCONNECT  = 0xE0
+
+KEEPALIVE    = 60       # [s]
+MAX_INFLIGHT = 32       # unacknowledged QoS 1 messages on the wire
+MAX_BUFFER   = 10000    # messages waiting for connection, further ones rejected
+BATCH        = 64       # packets per socket write
+MIN_BACKOFF  = 1        # [s] reconnect delay, doubled up to MAX_BACKOFF
+MAX_BACKOFF  = 60       # [s]
+
+CONNACK_ERRORS = {
+    1: "unacceptable protocol version",
+    2: "identifier rejected",
+    3: "server unavailable",
+    4: "bad user name or password",
+    5: "not authorized"
+}
+
+
+def encode_length(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, n = n & 0x7F, n >> 7
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
+
+
+def encode_str(s) -> bytes:
+    data = s.encode() if isinstance(s, str) else bytes(s)
+    return struct.pack("!H", len(data)) + data
+
+
+def packet(header: int, body: bytes) -> bytes:
+    return bytes([header]) + encode_length(len(body)) + body
+
+
+def connect_packet(client_id: str, keepalive: int, clean: bool = True,
+                   username: str = None, password: str = None) -> bytes:
+    flags = 0x02 if clean else 0
+    payload = encode_str(client_id)
+    if username is not None:
+        flags |= 0x80
+        payload += encode_str(username)
+        if password is not None:
+            flags |= 0x40
+            payload += encode_str(password)
+    return packet(CONNECT, encode_str("MQTT") + bytes([4, flags]) + struct.pack("!H", keepalive) + payload)
+
+
+def publish_packet(topic: str, payload: bytes, qos: int = 1, pid: int = 0,
+                   retain: bool = False, dup: bool = False) -> bytes:
+    header = PUBLISH | (dup << 3) | (qos << 1) | retain
+    body = encode_str(topic) + (struct.pack("!H", pid) if qos else b'') + payload
+    return packet(header, body)
+
+
+class Message:
+
+    __slots__ = ("topic", "payload", "qos", "retain", "dup")
+
+    def __init__(self, topic: str, payload: bytes, qos: int = 1, retain: bool = False):
+        self.topic   = topic
+        self.payload = payload
+        self.qos     = qos
+        self.retain  = retain
+        self.dup     = False
+
+
+class MQTTClient:
+
+    def __init__(self, host: str, port: int = 1883, client_id: str = "", keepalive: int = KEEPALIVE,
+                       username: str = None, password: str = None, clean: bool = True,
+                       max_inflight: int = MAX_INFLIGHT, max_buffer: int = MAX_BUFFER,
+                       timeout: float = 10):
+        self.host         = host
+        self.port         = port
+        self.client_id    = client_id
+        self.keepalive    = keepalive
+        self.username     = username
+        self.password     = password
+        self.clean        = clean
+        self.max_inflight = max_inflight
+        self.max_buffer   = max_buffer
+        self.timeout      = timeout
+
+        self.queue     = deque()            # Message waiting for send
+        self.inflight  = OrderedDict()      # packet id -> Message sent, PUBACK pending
+        self.next_pid  = 1
+        self.cond      = threading.Condition()
+        self.sock      = None
+        self.rbuf      = bytearray()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.stopping  = False
+        self.thread    = None
+        self.connected = False
+        self.last_send = 0.0
+        self.ping_sent = None
+
+        self.published  = 0     # packets written (incl. resent)
+        self.acked      = 0
+        self.resent     = 0
+        self.dropped    = 0     # rejected, buffer full
+        self.reconnects = 0
+        self.last_error = None
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(target = self.run, name = "mqtt", daemon = True)
+            self.thread.start()
+
+    # Queue message, returns False (message not queued) when buffer is full
+    def publish(self, topic: str, payload: bytes, qos: int = 1, retain: bool = False) -> bool:
+        with self.cond:
+            if len(self.queue) >= self.max_buffer:
+                self.dropped += 1
+                return False
+            self.queue.append(Message(topic, payload, qos, retain))
+        self.wake()
+        return True
+
+    def wake(self) -> None:
+        try:
+            self.wake_w.send(b'\0')
+        except OSError:
+            pass
+
+    def pending(self) -> int:
+        with self.cond:
+            return len(self.queue) + len(self.inflight)
+
+    # Wait until every queued message is acknowledged, returns True if done
+    def flush(self, timeout: float = None) -> bool:
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.cond:
+            while self.queue or self.inflight:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def connect(self) -> None:
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall(connect_packet(self.client_id, self.keepalive, self.clean,
+                                        self.username, self.password))
+            header, body = self.read_packet(sock)
+            if header != CONNACK or len(body) != 2:
+                raise ConnectionError(f"MQTT unexpected packet {header:#x} instead of CONNACK")
+            if body[1]:
+                raise ConnectionError(f"MQTT connection refused: {CONNACK_ERRORS.get(body[1], body[1])}")
+        except Exception:
+            sock.close()
+            raise
+        sock.setblocking(False)
+        with self.cond:
+            # unacknowledged messages first, in original order
+            for msg in reversed(self.inflight.values()):
+                msg.dup = True
+                self.queue.appendleft(msg)
+                self.resent += 1
+            self.inflight.clear()
+            self.sock = sock
+            self.connected = True
+        self.rbuf.clear()
+        self.ping_sent = None
+        self.last_send = monotonic()
+
+    # Blocking read of one packet during CONNECT
+    def read_packet(self, sock) -> tuple:
+        def recv(n: int) -> bytes:
+            data = b''
+            while len(data) < n:
+                chunk = sock.recv(n - len(data))
+                if not chunk:
+                    raise ConnectionError("MQTT connection closed")
+                data += chunk
+            return data
+        header = recv(1)[0]
+        length, shift = 0, 0
+        while True:
+            byte = recv(1)[0]
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        return header & 0xF0, recv(length)
+
+    # Complete packets from receive buffer
+    def packets(self):
+        buf = self.rbuf
+        while len(buf) >= 2:
+            length, shift, pos = 0, 0, 1
+            while True:
+                if pos >= len(buf):
+                    return
+                byte = buf[pos]
+                length |= (byte & 0x7F) << shift
+                shift += 7
+                pos += 1
+                if not byte & 0x80:
+                    break
+            if len(buf) < pos + length:
+                return
+            header, body = buf[0] & 0xF0, bytes(buf[pos:pos + length])
+            del buf[:pos + length]
+            yield header, body
+
+    def receive(self) -> None:
+        try:
+            data = self.sock.recv(65536)
+        except BlockingIOError:
+            return
+        if not data:
+            raise ConnectionError("MQTT connection closed by broker")
+        self.rbuf += data
+        for header, body in self.packets():
+            if header == PUBACK:
+                pid = struct.unpack("!H", body[:2])[0]
+                with self.cond:
+                    if self.inflight.pop(pid, None) is not None:
+                        self.acked += 1
+                        self.cond.notify_all()
+            elif header == PINGRESP:
+                self.ping_sent = None
+
+    def alloc_pid(self) -> int:
+        while True:
+            pid = self.next_pid
+            self.next_pid = pid % 0xFFFF + 1
+            if pid not in self.inflight:
+                return pid
+
+    # Batch of packets filling in-flight window
+    def take_batch(self) -> bytes:
+        out = []
+        with self.cond:
+            while self.queue and len(out) < BATCH:
+                msg = self.queue[0]
+                if msg.qos and len(self.inflight) >= self.max_inflight:
+                    break
+                self.queue.popleft()
+                pid = 0
+                if msg.qos:
+                    pid = self.alloc_pid()
+                    self.inflight[pid] = msg
+                out.append(publish_packet(msg.topic, msg.payload, msg.qos, pid, msg.retain, msg.dup))
+            if out and not self.queue and not self.inflight:
+                self.cond.notify_all()      # QoS 0 only, nothing to acknowledge
+        self.published += len(out)
+        return b''.join(out)
+
+    def send_all(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            try:
+                n = self.sock.send(view)
+                view = view[n:]
+            except BlockingIOError:
+                if not select.select([], [self.sock], [], self.timeout)[1]:
+                    raise ConnectionError("MQTT send timeout")
+        self.last_send = monotonic()
+
+    def serve(self) -> None:
+        while not self.stopping:
+            batch = self.take_batch()
+            if batch:
+                self.send_all(batch)
+                continue
+            now = monotonic()
+            if self.ping_sent is not None and now - self.ping_sent > self.timeout:
+                raise ConnectionError("MQTT PINGRESP timeout")
+            if self.ping_sent is None and now - self.last_send >= self.keepalive / 2:
+                self.send_all(bytes([PINGREQ, 0]))
+                self.ping_sent = now
+            wait = self.keepalive / 2 - (now - self.last_send)
+            if self.ping_sent is not None:
+                # dead broker is noticed timeout after ping, not after next keepalive
+                wait = min(wait, self.ping_sent + self.timeout - now)
+            wait = max(wait, 0.1)
+            readable, _, _ = select.select([self.sock, self.wake_r], [], [], wait)
+            if self.wake_r in readable:
+                self.wake_r.recv(4096)
+            if self.sock in readable:
+                self.receive()
+
+    def disconnect(self) -> None:
+        with self.cond:
+            sock, self.sock = self.sock, None
+            self.connected = False
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def run(self) -> None:
+        backoff = MIN_BACKOFF
+        while not self.stopping:
+            try:
+                self.connect()
+                backoff = MIN_BACKOFF
+                self.serve()
+                self.send_all(bytes([DISCONNECT, 0]))
+            except (OSError, ValueError) as e:
+                self.last_error = repr(e)
+            self.disconnect()
+            if self.stopping:
+                break
+            self.reconnects += 1
+            with self.cond:
+                self.cond.wait(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def stats(self) -> dict:
+        with self.cond:
+            queued, inflight = len(self.queue), len(self.inflight)
+        return {
+            "connected":  self.connected,
+            "queued":     queued,
+            "inflight":   inflight,
+            "published":  self.published,
+            "acked":      self.acked,
+            "resent":     self.resent,
+            "dropped":    self.dropped,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error
+        }
+
+    # Messages not yet acknowledged are lost unless flush() was called before
+    def close(self) -> None:
+        self.stopping = True
+        with self.cond:
+            self.cond.notify_all()
+        self.wake()
+        if self.thread is not None:
+            self.thread.join(self.timeout)
+        self.disconnect()
+        self.wake_r.close()
+        self.wake_w.close()
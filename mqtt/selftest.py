@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#
+# MQTTClient against in-process broker stand-in (mqtt/sim.py)
+#
+#   python3 mqtt/selftest.py            # exit 1 when any check fails
+#
+# Checks flush of pipelined QoS 1 messages, in-flight window, resend with DUP flag
+# after dropped connection, PINGRESP timeout and full buffer.
+
+import os
+import sys
+from time import sleep, monotonic
+
+# repo root instead of script directory, mqtt/mqtt.py would shadow mqtt package
+sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from mqtt.mqtt import MQTTClient
+from mqtt.sim import SimBroker
+
+MESSAGES = 5000
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() >= deadline:
+            return False
+        sleep(0.01)
+    return True
+
+
+def check_flush(broker: SimBroker) -> str:
+    client = MQTTClient("127.0.0.1", broker.port, "selftest-flush")
+    client.start()
+    try:
+        start = monotonic()
+        for i in range(MESSAGES):
+            client.publish(f"airq/selftest/f{i % 10}", str(i).encode())
+        assert client.flush(10), f"not acknowledged: {client.stats()}"
+        elapsed = monotonic() - start
+        payloads = [m[1] for m in broker.messages if m[0].startswith("airq/selftest/")]
+        assert payloads == [str(i).encode() for i in range(MESSAGES)], "messages lost or reordered"
+        return f"{MESSAGES} QoS 1 messages acknowledged in {elapsed:.2f} s"
+    finally:
+        client.close()
+
+
+def check_resend(broker: SimBroker) -> str:
+    client = MQTTClient("127.0.0.1", broker.port, "selftest-resend", max_inflight = 8)
+    client.start()
+    try:
+        assert wait_for(lambda: client.connected), "not connected"
+        broker.ack = False
+        for i in range(20):
+            client.publish("airq/resend", str(i).encode())
+        assert wait_for(lambda: client.stats()["inflight"] == 8), f"in-flight window: {client.stats()}"
+        assert client.stats()["queued"] == 12, f"queued: {client.stats()}"
+
+        sent = len(broker.messages)
+        connects = broker.connects
+        broker.ack = True
+        broker.drop_clients()
+        assert client.flush(10), f"not acknowledged after reconnect: {client.stats()}"
+        assert broker.connects == connects + 1, "no reconnect"
+
+        resent = broker.messages[sent:]
+        assert all(m[3] for m in resent[:8]), "unacknowledged messages resent without DUP"
+        assert not any(m[3] for m in resent[8:]), "queued messages sent with DUP"
+        assert [m[1] for m in resent] == [str(i).encode() for i in range(20)], "resend out of order"
+        return f"8 in flight + 12 queued delivered in order after reconnect, {client.stats()['resent']} with DUP"
+    finally:
+        broker.ack = True
+        client.close()
+
+
+def check_ping_timeout(broker: SimBroker) -> str:
+    client = MQTTClient("127.0.0.1", broker.port, "selftest-ping", keepalive = 4, timeout = 0.5)
+    client.start()
+    try:
+        assert wait_for(lambda: client.connected), "not connected"
+        broker.pong = False
+        start = monotonic()
+        # ping after keepalive / 2, connection dropped timeout later (not next keepalive / 2)
+        assert wait_for(lambda: client.last_error and "PINGRESP" in client.last_error, 3.5), \
+            f"dead broker not detected: {client.stats()}"
+        return f"missing PINGRESP detected {monotonic() - start:.1f} s after last packet"
+    finally:
+        broker.pong = True
+        client.close()
+
+
+# IO thread not started, nothing leaves buffer
+def check_buffer_full() -> str:
+    client = MQTTClient("127.0.0.1", 1883, "selftest-buffer", max_buffer = 10)
+    try:
+        accepted = [client.publish("airq/buffer", b"1") for i in range(15)]
+        assert accepted == [True] * 10 + [False] * 5, f"accepted: {accepted}"
+        assert client.stats()["dropped"] == 5, f"dropped: {client.stats()}"
+        return "publish rejected when buffer is full"
+    finally:
+        client.close()
+
+
+def main() -> int:
+    broker = SimBroker().start()
+    failed = 0
+    try:
+        for check in (lambda: check_flush(broker), lambda: check_resend(broker),
+                      lambda: check_ping_timeout(broker), check_buffer_full):
+            try:
+                print("ok  ", check())
+            except AssertionError as e:
+                failed += 1
+                print("FAIL", e)
+    finally:
+        broker.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+import struct
+import threading
+import socketserver
+from mqtt.mqtt import CONNECT, CONNACK, PUBLISH, PUBACK, PINGREQ, PINGRESP, DISCONNECT
+
+# In-process MQTT broker stand-in (publish side only)
+#
+#   broker = SimBroker()
+#   broker.start()
+#   client = MQTTClient("127.0.0.1", broker.port)
+#   ...
+#   broker.messages                   # [(topic, payload, qos, dup), ...]
+#   broker.drop_clients()             # client has to reconnect and resend
+#
+# Answers CONNECT, QoS 1 PUBLISH and PINGREQ like a broker, acknowledgements can be
+# held back (ack = False) to fill client in-flight window, PINGRESP too (pong = False)
+# to simulate dead broker. See mqtt/selftest.py.
+
+
+class SimBroker:
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, ack: bool = True, pong: bool = True):
+        self.ack      = ack
+        self.pong     = pong
+        self.pings    = 0
+        self.messages = []
+        self.connects = 0
+        self.clients  = []
+        self.lock     = threading.Lock()
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                with broker.lock:
+                    broker.clients.append(self.request)
+                try:
+                    broker.serve(self.request)
+                except OSError:
+                    pass
+
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler, bind_and_activate = True)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def start(self) -> "SimBroker":
+        threading.Thread(target = self.server.serve_forever, name = "mqtt-broker", daemon = True).start()
+        return self
+
+    def serve(self, sock) -> None:
+        f = sock.makefile("rb")
+        while True:
+            first = f.read(1)
+            if not first:
+                return
+            length, shift = 0, 0
+            while True:
+                byte = f.read(1)[0]
+                length |= (byte & 0x7F) << shift
+                shift += 7
+                if not byte & 0x80:
+                    break
+            body = f.read(length)
+            kind = first[0] & 0xF0
+            if kind == CONNECT:
+                with self.lock:
+                    self.connects += 1
+                sock.sendall(bytes([CONNACK, 2, 0, 0]))
+            elif kind == PUBLISH:
+                qos = (first[0] >> 1) & 3
+                n = struct.unpack("!H", body[:2])[0]
+                topic = body[2:2 + n].decode()
+                pos = 2 + n
+                pid = None
+                if qos:
+                    pid = body[pos:pos + 2]
+                    pos += 2
+                with self.lock:
+                    self.messages.append((topic, body[pos:], qos, bool(first[0] & 0x08)))
+                    ack = self.ack
+                if qos and ack:
+                    sock.sendall(bytes([PUBACK, 2]) + pid)
+            elif kind == PINGREQ:
+                with self.lock:
+                    self.pings += 1
+                    pong = self.pong
+                if pong:
+                    sock.sendall(bytes([PINGRESP, 0]))
+            elif kind == DISCONNECT:
+                return
+
+    def drop_clients(self) -> None:
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for sock in clients:
+            try:
+                sock.shutdown(2)
+                sock.close()
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        self.drop_clients()
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+#
+# Configuration driven acquisition pipeline
+#
+#   python3 pipeline/pipeline.py config/AirQmonitor.json              # foreground
+#   python3 pipeline/pipeline.py config/AirQmonitorSEN.json --daemon
+#   python3 pipeline/pipeline.py config/AirQmonitor.json --check      # validate only
+#
+# sensors -> stages -> store / sinks, one runner for every station layout.
+# Sensors are read when due (own period), sensors on different buses in parallel.
+# Values of every cycle pass processing stages in order, then are stored locally
+# and handed to sinks, sc payloads are built per pin from field-to-pin mapping.
+#
+# Config (JSON):
+#   period    - default sensor period [s]
+#   base_dir, log_file, queue_file, device_cache, metrics_port,
+#   metrics_address - default 127.0.0.1, "" = all interfaces (endpoint is not authenticated)
+#   data_dir  - local TSDB of stored fields (list "fields")
+#   sensors   - [{"name", "driver", "bus", "address", "period", "warmup", "options", "read"}]
+#     options - driver constructor arguments, read - read_values() arguments
+#     warmup  - stop measurement after read, start again this long before next read [s]
+#   stages    - [{"stage": "select" | "rename" | "offset" | "round", ...}]
+#   sinks     - [{"sink": "sc", "sensor_id", "pins": {"1": [fields], ...}},
+#                {"sink": "tmep", "domain", "guid", "fields": [fields]},
+#                {"sink": "file", "filename"}, {"sink": "stdout"},
+#                {"sink": "mqtt", "host", "port", "prefix"}]
+#     every sink also takes "name", "timeout", "retries", "retry_delay" (see sinks/sinks.py)
+#
+# Sinks are delivered to concurrently, payloads not delivered go to upload journal
+# and are retried from there.
+
+import os
+import sys
+import json
+import atexit
+import signal
+import logging
+import argparse
+import inspect
+import threading
+import logging.handlers
+from time import time, sleep, monotonic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loader.loader import driver, driver_module
+from acquisition.acquisition import Acquisition
+from devcache.devcache import DeviceCache
+from uploadQueue.uploadQueue import UploadQueue
+from uploadQueue.worker import UploadWorker
+from tsdb.tsdb import TSDB
+from sinks.sinks import SINKS, FanOut, create as create_sink
+from metrics.metrics import registry as metrics
+
+DEFAULT_PERIOD  = 180       # [s]
+STARTUP_TIMEOUT = 30        # [s] max wait for valid data from all sensors
+UPLOAD_TIMEOUT  = 10        # [s] per request
+
+logger = logging.getLogger("pipeline")
+
+
+def parse_address(value) -> int:
+    if value is None or isinstance(value, int):
+        return value
+    return int(value, 0)
+
+
+def load_config(filename: str) -> dict:
+    with open(filename) as f:
+        config = json.load(f)
+    if not config.get("sensors"):
+        raise ValueError(f"{filename}: no sensors configured")
+    names = set()
+    for sensor in config["sensors"]:
+        for key in ("driver", "bus"):
+            if key not in sensor:
+                raise ValueError(f"{filename}: sensor {sensor} without {key!r}")
+        sensor.setdefault("name", sensor["driver"])
+        if sensor["name"] in names:
+            raise ValueError(f"{filename}: duplicate sensor name {sensor['name']!r}")
+        names.add(sensor["name"])
+    if config.get("data_dir") is not None and not config.get("fields"):
+        raise ValueError(f"{filename}: data_dir needs list of stored fields")
+    for stage in config.get("stages", []):
+        if stage.get("stage") not in STAGES:
+            raise ValueError(f"{filename}: unknown stage {stage.get('stage')!r}, known: {', '.join(STAGES)}")
+    for conf in config.get("sinks", []):
+        if conf.get("sink") not in SINKS:
+            raise ValueError(f"{filename}: unknown sink {conf.get('sink')!r}, known: {', '.join(SINKS)}")
+    return config
+
+
+# Processing stages, values dict in, values dict out
+
+def stage_select(values: dict, fields: list) -> dict:
+    return {k: values[k] for k in fields if k in values}
+
+
+def stage_rename(values: dict, fields: dict) -> dict:
+    return {fields.get(k, k): v for k, v in values.items()}
+
+
+# Calibration offsets, e.g. {"t": -0.4}
+def stage_offset(values: dict, fields: dict) -> dict:
+    return {k: v + fields[k] if k in fields else v for k, v in values.items()}
+
+
+def stage_round(values: dict, digits: int = 2, fields: list = None) -> dict:
+    return {k: round(v, digits) if fields is None or k in fields else v for k, v in values.items()}
+
+
+STAGES = {
+    "select": stage_select,
+    "rename": stage_rename,
+    "offset": stage_offset,
+    "round":  stage_round,
+}
+
+
+def build_stages(config: list) -> list:
+    stages = []
+    for conf in config:
+        args = {k: v for k, v in conf.items() if k != "stage"}
+        func = STAGES[conf["stage"]]
+        stages.append(lambda values, func = func, args = args: func(values, **args))
+    return stages
+
+
+class Sensor:
+
+    def __init__(self, config: dict, period: float, devices: DeviceCache):
+        self.name      = config["name"]
+        self.driver    = config["driver"]
+        self.bus       = config["bus"]
+        self.address   = parse_address(config.get("address"))
+        self.period    = config.get("period", period)
+        self.warmup    = config.get("warmup")
+        self.read_args = config.get("read", {})
+        self.next_due  = 0.0
+        self.start_due = None      # monotonic time of measurement start after warmup stop
+
+        cls    = driver(config["driver"])
+        params = inspect.signature(cls).parameters
+        if self.address is None:
+            self.address = params["address"].default
+        cached = devices.get(self.bus, self.address)
+        kwargs = dict(config.get("options", {}))
+        if "cached" in params:
+            kwargs["cached"] = cached
+        self.device = cls(self.bus, self.address, **kwargs)
+
+        # id used in sink topics, serial number where driver has one
+        sn = getattr(self.device, "sn", None)
+        if isinstance(sn, str) and sn:
+            self.source = f"{config['driver']}-{sn}"
+        else:
+            self.source = f"{config['driver']}-{self.bus}-{self.address:02x}"
+
+        # identity / calibration for next start
+        if hasattr(self.device, "identity"):
+            devices.put(self.bus, self.address, self.device.identity())
+        if hasattr(self.device, "load_calib"):
+            devices.put(self.bus, self.address, {"calib": self.device.load_calib(cached.get("calib"))})
+
+    def read(self) -> dict:
+        return self.device.read_values(**self.read_args)
+
+    def start(self) -> None:
+        if hasattr(self.device, "restore_voc_state") and self.device.state_dir is not None:
+            logger.info(f"{self.name} VOC algo state restored: {self.device.restore_voc_state()} s old")
+        if hasattr(self.device, "start_measurement"):
+            self.device.start_measurement()
+
+    # Measurement is stopped between reads, started again warmup seconds before next read
+    # (by Pipeline.run, see warm_up), next_due is already set to next read
+    def after_read(self) -> None:
+        if self.warmup and self.warmup < self.period:
+            self.device.stop_measurement()
+            self.start_due = self.next_due - self.warmup
+
+    def warm_up(self, now: float) -> None:
+        if self.start_due is not None and self.start_due <= now:
+            self.start_due = None
+            self.device.start_measurement()
+
+    # Next time this sensor needs loop (read or warmup start)
+    def wakeup(self) -> float:
+        return self.next_due if self.start_due is None else min(self.next_due, self.start_due)
+
+    def close(self) -> None:
+        if hasattr(self.device, "stop_measurement_and_close"):
+            self.device.stop_measurement_and_close()
+
+
+class Pipeline:
+
+    def __init__(self, config: dict):
+        self.config   = config
+        self.base_dir = config.get("base_dir", ".")
+        self.period   = config.get("period", DEFAULT_PERIOD)
+        self.sensors  = []
+        self.sinks    = []
+        self.fanout   = None
+        self.stages   = build_stages(config.get("stages", []))
+        self.acq      = Acquisition(raise_errors = False)
+        self.worker   = None
+        self.db       = None
+        self.stopping = threading.Event()
+
+    def path(self, key: str, default: str) -> str:
+        return os.path.join(self.base_dir, self.config.get(key, default))
+
+    def setup(self) -> None:
+        for bus in sorted({s["bus"] for s in self.config["sensors"]}):
+            metrics.instrument_bus(bus)
+
+        devices = DeviceCache(self.path("device_cache", "devices.json"))
+        for conf in self.config["sensors"]:
+            sensor = Sensor(conf, self.period, devices)
+            self.sensors.append(sensor)
+            self.acq.add(sensor.name, sensor.device, sensor.read, sensor.bus)
+            metrics.watch_driver(sensor.name, sensor.device, *getattr(driver_module(sensor.driver), "CODECS", ()))
+        devices.save()
+
+        uq = UploadQueue(self.path("queue_file", "upload.db"))
+        for i, conf in enumerate(self.config.get("sinks", [])):
+            name = conf.get("name", conf["sink"] if i == 0 else f"{conf['sink']}{i}")
+            # journal is the retry path, no retries within delivery unless configured
+            conf = dict(conf, timeout = conf.get("timeout", UPLOAD_TIMEOUT), retries = conf.get("retries", 0))
+            s = create_sink(conf, name)
+            self.sinks.append(s)
+            uq.register(name, metrics.timed_sink(name, s.resend), s.timeout)
+        self.worker = UploadWorker(uq)
+        self.worker.start()
+        self.fanout = FanOut(self.sinks, lambda name, key, payload: self.worker.submit(name, payload, key),
+                             self.worker.backlog)
+        sink_up = metrics.gauge("airq_sink_up", "Sink accepts deliveries (not backing off)", ("sink",))
+        metrics.collect(lambda: [sink_up.set(int(s.health.up()), sink = s.name) for s in self.sinks])
+
+        if self.config.get("data_dir") is not None:
+            self.db = TSDB(self.path("data_dir", "data"), self.config.get("fields"))
+        if self.config.get("metrics_port"):
+            metrics.serve(self.config["metrics_port"], self.config.get("metrics_address", "127.0.0.1"))
+
+        for sensor in self.sensors:
+            sensor.start()
+        ready_start = monotonic()
+        ready = self.acq.wait_ready(self.config.get("startup_timeout", STARTUP_TIMEOUT))
+        logger.info(f"Sensors ready in {monotonic() - ready_start:.1f} s, errors: {ready.errors}")
+
+    def due(self, now: float) -> list:
+        return [s for s in self.sensors if s.next_due <= now]
+
+    # Read due sensors, values of this cycle go through stages to store and sinks
+    def cycle(self, sensors: list) -> dict:
+        for sensor in sensors:
+            while getattr(sensor.device, "is_cleaning", lambda: 0)() == 1:
+                sleep(1)
+        reading = self.acq.read({s.name for s in sensors})
+        for name, error in reading.errors.items():
+            logger.warning(f"{name} read failed: {error!r}")
+        metrics.cycle(reading.cycle)
+
+        values = reading.values
+        for stage in self.stages:
+            values = stage(values)
+
+        ts = time()
+        if self.db is not None and values:
+            try:
+                self.db.append(ts, values)
+            except OSError as e:
+                logger.warning(f"Local store failed: {e!r}")
+        if values:
+            sources = {field: s.source for s in sensors for field in reading.device(s.name)}
+            self.fanout.submit(values, sources, ts)
+        for sensor in sensors:
+            sensor.after_read()
+        return values
+
+    def run(self) -> None:
+        while not self.stopping.is_set():
+            now = monotonic()
+            for sensor in self.sensors:
+                sensor.warm_up(now)
+            sensors = self.due(now)
+            if sensors:
+                for sensor in sensors:
+                    sensor.next_due += sensor.period
+                    if sensor.next_due <= now:             # first read or late, no catch-up burst
+                        sensor.next_due = now + sensor.period
+                values = self.cycle(sensors)
+                logger.info(f"Cycle {[s.name for s in sensors]}: {values}")
+            wait = min(s.wakeup() for s in self.sensors) - monotonic()
+            if wait > 0:
+                self.stopping.wait(wait)
+
+    # Signal handlers must not touch I2C, work is done in thread
+    def in_thread(self, method: str) -> None:
+        def run():
+            for sensor in self.sensors:
+                if hasattr(sensor.device, method):
+                    logger.info(f"{sensor.name}: {method}")
+                    getattr(sensor.device, method)()
+        threading.Thread(target = run).start()
+
+    def close(self) -> None:
+        self.stopping.set()
+        self.acq.close()        # waits for reads in flight, sensors are closed after
+        for sensor in self.sensors:
+            sensor.close()
+        if self.fanout is not None:
+            self.fanout.close()
+        if self.worker is not None:
+            self.worker.stop(UPLOAD_TIMEOUT)
+        if self.db is not None:
+            self.db.close()
+        metrics.close()
+
+
+def setup_logging(filename: str = None) -> None:
+    logging.basicConfig(format = '%(asctime)s %(message)s')
+    logger.setLevel(logging.INFO)
+    if filename:
+        handler = logging.handlers.TimedRotatingFileHandler(filename, when = "midnight", backupCount = 3)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s %(message)s'))
+        logger.addHandler(handler)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description = "Configuration driven AirQmonitor pipeline")
+    parser.add_argument("config", help = "JSON config, see config/")
+    parser.add_argument("--daemon", action = "store_true", help = "fork to background")
+    parser.add_argument("--check", action = "store_true", help = "validate config and exit")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.check:
+        print(f"{args.config}: {len(config['sensors'])} sensors, {len(config.get('stages', []))} stages, "
+              f"{len(config.get('sinks', []))} sinks")
+        return 0
+
+    setup_logging(config.get("log_file"))
+    if "base_dir" in config:
+        os.chdir(config["base_dir"])
+    if args.daemon and os.fork() > 0:
+        return 0
+    logger.info(f"AirQmonitor pipeline started : {os.getpid()} {args.config}")
+
+    pipeline = Pipeline(config)
+    atexit.register(pipeline.close)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGUSR1, lambda signum, frame: pipeline.in_thread("start_fan_cleaning"))
+    signal.signal(signal.SIGUSR2, lambda signum, frame: pipeline.in_thread("save_voc_state"))
+    pipeline.setup()
+    try:
+        pipeline.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+#
+# Replay raw I2C capture (i2c/capture.py) through driver decoders
+#
+#   python3 replay/replay.py i2c.cap                       # readings as JSON lines
+#   python3 replay/replay.py i2c.cap --out readings.jsonl --workers 4
+#   python3 replay/replay.py i2c.cap --stats               # decoder throughput only
+#
+# Log is split into chunks decoded in parallel by process pool, readings keep log order.
+# Device state needed for decoding (BMP280 calibration, SEN5x product) is tracked
+# while splitting and handed to every chunk.
+
+import os
+import sys
+import json
+import mmap
+import argparse
+from time import perf_counter
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from i2c.capture import REC, MAGIC, OP_WRITE, records
+import sps30
+import sen5x
+import sht40
+import bmp280
+from bmp280 import BMP280
+
+CHUNK_RECORDS = 20000
+
+SPS_VALUES  = (bytes(sps30.CMD_READ_MEASURED_VALUES), sps30.NBYTES_MEASURED_VALUES_FLOAT)
+SEN_VALUES  = (bytes(sen5x.CMD_READ_MEASURED_VALUES), sen5x.NBYTES_MEASURED_VALUES)
+SEN_PRODUCT = (bytes(sen5x.CMD_PRODUCT_NAME), sen5x.NBYTES_PRODUCT_NAME)
+SHT_VALUES  = {(bytes([cmd]), sht40.NBYTES_LENGTH) for cmd in sht40.CMD_MEASURE.values()}
+BMP_CALIB   = (bytes(bmp280.CMD_CALIB), bmp280.NBYTES_CALIB)
+BMP_DATA    = (bytes(bmp280.CMD_DATA), bmp280.NBYTES_DATA)
+BMP_TEMP    = (bytes(bmp280.CMD_TEMPERATURE), bmp280.NBYTES_TEMP_P)
+BMP_PRESS   = (bytes(bmp280.CMD_PRESSURE), bmp280.NBYTES_TEMP_P)
+BMP_KEYS    = ['T1', 'T2', 'T3'] + ['P' + str(i) for i in range(1, 10)]
+
+# (command length, response length) of records changing device state
+STATE_SIZES = {(len(cmd), nbytes) for cmd, nbytes in (BMP_CALIB, BMP_TEMP, SEN_PRODUCT)}
+
+
+def adc20(data: bytes, offset: int = 0) -> int:
+    return (data[offset] << 16 | data[offset+1] << 8 | data[offset+2]) >> 4
+
+
+class Replayer:
+
+    def __init__(self, state: dict = None):
+        state = state or {}
+        self.calib   = dict(state.get("calib", {}))     # (bus, address) -> BMP280 calibration
+        self.adc_t   = dict(state.get("adc_t", {}))     # (bus, address) -> last BMP280 temperature ADC
+        self.product = dict(state.get("product", {}))   # (bus, address) -> SEN5x product
+        self.bmp     = BMP280.__new__(BMP280)           # formulas only, no I2C
+
+    def state(self) -> dict:
+        return {"calib": dict(self.calib), "adc_t": dict(self.adc_t), "product": dict(self.product)}
+
+    # Update device state, returns True for records needing decode
+    def observe(self, bus: int, address: int, cmd: bytes, data: bytes) -> bool:
+        key = (cmd, len(data))
+        if key == BMP_CALIB:
+            self.bmp.calib_data = dict.fromkeys(BMP_KEYS, 0)
+            self.calib[(bus, address)] = dict(self.bmp.read_calib_data(data))
+        elif key == BMP_TEMP:
+            self.adc_t[(bus, address)] = adc20(data)
+        elif key == SEN_PRODUCT:
+            name = bytes(b for i, b in enumerate(data) if i % 3 != 2).split(b'\0')[0]
+            self.product[(bus, address)] = name.decode('ascii', 'replace')
+        else:
+            return key in (SPS_VALUES, SEN_VALUES, BMP_DATA, BMP_PRESS) or key in SHT_VALUES
+        return False
+
+    # Returns (device, values) or None
+    def decode(self, bus: int, address: int, cmd: bytes, data: bytes) -> tuple:
+        key = (cmd, len(data))
+        if key == SPS_VALUES:
+            return "sps30", sps30.MEASURED_VALUES_FLOAT.decode(data)
+        if key == SEN_VALUES:
+            if self.product.get((bus, address)) == "SEN54":
+                return "sen5x", sen5x.MEASURED_VALUES_SEN54.decode(data)
+            return "sen5x", sen5x.MEASURED_VALUES_SEN55.decode(data)
+        if key in SHT_VALUES:
+            return "sht40", sht40.MEASURED_VALUES.decode(data)
+        if key == BMP_DATA or key == BMP_PRESS:
+            calib = self.calib.get((bus, address))
+            if calib is None:
+                return None
+            if key == BMP_DATA:
+                adc_t, adc_p = adc20(data, 3), adc20(data)
+            elif (bus, address) in self.adc_t:
+                adc_t, adc_p = self.adc_t[(bus, address)], adc20(data)
+            else:
+                return None
+            self.bmp.calib_data = calib
+            t, p = self.bmp.compensate(adc_t, adc_p)
+            return "bmp280", {"t1": t, "p": p}
+        return None
+
+
+def replay_chunk(args: tuple) -> list:
+    chunk, state = args
+    replayer = Replayer(state)
+    readings = []
+    for wall, mono, bus, address, op, cmd, data in records(chunk, 0):
+        if op == OP_WRITE or not replayer.observe(bus, address, cmd, data):
+            continue
+        res = replayer.decode(bus, address, cmd, data)
+        if res is not None and res[1]:
+            readings.append({"ts": wall, "mono": mono, "bus": bus, "address": address,
+                             "device": res[0], "values": res[1]})
+    return readings
+
+
+# Yields (chunk bytes, device state at chunk start), only headers and state
+# records are parsed here
+def chunks(log, chunk_records: int = CHUNK_RECORDS):
+    if log[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a capture log")
+    replayer = Replayer()
+    start = offset = len(MAGIC)
+    end   = len(log)
+    state = replayer.state()
+    count = 0
+    while offset + REC.size <= end:
+        wall, mono, bus, address, op, ncmd, ndata = REC.unpack_from(log, offset)
+        body = offset + REC.size
+        if body + ncmd + ndata > end:
+            break                   # torn tail record
+        if op != OP_WRITE and (ncmd, ndata) in STATE_SIZES:
+            replayer.observe(bus, address, log[body:body + ncmd], log[body + ncmd:body + ncmd + ndata])
+        offset = body + ncmd + ndata
+        count += 1
+        if count == chunk_records:
+            yield log[start:offset], state
+            start, count = offset, 0
+            state = replayer.state()
+    if count:
+        yield log[start:offset], state
+
+
+def replay(filename: str, workers: int = 1, chunk_records: int = CHUNK_RECORDS):
+    with open(filename, 'rb') as f:
+        log = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    try:
+        if workers <= 1:
+            for job in chunks(log, chunk_records):
+                yield from replay_chunk(job)
+        else:
+            with Pool(workers) as pool:
+                for readings in pool.imap(replay_chunk, chunks(log, chunk_records)):
+                    yield from readings
+    finally:
+        log.close()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay raw I2C capture through decoders")
+    parser.add_argument("capture", help="capture log written by i2c/capture.py")
+    parser.add_argument("--out", metavar="FILE", help="write readings as JSON lines (default stdout)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="decoder processes")
+    parser.add_argument("--chunk", type=int, default=CHUNK_RECORDS, help="records per chunk")
+    parser.add_argument("--stats", action="store_true", help="print throughput only")
+    args = parser.parse_args(argv)
+
+    start = perf_counter()
+    count = 0
+    out = None
+    if not args.stats:
+        out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        for reading in replay(args.capture, args.workers, args.chunk):
+            count += 1
+            if out is not None:
+                out.write(json.dumps(reading) + "\n")
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+    elapsed = perf_counter() - start
+    print(f"{count} readings in {elapsed:.3f} s ({count / max(elapsed, 1e-9):.0f}/s)", file = sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
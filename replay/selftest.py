@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+#
+# Capture (i2c/capture.py) on simulated bus (i2c/sim.py) replayed by replay/replay.py
+#
+#   python3 replay/selftest.py          # exit 1 when any check fails
+#
+# Checks that drivers started with warm device cache (calibration / product name of
+# previous run, see devcache) still log what replay needs: BMP280 readings are
+# decoded with its calibration, SEN54 readings with SEN54 frame layout.
+
+import os
+import sys
+import tempfile
+
+sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from i2c.sim import SimBus, VirtualBMP280, VirtualSEN5x
+from i2c.capture import Capture
+from replay.replay import replay
+from bmp280 import BMP280
+from sen5x import SEN5x
+
+BUS      = 101
+READINGS = 5
+
+
+def capture_run(filename: str, sim: SimBus, make, read) -> list:
+    capture = Capture(filename)
+    capture.install(BUS)
+    try:
+        device = make()
+        return [read(device) for i in range(READINGS)]
+    finally:
+        capture.close()
+
+
+def check_bmp280_cached(tmp: str, sim: SimBus) -> str:
+    sim.attach(0x77, VirtualBMP280(t = 21.25, p = 98765.4))
+    cached = BMP280(BUS, 0x77).load_calib()     # previous run
+    filename = os.path.join(tmp, "bmp280.cap")
+
+    def make():
+        bmp = BMP280(BUS, 0x77)
+        bmp.load_calib(cached)
+        return bmp
+    read = capture_run(filename, sim, make, lambda bmp: bmp.read_values())
+
+    replayed = [r["values"] for r in replay(filename) if r["device"] == "bmp280"]
+    assert len(replayed) == READINGS, f"{len(replayed)} of {READINGS} BMP280 readings replayed"
+    assert replayed == read, f"replayed {replayed[0]}, read {read[0]}"
+    return f"{READINGS} BMP280 readings of warm-cache run replayed with calibration"
+
+
+def check_sen54_cached(tmp: str, sim: SimBus) -> str:
+    sim.attach(0x69, VirtualSEN5x("SEN54", ready_interval = 0))
+    cached = SEN5x(BUS, 0x69).identity()        # previous run
+    filename = os.path.join(tmp, "sen54.cap")
+
+    def make():
+        sen = SEN5x(BUS, 0x69, cached = cached)
+        sen.start_measurement()
+        return sen
+    read = capture_run(filename, sim, make, lambda sen: sen.read_values())
+    assert all(read), "SEN5x not read"
+
+    replayed = [r["values"] for r in replay(filename) if r["device"] == "sen5x"]
+    assert len(replayed) == READINGS, f"{len(replayed)} of {READINGS} SEN5x readings replayed"
+    assert all("nox" not in values for values in replayed), f"decoded as SEN55: {replayed[0]}"
+    return f"{READINGS} SEN54 readings of warm-cache run replayed with SEN54 layout"
+
+
+def main() -> int:
+    sim = SimBus().install(BUS)
+    failed = 0
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for check in (check_bmp280_cached, check_sen54_cached):
+                try:
+                    print("ok  ", check(tmp, sim))
+                except AssertionError as e:
+                    failed += 1
+                    print("FAIL", e)
+    finally:
+        sim.uninstall(BUS)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
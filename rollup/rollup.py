@@ -0,0 +1,196 @@
+import os
+import math
+from tsdb.tsdb import TSDB, FLUSH_RECORDS
+
+# Incremental rollups (downsampling)
+#
+# Every sample updates running count/min/max/mean and P2 quantile estimates of
+# the current bucket of every resolution in O(1). Closed bucket is appended to
+# TSDB of its resolution (directory/<resolution>), record timestamp = bucket start,
+# fields <field>_<stat>, e.g. pm2_mean, t_max, nox_p90.
+#
+#   rollup = Rollup("/home/pi/AirQmonitor/data/rollup", ["pm2", "pm10", "t"])
+#   rollup.catch_up(db)               # samples stored while not running
+#   rollup.add(time(), reading.values)
+#   rollup.query("1h", start, end, ["pm2_mean", "pm2_p90"])
+
+RESOLUTIONS = {
+    "1m": 60,
+    "5m": 300,
+    "1h": 3600,
+    "1d": 86400
+}
+QUANTILES = (0.5, 0.9)
+
+
+class P2Quantile:
+
+    # P2 algorithm (Jain & Chlamtac), 5 markers, no samples stored
+    def __init__(self, q: float):
+        self.q  = q
+        self.h  = []                                     # marker heights
+        self.n  = [0, 1, 2, 3, 4]                        # marker positions
+        self.np = [0, 2 * q, 4 * q, 2 + 2 * q, 4]        # desired positions
+        self.dn = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def add(self, x: float) -> None:
+        h, n = self.h, self.n
+        if len(h) < 5:
+            h.append(x)
+            h.sort()
+            return
+
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= h[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.np[i] += self.dn[i]
+
+        for i in range(1, 4):
+            d = self.np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                hp = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+                        (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+                if not h[i - 1] < hp < h[i + 1]:
+                    hp = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+                h[i] = hp
+                n[i] += d
+
+    def value(self) -> float:
+        if not self.h:
+            return math.nan
+        if len(self.h) < 5:
+            return self.h[round(self.q * (len(self.h) - 1))]
+        return self.h[2]
+
+
+class Aggregate:
+
+    def __init__(self, quantiles: tuple = QUANTILES):
+        self.count     = 0
+        self.sum       = 0.0
+        self.min       = math.inf
+        self.max       = -math.inf
+        self.quantiles = [P2Quantile(q) for q in quantiles]
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        self.sum   += x
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        for quantile in self.quantiles:
+            quantile.add(x)
+
+    def stats(self, field: str) -> dict:
+        result = {
+            field + "_min":   self.min,
+            field + "_max":   self.max,
+            field + "_mean":  self.sum / self.count,
+            field + "_count": self.count
+        }
+        for quantile in self.quantiles:
+            result[f"{field}_p{round(quantile.q * 100)}"] = quantile.value()
+        return result
+
+
+def stat_names(fields: list, quantiles: tuple = QUANTILES) -> list:
+    stats = ["min", "max", "mean", "count"] + [f"p{round(q * 100)}" for q in quantiles]
+    return [f"{field}_{stat}" for field in fields for stat in stats]
+
+
+class Bucket:
+
+    def __init__(self, start: float, quantiles: tuple):
+        self.start     = start
+        self.quantiles = quantiles
+        self.fields    = {}     # field -> Aggregate
+
+    def add(self, values: dict, fields: list) -> None:
+        for field in fields:
+            value = values.get(field)
+            if value is None or value != value:
+                continue
+            agg = self.fields.get(field)
+            if agg is None:
+                agg = self.fields[field] = Aggregate(self.quantiles)
+            agg.add(value)
+
+    def stats(self) -> dict:
+        result = {}
+        for field, agg in self.fields.items():
+            result.update(agg.stats(field))
+        return result
+
+
+class Rollup:
+
+    def __init__(self, directory: str, fields: list, resolutions: dict = RESOLUTIONS,
+                       quantiles: tuple = QUANTILES):
+        self.fields      = list(fields)
+        self.resolutions = dict(resolutions)
+        self.quantiles   = tuple(quantiles)
+        self.buckets     = {}     # resolution -> open Bucket
+        self.resume      = {}     # resolution -> samples older than this are already rolled up
+        self.stores      = {}
+        names = stat_names(self.fields, self.quantiles)
+        for name, period in self.resolutions.items():
+            # coarse resolutions are written as soon as bucket closes
+            store = TSDB(os.path.join(directory, name), names,
+                         flush_records = max(1, FLUSH_RECORDS * 60 // period))
+            self.stores[name] = store
+            self.resume[name] = -math.inf if store.last is None else store.last + period
+
+    def add(self, ts: float, values: dict) -> None:
+        for name, period in self.resolutions.items():
+            if ts < self.resume[name]:
+                continue
+            start  = ts - ts % period
+            bucket = self.buckets.get(name)
+            if bucket is None or bucket.start != start:
+                if bucket is not None:
+                    self.emit(name, bucket)
+                bucket = self.buckets[name] = Bucket(start, self.quantiles)
+            bucket.add(values, self.fields)
+
+    def emit(self, name: str, bucket: Bucket) -> None:
+        if bucket.fields:
+            self.stores[name].append(bucket.start, bucket.stats())
+
+    # Roll up raw samples stored in TSDB since last closed bucket
+    def catch_up(self, db: TSDB) -> int:
+        start = min(self.resume.values())
+        count = 0
+        for ts, values in db.query(max(start, 0), math.inf, [f for f in self.fields if f in db.field_idx]):
+            self.add(ts, values)
+            count += 1
+        return count
+
+    # Stats of open (not yet stored) bucket
+    def current(self, name: str) -> dict:
+        bucket = self.buckets.get(name)
+        return {} if bucket is None else bucket.stats()
+
+    def query(self, name: str, start: float = 0, end: float = math.inf, fields: list = None):
+        return self.stores[name].query(start, end, fields)
+
+    def flush(self) -> None:
+        for store in self.stores.values():
+            store.flush()
+
+    # Open buckets are not stored, catch_up() rebuilds them from raw data
+    def close(self) -> None:
+        for store in self.stores.values():
+            store.close()
@@ -1,7 +1,11 @@
+import os
 import sys
-from time import sleep
+from time import sleep, time
 from datetime import datetime
 from i2c.i2c import I2C
+from sensirion.crc import crc8, check_frame, add_crc
+from sensirion.codec import Field, FrameCodec
+from sensirion.ready import DataReady, NotReady
 
 # I2C commands
 CMD_START_MEASUREMENT      = [0x00, 0x21]
@@ -51,59 +55,97 @@ PACKET_SIZE = 3
 # Size of each measurement data packet (PMx) including checksum bytes, in bytes
 SIZE_INTEGER = 3  # unsigned 16 bit integer
 
+# Data-ready wait deadline [s], new values every 1s
+DATA_READY_TIMEOUT = 2.0
+
 # Error value
 SEN_DATA_ERR = [0x80,0x7F]  #-127.0
+
+# Execution time of read commands (datasheet 20 ms), response is read after it,
+# not by repeated start right after command
+EXEC_TIME = 0.02   # [s]
+
+# VOC algorithm state older than this is not restored, sensor was off too long [s]
+VOC_STATE_MAX_AGE = 600
+# Warm start param written with restored state, 0 = cold start .. 65535 = warm start
+WARM_START_RESTORED = 0xFFFF
 #[0xBF,0x80,0x00,0x00]  #-1.0
 
+# Measured values frame layout
+FRAME_MEASURED_VALUES = [
+    Field("pm1",  1, 'H', 10),
+    Field("pm2",  1, 'H', 10),
+    Field("pm4",  1, 'H', 10),
+    Field("pm10", 1, 'H', 10),
+    Field("h",    1, 'h', 100),
+    Field("t",    1, 'h', 200),
+    Field("voc",  1, 'h', 10),
+    Field("nox",  1, 'h', 10)   # SEN55 only
+]
+MEASURED_VALUES_SEN55 = FrameCodec(FRAME_MEASURED_VALUES, bytes(SEN_DATA_ERR))
+MEASURED_VALUES_SEN54 = FrameCodec(FRAME_MEASURED_VALUES[:-1], bytes(SEN_DATA_ERR))
+
+# Frame decoders of this driver (CRC error / frame counters, see metrics watch_driver)
+CODECS = (MEASURED_VALUES_SEN55, MEASURED_VALUES_SEN54)
+
 class SEN5x:
 
 # Init I2C BUS
-    def __init__(self,  bus: int = 1, address: int = 0x69):
+    # state_dir - directory of VOC algorithm state snapshots, saved on close if set
+    # cached    - identity() of previous run, product and firmware are reused if serial matches
+    #             (not on captured bus, replay needs product name in the log)
+    def __init__(self,  bus: int = 1, address: int = 0x69, state_dir: str = None, cached: dict = None):
         self.cleaning    = 0
         self.cleaning_ts = 0
+        self.crc_errors  = 0
         self.i2c         = I2C(bus, address)
-        self.type        = self.product_name()
+        # preallocated response buffer, reused by every measurement read
+        self.buf         = bytearray(NBYTES_MEASURED_VALUES)
+        self.view        = memoryview(self.buf)
+        self.data_ready  = DataReady(self.read_data_ready_flag, DATA_READY_TIMEOUT)
         self.sn          = self.serial_number()
-        self.fw          = self.firmware_version()
+        if cached and cached.get("sn") == self.sn and not self.i2c.captured():
+            self.type    = cached["type"]
+            self.fw      = cached["fw"]
+        else:
+            self.type    = self.product_name()
+            self.fw      = self.firmware_version()
+        self.state_dir   = state_dir
 
 
 # I2C commands BEGIN
     def serial_number(self) -> str:
-        self.i2c.write(CMD_SERIAL_NUMBER)
-        data = self.i2c.read(NBYTES_SERIAL_NUMBER)
+        data = self.i2c.transfer(CMD_SERIAL_NUMBER, NBYTES_SERIAL_NUMBER, EXEC_TIME)
+        if self.check_frame(data):
+            return "CRC mismatch"
         result = ""
         for i in range(0, NBYTES_SERIAL_NUMBER, PACKET_SIZE):
-            if self.crc_calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatch"
             if(data[i:i+2] != [0x00, 0x00]):
                 result += "".join(map(chr, data[i:i+2]))
         return str(result.rstrip('\x00'))
 
     def firmware_version(self) -> str:
-        self.i2c.write(CMD_FIRMWARE_VERSION)
-        data = self.i2c.read(NBYTES_FIRMWARE_VERSION)
-        if self.crc_calc(data[:2]) != data[2]:
+        data = self.i2c.transfer(CMD_FIRMWARE_VERSION, NBYTES_FIRMWARE_VERSION, EXEC_TIME)
+        if self.check_frame(data):
             return "CRC mismatch"
         return ".".join(map(str, data[:2]))
 
     def product_name(self) -> str:
-        self.i2c.write(CMD_PRODUCT_NAME)
-        data = self.i2c.read(NBYTES_PRODUCT_NAME)
+        data = self.i2c.transfer(CMD_PRODUCT_NAME, NBYTES_PRODUCT_NAME, EXEC_TIME)
+        if self.check_frame(data):
+            return "CRC mismatch"
         result = ""
-        for i in range(0, NBYTES_PRODUCT_NAME, 3):
-            if self.crc_calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatch"
+        for i in range(0, NBYTES_PRODUCT_NAME, PACKET_SIZE):
             if(data[i:i+2] != [0x00, 0x00]):
                 result += "".join(map(chr, data[i:i+2]))
         return str(result.rstrip('\x00'))
 
     def read_status_register(self) -> dict:
-        self.i2c.write(CMD_READ_STATUS_REGISTER)
-        data = self.i2c.read(NBYTES_READ_STATUS_REGISTER)
+        data = self.i2c.transfer(CMD_READ_STATUS_REGISTER, NBYTES_READ_STATUS_REGISTER, EXEC_TIME)
+        if self.check_frame(data):
+            return "CRC mismatch"
         status = []
         for i in range(0, NBYTES_READ_STATUS_REGISTER, PACKET_SIZE):
-            if self.crc_calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatch"
             status.extend(data[i:i+2])
         binary = '{:032b}'.format(
             status[0] << 24 | status[1] << 16 | status[2] << 8 | status[3])
@@ -130,33 +172,29 @@ class SEN5x:
         self.i2c.write(CMD_CLEAR_STATUS_REGISTER)
 
     def read_data_ready_flag(self) -> bool:
-        self.i2c.write(CMD_READ_DATA_READY_FLAG)
-        data = self.i2c.read(NBYTES_READ_DATA_READY_FLAG)
-        if self.crc_calc(data[0:2]) != data[2]:
+        data = self.view[:NBYTES_READ_DATA_READY_FLAG]
+        self.i2c.transfer_into(CMD_READ_DATA_READY_FLAG, data, EXEC_TIME)
+        if self.check_frame(data):
             return False
         return True if data[1] == 1 else False
 
     def read_rht_acceleration_mode(self) -> int:
-        self.i2c.write(CMD_READ_RHT_ACC_MODE)
-        data = self.i2c.read(NBYTES_READ_DATA_READY_FLAG)
-        if self.crc_calc(data[0:2]) != data[2]:
+        data = self.i2c.transfer(CMD_RHT_ACC_MODE, NBYTES_RHT_ACC_MODE, EXEC_TIME)
+        if self.check_frame(data):
             return -1
         return (data[0] << 8 | data[1])
 
     def read_warm_start_param(self, writeCMD : int = 1) -> int:
         if writeCMD == 1:
-            self.i2c.write(CMD_WARM_START_PARAM)
-        data = self.i2c.read(NBYTES_WARM_START_PARAM)
-        if self.crc_calc(data[0:2]) != data[2]:
+            data = self.i2c.transfer(CMD_WARM_START_PARAM, NBYTES_WARM_START_PARAM, EXEC_TIME)
+        else:
+            data = self.i2c.read(NBYTES_WARM_START_PARAM)
+        if self.check_frame(data):
             return -1
         return (data[0] << 8 | data[1])
 
     def write_warm_start_param(self, param:int) -> None:
-        data = CMD_WARM_START_PARAM
-        data.append((param & 0xff00) >> 8)
-        data.append(param & 0x00ff)
-        data.append(self.crc_calc(data[2:4]))
-        print(data) 
+        data = CMD_WARM_START_PARAM + add_crc([(param & 0xff00) >> 8, param & 0x00ff])
         self.i2c.write(data)
 
     def start_fan_cleaning(self) -> None:
@@ -173,12 +211,11 @@ class SEN5x:
             'h' : 60,
             's' : 1
         }
-        self.i2c.write(CMD_AUTO_CLEANING_INTERVAL)
-        data = self.i2c.read(NBYTES_AUTO_CLEANING_INTERVAL)
+        data = self.i2c.transfer(CMD_AUTO_CLEANING_INTERVAL, NBYTES_AUTO_CLEANING_INTERVAL, EXEC_TIME)
+        if self.check_frame(data):
+            return "CRC mismatch"
         interval = []
-        for i in range(0, NBYTES_AUTO_CLEANING_INTERVAL, 3):
-            if self.crc_calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatch"
+        for i in range(0, NBYTES_AUTO_CLEANING_INTERVAL, PACKET_SIZE):
             interval.extend(data[i:i+2])
         ret = (interval[0] << 24 | interval[1] << 16 | interval[2] << 8 | interval[3])
         return ret / dividier[unit]
@@ -190,70 +227,78 @@ class SEN5x:
         interval.append((seconds & 0x00ff0000) >> 16)
         interval.append((seconds & 0x0000ff00) >> 8)
         interval.append(seconds & 0x000000ff)
-        data = CMD_AUTO_CLEANING_INTERVAL
-        data.extend([interval[0], interval[1]])
-        data.append(self.crc_calc(data[2:4]))
-        data.extend([interval[2], interval[3]])
-        data.append(self.crc_calc(data[5:7]))
+        data = CMD_AUTO_CLEANING_INTERVAL + add_crc(interval)
         self.i2c.write(data)
 
     def read_thermo_compensation_param(self) -> list:
-        self.i2c.write(CMD_THERMO_COMPENS_PARAM)
-        data = self.i2c.read(NBYTES_THERMO_COMPENS_PARAM)
+        data = self.i2c.transfer(CMD_THERMO_COMPENS_PARAM, NBYTES_THERMO_COMPENS_PARAM, EXEC_TIME)
         return data
 
     def read_voc_tunning_param(self) -> list:
-        self.i2c.write(CMD_VOC_TUNNING_PARAM)
-        data = self.i2c.read(NBYTES_VOC_NOX_TUNNING_PARAM)
+        data = self.i2c.transfer(CMD_VOC_TUNNING_PARAM, NBYTES_VOC_NOX_TUNNING_PARAM, EXEC_TIME)
         return data
 
     def write_voc_tunning_param(self, param:list) -> None:
-        data = CMD_VOC_TUNNING_PARAM
         if param[0] == 255:
             param = DEFAULT_VOC_TUNNING_PARAM
-        for i in range(0, NBYTES_VOC_NOX_TUNNING_PARAM, PACKET_SIZE):
-            if self.crc_calc(param[i:i+2]) != param[i+2]:
-                return "CRC mismatch"
-        data.extend(param)
-        print(data)
+        if self.check_frame(param, NBYTES_VOC_NOX_TUNNING_PARAM):
+            return "CRC mismatch"
+        data = CMD_VOC_TUNNING_PARAM + list(param[:NBYTES_VOC_NOX_TUNNING_PARAM])
         self.i2c.write(data)
 
     def read_nox_tunning_param(self) -> list:
-        self.i2c.write(CMD_NOX_TUNNING_PARAM)
-        data = self.i2c.read(NBYTES_VOC_NOX_TUNNING_PARAM)
+        data = self.i2c.transfer(CMD_NOX_TUNNING_PARAM, NBYTES_VOC_NOX_TUNNING_PARAM, EXEC_TIME)
         return data
 
     def write_nox_tunning_param(self, param:list) -> None:
-        data = CMD_NOX_TUNNING_PARAM
         if param[0] == 255:
-            param = DEFAULT_VOC_TUNNING_PARAM
-        for i in range(0, NBYTES_VOC_NOX_TUNNING_PARAM, PACKET_SIZE):
-            if self.crc_calc(param[i:i+2]) != param[i+2]:
-                return "CRC mismatch"
-        data.extend(param)
-        print(data)
+            param = DEFAULT_NOX_TUNNING_PARAM
+        if self.check_frame(param, NBYTES_VOC_NOX_TUNNING_PARAM):
+            return "CRC mismatch"
+        data = CMD_NOX_TUNNING_PARAM + list(param[:NBYTES_VOC_NOX_TUNNING_PARAM])
         self.i2c.write(data)
 
     def read_voc_algo_state(self) -> list:
-        self.i2c.write(CMD_VOC_ALGO_STATE)
-        data = self.i2c.read(NBYTES_VOC_ALGO_STATE)
+        data = self.i2c.transfer(CMD_VOC_ALGO_STATE, NBYTES_VOC_ALGO_STATE, EXEC_TIME)
         return data
 
     def write_voc_algo_state(self, param:list) -> None:
-        data = CMD_VOC_ALGO_STATE
-        for i in range(0, NBYTES_VOC_ALGO_STATE, PACKET_SIZE):
-            if self.crc_calc(param[i:i+2]) != param[i+2]:
-                return "CRC mismatch"
-        data.extend(param)
-        print(data)
+        if self.check_frame(param, NBYTES_VOC_ALGO_STATE):
+            return "CRC mismatch"
+        data = CMD_VOC_ALGO_STATE + list(param[:NBYTES_VOC_ALGO_STATE])
         self.i2c.write(data)
 
+    # Snapshot of VOC algorithm state, readable in measurement and idle mode
+    def save_voc_state(self, directory: str = None) -> str:
+        data = self.read_voc_algo_state()
+        if self.check_frame(data, NBYTES_VOC_ALGO_STATE):
+            return ""
+        return self.to_file(self.voc_state_filename(directory), data)
+
+    # Restore VOC algorithm state and warm start param, idle mode only (before
+    # start_measurement). Returns age of restored state [s], -1 if nothing restored
+    def restore_voc_state(self, directory: str = None, max_age: float = VOC_STATE_MAX_AGE,
+                                warm_start: int = WARM_START_RESTORED) -> float:
+        filename = self.voc_state_filename(directory)
+        try:
+            age  = time() - os.path.getmtime(filename)
+            data = self.from_file(filename)
+        except OSError:
+            return -1
+        if age > max_age or len(data) != NBYTES_VOC_ALGO_STATE or check_frame(data):
+            return -1
+        self.write_voc_algo_state(data)
+        if warm_start:
+            self.write_warm_start_param(warm_start)
+        return age
+
     def reset(self) -> None:
         self.i2c.write(CMD_RESET)
 
     def stop_measurement_and_close(self) -> None:
         self.i2c.write(CMD_STOP_MEASUREMENT)
-#        self.save_to_file(self.type + '-' + self.sn + '-VOCalgo.bin', self.read_voc_algo_state())
+        if self.state_dir is not None:
+            self.save_voc_state()
         self.i2c.close()
 
     def stop_measurement(self) -> None:
@@ -262,88 +307,76 @@ class SEN5x:
 
     def start_measurement(self) -> None:
         self.i2c.write(CMD_START_MEASUREMENT)
+        self.data_ready.start()
         sleep(0.05)
 
-    def read_measurement(self) -> list:
-        if not self.read_data_ready_flag():
-            sleep(1)
-        self.i2c.write(CMD_READ_MEASURED_VALUES)
-        data = self.i2c.read(NBYTES_MEASURED_VALUES)
-        return data
+    # Wait for data-ready flag, returns NotReady if no new data before timeout
+    def read_measurement_into(self, timeout: float = None) -> memoryview:
+        ready = self.data_ready.wait(timeout)
+        if not ready:
+            return ready
+        self.i2c.transfer_into(CMD_READ_MEASURED_VALUES, self.view, EXEC_TIME)
+        return self.view
+
+    def read_measurement(self, timeout: float = None) -> list:
+        data = self.read_measurement_into(timeout)
+        return list(data) if data else data
 
 # I2C commands END
 #
 # Helper functions BEGIN
     def crc_calc(self, data: list) -> int:
-        crc = 0xFF
-        for i in range(2):
-            crc ^= data[i]
-            for _ in range(8, 0, -1):
-                if crc & 0x80:
-                    crc = (crc << 1) ^ 0x31
-                else:
-                    crc = crc << 1
-        return (crc & 0x0000FF)
+        return crc8(data)
+
+    # check_frame() counting responses with CRC mismatch (see metrics)
+    def check_frame(self, data, nbytes: int = -1) -> list:
+        bad = check_frame(data, nbytes)
+        if bad:
+            self.crc_errors += 1
+        return bad
 
     def int16_number_conversion(self, data: int) -> int:
-        return data if (data < 0x8000) else data - 0xFFFF
+        return data if (data < 0x8000) else data - 0x10000
+
+    def identity(self) -> dict:
+        return {"type": self.type, "sn": self.sn, "fw": self.fw}
 
     def is_cleaning(self) -> int:
         return self.cleaning
 
+    # Atomic write (tmp + fsync + rename), power loss leaves old or new file
     def to_file(self, filename: str, data: list, binary: int = 1) -> str:
         if binary == 1:
             bin_data = bytearray(data)
-            with open(filename, 'wb') as bin_file:
+            with open(filename + ".tmp", 'wb') as bin_file:
                bin_file.write(bin_data)
+               bin_file.flush()
+               os.fsync(bin_file.fileno())
+            os.replace(filename + ".tmp", filename)
         return filename
 
     def from_file(self, filename: str, binary: int = 1) -> list:
-        bin_file = open(filename, 'rb')
-        return list(bin_file.read())
+        with open(filename, 'rb') as bin_file:
+            return list(bin_file.read())
+
+    # One snapshot per product and serial number
+    def voc_state_filename(self, directory: str = None) -> str:
+        directory = self.state_dir if directory is None else directory
+        return os.path.join(directory or ".", self.type + '-' + self.sn + '-VOCalgo.bin')
 
 # Helper functions END
 #
 # Main functions
     def values_to_list(self, data: list, sensorType: str = "SEN55") -> dict:
-        values = ["pm1", "pm2", "pm4", "pm10", "h", "t", "voc"]
-        scale = {
-              "pm1":  10,
-              "pm2":  10,
-              "pm4":  10,
-              "pm10": 10,
-              "h":    100,
-              "t":    200,
-              "voc":  10,
-              "nox":  10
-        }
-        assoc = {
-              "t":    0.0,
-              "h":    0.0,
-              "pm1":  0.0,
-              "pm2":  0.0,
-              "pm4":  0.0,
-              "pm10": 0.0,
-              "voc":  0.0
-        }
         if sensorType == "SEN55":
-          values.append("nox")
-          assoc.update({"nox":0.0})
-
-        for block, (idx) in enumerate(values):
-            sensor_data = []
-            for i in range(0, SIZE_INTEGER, PACKET_SIZE):
-                offset = (block * SIZE_INTEGER) + i
-                if self.crc_calc(data[offset:offset+2]) != data[offset+2]:
-                    sensor_data.extend(SEN_DATA_ERR)
-                else:
-                    sensor_data.extend(data[offset:offset+2])
-
-            if block > 3:
-                assoc[idx] = self.int16_number_conversion(sensor_data[0] << 8 | sensor_data[1]) / scale[idx]
-            else:
-                assoc[idx] = (sensor_data[0] << 8 | sensor_data[1]) / scale[idx]
-        return assoc
+            return MEASURED_VALUES_SEN55.decode(data)
+        return MEASURED_VALUES_SEN54.decode(data)
+
+    # read_values() result with data and without CRC error (see Acquisition.wait_ready)
+    def valid_values(self, values: dict) -> bool:
+        if self.type == "SEN55":
+            return MEASURED_VALUES_SEN55.valid(values)
+        return MEASURED_VALUES_SEN54.valid(values)
 
     def status_to_str(self, sen_status_register: dict) -> str:
         sen_info = ""
@@ -356,7 +389,10 @@ class SEN5x:
         return sen_info
 
     def read_values(self) -> dict:
-        return self.values_to_list(self.read_measurement(), self.type)
+        data = self.read_measurement_into()
+        if not data:
+            return {}
+        return self.values_to_list(data, self.type)
 
     def read_status(self) -> dict:
         sen_status_register = self.read_status_register()
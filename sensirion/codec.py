@@ -0,0 +1,101 @@
+import struct
+from collections import namedtuple
+from sensirion.crc import check_frame, PACKET_SIZE
+
+# Size of data word without checksum byte, in bytes
+WORD_SIZE = 2
+
+# One value in response frame
+#   name   - key in result dict
+#   words  - number of 2-byte words (1 = 16 bit, 2 = 32 bit)
+#   type   - struct format char ('H', 'h', 'I', 'i', 'f')
+#   scale  - divider of raw value
+#   offset, gain - value = offset + gain * raw / scale
+Field = namedtuple('Field', ['name', 'words', 'type', 'scale', 'offset', 'gain'],
+                   defaults = [1, 0, 1])
+
+
+class FrameCodec:
+
+    # err - raw bytes used for value with bad CRC, None = drop whole frame
+    def __init__(self, fields: list, err: bytes = None, ndigits: int = None):
+        self.fields  = list(fields)
+        self.names   = [f.name for f in self.fields]
+        self.struct  = struct.Struct('>' + ''.join(f.type for f in self.fields))
+        self.words   = sum(f.words for f in self.fields)
+        self.nbytes  = self.words * PACKET_SIZE
+        self.err     = err
+        self.ndigits = ndigits
+        self.frames     = 0     # decoded frames
+        self.crc_errors = 0     # frames with CRC mismatch
+
+        # 16 bit only frames are unpacked directly from response, CRC bytes skipped by pad byte
+        self.direct = None
+        if all(f.words == 1 for f in self.fields):
+            self.direct = struct.Struct('>' + ''.join(f.type + 'x' for f in self.fields))
+
+        # word index -> field index
+        self.word_field = []
+        for idx, f in enumerate(self.fields):
+            self.word_field.extend([idx] * f.words)
+
+        # raw value used for field with bad CRC
+        self.err_raw = None
+        if err is not None:
+            self.err_raw = [struct.unpack('>' + f.type, err[:f.words * WORD_SIZE])[0]
+                            for f in self.fields]
+
+        # skip arithmetic for fields stored as-is
+        self.convert = [(f.name, f.offset, f.gain, f.scale)
+                        if (f.offset, f.gain, f.scale) != (0, 1, 1) else (f.name, None, None, None)
+                        for f in self.fields]
+
+        # decoded value of field with bad CRC, e.g. {"pm1": -127.0}
+        self.err_values = self.to_dict(self.err_raw) if self.err_raw is not None else {}
+
+    # True for decoded frame without CRC error (no field holds substituted err value)
+    def valid(self, values: dict) -> bool:
+        return bool(values) and all(values.get(name) != value for name, value in self.err_values.items())
+
+    # Remove checksum bytes [d1, d2, crc, d1, d2, crc, ...] -> [d1, d2, d1, d2, ...]
+    def strip(self, data, payload: bytearray = None) -> bytearray:
+        if payload is None:
+            payload = bytearray(data[:self.nbytes])
+            del payload[WORD_SIZE::PACKET_SIZE]
+            return payload
+        payload[0::WORD_SIZE] = data[0:self.nbytes:PACKET_SIZE]
+        payload[1::WORD_SIZE] = data[1:self.nbytes:PACKET_SIZE]
+        return payload
+
+    # data    - response incl. CRC bytes (list, bytes, bytearray or memoryview)
+    # payload - optional preallocated buffer of words*2 bytes for 32 bit frames
+    def decode(self, data, payload: bytearray = None) -> dict:
+        if isinstance(data, str) or len(data) < self.nbytes:
+            return {}
+        self.frames += 1
+        bad = check_frame(data, self.nbytes)
+        if bad:
+            self.crc_errors += 1
+            if self.err is None:
+                return {}
+        if self.direct is not None and not isinstance(data, list):
+            raw = self.direct.unpack_from(data)
+        else:
+            raw = self.struct.unpack_from(self.strip(data, payload))
+        if bad:
+            raw = list(raw)
+            for word in bad:
+                idx = self.word_field[word]
+                raw[idx] = self.err_raw[idx]
+        return self.to_dict(raw)
+
+    def to_dict(self, raw: tuple) -> dict:
+        assoc = {}
+        ndigits = self.ndigits
+        for (name, offset, gain, scale), value in zip(self.convert, raw):
+            if scale is not None:
+                value = offset + gain * value / scale
+            if ndigits is not None:
+                value = round(value, ndigits)
+            assoc[name] = value
+        return assoc
@@ -0,0 +1,57 @@
+#CRC-8 used by Sensirion sensors (SPS30, SEN5x, SHT40)
+#polynomial 0x31 (x^8 + x^5 + x^4 + 1), init 0xFF, no reflection, no final XOR
+
+CRC8_POLYNOMIAL = 0x31
+CRC8_INIT       = 0xFF
+
+# Packet size including checksum byte [data1, data2, checksum]
+PACKET_SIZE = 3
+
+
+def _crc8_table(polynomial: int = CRC8_POLYNOMIAL) -> bytes:
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ polynomial) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+        table[i] = crc
+    return bytes(table)
+
+
+CRC8_TABLE = _crc8_table()
+
+
+# CRC of one 2-byte word starting at data[offset]
+def crc8(data, offset: int = 0) -> int:
+    return CRC8_TABLE[CRC8_TABLE[CRC8_INIT ^ data[offset]] ^ data[offset+1]]
+
+
+# CRC of arbitrary length data
+def crc8_bytes(data) -> int:
+    crc = CRC8_INIT
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+# Verify whole response [d1, d2, crc, d1, d2, crc, ...], return indices of bad words
+def check_frame(data, nbytes: int = -1) -> list:
+    table = CRC8_TABLE
+    if nbytes < 0:
+        nbytes = len(data)
+    bad = []
+    for i in range(0, nbytes - PACKET_SIZE + 1, PACKET_SIZE):
+        if table[table[CRC8_INIT ^ data[i]] ^ data[i+1]] != data[i+2]:
+            bad.append(i // PACKET_SIZE)
+    return bad
+
+
+# Build write payload, insert CRC after each 2-byte word
+def add_crc(data) -> list:
+    result = []
+    for i in range(0, len(data) - 1, 2):
+        result.extend((data[i], data[i+1], crc8(data, i)))
+    return result
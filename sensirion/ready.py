@@ -0,0 +1,97 @@
+from time import sleep, monotonic
+
+# Adaptive data-ready polling
+#
+# Learns typical interval between two ready measurements (EWMA) and sleeps until
+# just before next expected ready time, then polls ready flag with exponential
+# backoff until deadline.
+
+
+class NotReady:
+
+    # Result of read when data did not become ready before deadline, evaluates as False
+    def __init__(self, waited: float = 0.0, polls: int = 0):
+        self.waited = waited
+        self.polls  = polls
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __repr__(self) -> str:
+        return f"NotReady(waited={self.waited:.3f}s, polls={self.polls})"
+
+
+class DataReady:
+
+    # ready        - callable returning True when new data is available
+    # timeout      - default deadline of wait() [s]
+    # min_delay    - first poll delay, doubled (backoff) up to max_delay [s]
+    # lead         - wake up this long before expected ready time [s]
+    # max_interval - longer gaps (e.g. measurement stopped) are not learned [s]
+    def __init__(self, ready, timeout: float = 2.0,
+                       min_delay: float = 0.01, max_delay: float = 0.2, backoff: float = 2.0,
+                       lead: float = 0.02, alpha: float = 0.25, max_interval: float = 10.0,
+                       clock = monotonic, sleep = sleep):
+        self.ready        = ready
+        self.timeout      = timeout
+        self.min_delay    = min_delay
+        self.max_delay    = max_delay
+        self.backoff      = backoff
+        self.lead         = lead
+        self.alpha        = alpha
+        self.max_interval = max_interval
+        self.clock        = clock
+        self.sleep        = sleep
+
+        self.interval = None    # learned ready interval [s]
+        self.last     = None    # time of last ready (or measurement start)
+        self.polls    = 0       # total ready flag reads
+        self.misses   = 0       # ready flag reads returning not ready
+        self.timeouts = 0       # wait() calls ending with NotReady
+
+    # Measurement (re)started, next data expected one interval from now
+    def start(self) -> None:
+        self.last = self.clock()
+
+    def learn(self, now: float) -> None:
+        if self.last is not None:
+            sample = now - self.last
+            if 0 < sample <= self.max_interval:
+                if self.interval is None:
+                    self.interval = sample
+                else:
+                    self.interval += self.alpha * (sample - self.interval)
+        self.last = now
+
+    # Time when next data is expected, None if unknown
+    def expected(self) -> float:
+        if self.interval is None or self.last is None:
+            return None
+        return self.last + self.interval
+
+    def wait(self, timeout: float = None):
+        start    = self.clock()
+        deadline = start + (self.timeout if timeout is None else timeout)
+        polls    = 0
+
+        expected = self.expected()
+        if expected is not None:
+            wake = min(expected - self.lead, deadline)
+            if wake > start:
+                self.sleep(wake - start)
+
+        delay = self.min_delay
+        while True:
+            polls += 1
+            self.polls += 1
+            ready = self.ready()
+            now = self.clock()
+            if ready:
+                self.learn(now)
+                return True
+            self.misses += 1
+            if now >= deadline:
+                self.timeouts += 1
+                return NotReady(now - start, polls)
+            self.sleep(min(delay, deadline - now))
+            delay = min(delay * self.backoff, self.max_delay)
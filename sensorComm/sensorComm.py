@@ -1,5 +1,5 @@
-import urllib.request
 import json
+from httpPool.httpPool import get_pool
 
 #API descr at https://github.com/opendata-stuttgart/meta/wiki/EN-APIs
 
@@ -22,47 +22,66 @@ MAP_TO_SC = {
 }
 
 
+# JSON body of push-sensor-data request, fields without API value type are skipped
+def sensor_json(data: dict, software_version: str = '1.0', sampling_rate: int = 60) -> str:
+    json_values = {
+        "software_version": software_version,
+        "sampling_rate": sampling_rate,
+        "sensordatavalues":[]
+    }
+    listObj = []
+    for key in data:
+        if key in MAP_TO_SC:
+          val = {
+              "value_type": MAP_TO_SC[key],
+              "value": data[key]
+          }
+          listObj.append(val)
+    json_values["sensordatavalues"] = listObj
+    return json.dumps(json_values)
+
 
 class sensorCommunity:
 
-    def __init__(self, sensor_id:str = "", sampl_rate: int = 60, sw_version: str = '1.0'):
+    def __init__(self, sensor_id:str = "", sampl_rate: int = 60, sw_version: str = '1.0',
+                       timeout: int = 10, api_url: str = SC_API_URL, pool = None):
         self.sampling_rate    = sampl_rate
         self.software_version = sw_version
         self.sensor_id        = sensor_id
+        self.timeout          = timeout
+        self.api_url          = api_url
+        self.pool             = get_pool() if pool is None else pool
         self.data             = None
+        self.last_response    = None
 
     def create_json(self, data: dict) -> None:
-        json_values = {
-            "software_version": self.software_version,
-            "sampling_rate": self.sampling_rate,
-            "sensordatavalues":[]
-        }
-        listObj = []
-        for key in data:
-            if key in MAP_TO_SC:
-              val = {
-                  "value_type": MAP_TO_SC[key],
-                  "value": data[key]
-              }
-              listObj.append(val)
-        json_values["sensordatavalues"] = listObj
-        self.data = json.dumps(json_values)
+        self.data = sensor_json(data, self.software_version, self.sampling_rate)
 
-    def post(self, Xpin:int = 1) -> str:
+    # Returns response body, None on failure
+    # Connection to API is kept open and reused by next post (see httpPool)
+    def post(self, Xpin:int = 1, data: str = None, timeout: float = None) -> str:
+        if data is None:
+            data = self.data
+        if timeout is None:
+            timeout = self.timeout
+        self.last_response = None
+        headers = {'User-Agent': "Python/AirQmonitor"}
         try:
-            url = SC_API_URL
+            url = self.api_url
 #            print("POST Data ", url)
             headers = {
                 'User-Agent'  : "Python/AirQmonitor",
-                'Connection'  : "close",
                 'Content-Type': "application/json",
-                'X-Pin'       : Xpin,
+                'X-Pin'       : str(Xpin),
                 'X-Sensor'    : self.sensor_id
             }
-            postData = self.data.encode('ascii')
-            req = urllib.request.Request(url, postData, headers = headers)
-            resp = urllib.request.urlopen(req)
-            return resp.read()
+            postData = data.encode('ascii')
+            resp = self.pool.request("POST", url, postData, headers, timeout = timeout)
+            self.last_response = resp
+            if resp.status >= 400:
+                print("HTTP Error:", resp.status, resp.reason)
+                return None
+            return resp.body
 
         except Exception as e:
             print("Unable to POST for client", headers['User-Agent'])
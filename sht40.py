@@ -1,6 +1,8 @@
 import sys
 from time import sleep
 from i2c.i2c import I2C
+from sensirion.crc import crc8, check_frame
+from sensirion.codec import Field, FrameCodec
 
 # I2C commands
 CMD_RESET = [0x94]
@@ -26,79 +28,80 @@ NBYTES_LENGTH = 6
 PACKET_SIZE  = 3
 SIZE_INTEGER = 3
 
+# Measurement frame layout, T = -45 + 175 * raw/65535, RH = -6 + 125 * raw/65535
+FRAME_MEASUREMENT = [
+    Field("t", 1, 'H', 65535, -45, 175),
+    Field("h", 1, 'H', 65535, -6,  125)
+]
+MEASURED_VALUES = FrameCodec(FRAME_MEASUREMENT)
+
+# Frame decoders of this driver (CRC error / frame counters, see metrics watch_driver)
+CODECS = (MEASURED_VALUES,)
+
 class SHT40:
 
 # Init I2C BUS
     def __init__(self,  bus: int = 1, address: int = 0x44):
+        self.crc_errors = 0
         self.i2c  = I2C(bus, address)
+        # preallocated response buffer, reused by every measurement read
+        self.buf  = bytearray(NBYTES_LENGTH)
+        self.view = memoryview(self.buf)
         self.type = "SHT40"
         self.sn   = self.serial_number()
 
 
 # I2C commands BEGIN
     def serial_number(self) -> str:
-        self.i2c.write(CMD_SERIAL_NUMBER)
-        data = self.i2c.read(NBYTES_LENGTH)
+        data = self.i2c.transfer(CMD_SERIAL_NUMBER, NBYTES_LENGTH)
+        if self.check_frame(data):
+            return "CRC mismatch"
         result = ""
         for i in range(0, NBYTES_LENGTH, PACKET_SIZE):
-            if self.crc_calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatch"
             result += "".join(map(str, data[i:i+2]))
         return result
 
     def activate_heater(self, power_period: str = '20_01') -> str:
         self.i2c.write([CMD_HEATER[power_period]])
         data = self.i2c.read(NBYTES_LENGTH)
-        for i in range(0, NBYTES_LENGTH, PACKET_SIZE):
-            if self.crc_calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatch"
+        if self.check_frame(data):
+            return "CRC mismatch"
         return data
 
     def reset(self) -> None:
         self.i2c.write(CMD_RESET)
 
+    def read_measurement_into(self, res: str = 'hi') -> memoryview:
+        # SHT40 needs conversion time, measurement can't use I2C_RDWR transfer,
+        # bus is held for whole write/wait/read sequence
+        with self.i2c.transaction():
+            self.i2c.write([CMD_MEASURE[res]])
+            sleep(0.01)
+            self.i2c.readinto(self.view)
+        return self.view
+
     def read_measurement(self, res: str = 'hi') -> list:
-        self.i2c.write([CMD_MEASURE[res]])
-        sleep(0.01)
-        data = self.i2c.read(NBYTES_LENGTH)
-        for i in range(0, NBYTES_LENGTH, PACKET_SIZE):
-            if self.crc_calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatch"
+        data = list(self.read_measurement_into(res))
+        if self.check_frame(data):
+            return "CRC mismatch"
         return data
 # I2C commands END
 #
 # Helper functions BEGIN
     def crc_calc(self, data: list) -> int:
-        crc = 0xFF
-        for i in range(2):
-            crc ^= data[i]
-            for _ in range(8, 0, -1):
-                if crc & 0x80:
-                    crc = (crc << 1) ^ 0x31
-                else:
-                    crc = crc << 1
-        return (crc & 0x0000FF)
+        return crc8(data)
+
+    # check_frame() counting responses with CRC mismatch (see metrics)
+    def check_frame(self, data, nbytes: int = -1) -> list:
+        bad = check_frame(data, nbytes)
+        if bad:
+            self.crc_errors += 1
+        return bad
 # Helper functions END
 #
 # Main functions
     def values_to_list(self, data: list) -> dict:
-        values = ["t", "h"]
-        assoc = {
-              "t": 0.0,
-              "h": 0.0
-        }
-        for block, (idx) in enumerate(values):
-            sensor_data = []
-            for i in range(0, SIZE_INTEGER, PACKET_SIZE):
-                offset = (block * SIZE_INTEGER) + i
-                if self.crc_calc(data[offset:offset+2]) != data[offset+2]:
-                    return {}
-                sensor_data.extend(data[offset:offset+2])
-            if(idx == 't'):
-                assoc[idx] = -45 + 175 *(sensor_data[0] << 8 | sensor_data[1])/65535
-            if(idx == 'h'):
-                assoc[idx] = -6 + 125 *(sensor_data[0] << 8 | sensor_data[1])/65535
-        return assoc
+        return MEASURED_VALUES.decode(data)
 
     def read_values(self, res: str = 'hi') -> dict:
-        return self.values_to_list(self.read_measurement(res))
+        return self.values_to_list(self.read_measurement_into(res))
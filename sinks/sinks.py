@@ -0,0 +1,383 @@
+import os
+import sys
+import json
+import threading
+from time import time, sleep, monotonic
+from concurrent.futures import ThreadPoolExecutor, wait
+from loader.loader import sink as sink_class, sink_module
+from uploadQueue.uploadQueue import Rejected, check_response
+
+# Sink interface and concurrent fan-out
+#
+# Every sink turns values dict into payloads (serialize, cached until values change,
+# or reading timestamp too for sinks writing it)
+# and sends them with its own timeout and retry policy. FanOut delivers reading set
+# to all sinks in parallel, time per cycle is that of the slowest sink.
+# With on_failure journal (UploadQueue) the journal is the only retry path: payloads
+# of sink with journal backlog go straight behind it (order kept, no second copy),
+# journaled payloads are sent by resend(), which keeps sink health up to date.
+#
+#   fanout = FanOut([ScSink("sc", "raspi-xxxxxx", {1: ["pm1", "pm2"], 11: ["t", "h"]}, retries = 0),
+#                    FileSink("file", "/home/pi/AirQmonitor/readings.jsonl")],
+#                   on_failure = lambda name, key, payload: worker.submit(name, payload, key),
+#                   backlog = worker.backlog)
+#   uq.register("sc", sc_sink.resend, sc_sink.timeout)
+#   fanout.submit(reading.values, {"pm2": "sps30-9B7E4B5F", ...}, ts)   # background, Future of {sink: ok}
+#   fanout.health()
+
+TIMEOUT      = 10       # [s] per send
+RETRIES      = 1        # extra attempts within one delivery
+RETRY_DELAY  = 1.0      # [s] between attempts
+MAX_FAILURES = 3        # consecutive failed deliveries until sink is down
+MIN_BACKOFF  = 30       # [s] down sink is skipped this long, doubled up to MAX_BACKOFF
+MAX_BACKOFF  = 1800     # [s]
+
+
+class Health:
+
+    def __init__(self):
+        self.deliveries = 0
+        self.failures   = 0         # consecutive failed deliveries
+        self.failed     = 0         # failed deliveries total
+        self.skipped    = 0         # deliveries skipped while down
+        self.retries    = 0
+        self.last_ok    = None      # wall clock time
+        self.last_error = None
+        self.latency    = None      # [s] last delivery
+        self.retry_at   = 0.0       # monotonic time, sink is down until then
+
+    def up(self, now: float = None) -> bool:
+        return (monotonic() if now is None else now) >= self.retry_at
+
+    def state(self) -> str:
+        if not self.up():
+            return "down"
+        return "failing" if self.failures else "ok"
+
+    def snapshot(self) -> dict:
+        return {
+            "state":      self.state(),
+            "deliveries": self.deliveries,
+            "failures":   self.failures,
+            "failed":     self.failed,
+            "skipped":    self.skipped,
+            "retries":    self.retries,
+            "last_ok":    self.last_ok,
+            "last_error": self.last_error,
+            "latency":    self.latency
+        }
+
+
+class Sink:
+
+    timestamped = False     # payload contains reading timestamp
+
+    def __init__(self, name: str, timeout: float = TIMEOUT, retries: int = RETRIES,
+                       retry_delay: float = RETRY_DELAY, max_failures: int = MAX_FAILURES):
+        self.name         = name
+        self.timeout      = timeout
+        self.retries      = retries
+        self.retry_delay  = retry_delay
+        self.max_failures = max_failures
+        self.health       = Health()
+        self.cache_key    = None
+        self.cache        = []
+
+    # values -> [(key, payload)], payload is JSON-serializable (journal)
+    # sources - field -> id of sensor it was read from (e.g. "sps30-<serial>"), may be None
+    # ts      - wall clock time of reading
+    def build(self, values: dict, sources: dict = None, ts: float = None) -> list:
+        raise NotImplementedError
+
+    # Returns True when destination accepted payload, raises Rejected when it never will
+    def send(self, payload: dict, timeout: float = None) -> bool:
+        raise NotImplementedError
+
+    # Payloads of unchanged values (same reading delivered again) are reused,
+    # timestamped sinks reuse payloads of same reading set only
+    def serialize(self, values: dict, sources: dict = None, ts: float = None) -> list:
+        if ts is None:
+            ts = time()
+        key = (tuple(values.items()), tuple(sources.items()) if sources else None,
+               ts if self.timestamped else None)
+        if key != self.cache_key:
+            self.cache     = self.build(values, sources, ts)
+            self.cache_key = key
+        return self.cache
+
+    # Longest time one delivery of one payload can take [s]
+    def budget(self) -> float:
+        return (self.retries + 1) * self.timeout + self.retries * self.retry_delay
+
+    def attempt(self, payload: dict, deadline: float) -> bool:
+        for i in range(self.retries + 1):
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+            if i:
+                self.health.retries += 1
+            try:
+                if self.send(payload, min(self.timeout, remaining)):
+                    return True
+            except Rejected as e:
+                self.health.last_error = repr(e)
+                return False        # not retried, journal moves it to dead rows
+            except Exception as e:
+                self.health.last_error = repr(e)
+            if i < self.retries:
+                sleep(min(self.retry_delay, max(deadline - monotonic(), 0)))
+        return False
+
+    # Returns list of (key, payload) not delivered
+    def deliver(self, values: dict, sources: dict = None, ts: float = None) -> list:
+        health = self.health
+        payloads = self.serialize(values, sources, ts)
+        if not payloads:
+            return []
+        now = monotonic()
+        if not health.up(now):
+            health.skipped += 1
+            return list(payloads)
+        health.deliveries += 1
+        deadline = now + self.budget() * len(payloads)
+        failed = [(key, payload) for key, payload in payloads if not self.attempt(payload, deadline)]
+        health.latency = monotonic() - now
+        if failed:
+            health.failures += 1
+            health.failed   += 1
+            if health.failures >= self.max_failures:
+                backoff = min(MIN_BACKOFF * 2 ** (health.failures - self.max_failures), MAX_BACKOFF)
+                health.retry_at = monotonic() + backoff
+        else:
+            health.failures = 0
+            health.last_ok  = time()
+        return failed
+
+    # Send of journaled payload, result counts in health like a delivery
+    def resend(self, payload: dict, timeout: float = None) -> bool:
+        health = self.health
+        try:
+            ok = self.send(payload, self.timeout if timeout is None else timeout)
+        except Rejected as e:
+            health.last_error = repr(e)
+            raise
+        except Exception as e:
+            health.last_error = repr(e)
+            ok = False
+        if ok:
+            health.failures = 0
+            health.last_ok  = time()
+            health.retry_at = 0.0
+        else:
+            health.failures += 1
+            health.failed   += 1
+        return ok
+
+    def close(self) -> None:
+        pass
+
+
+class ScSink(Sink):
+
+    # pins - X-Pin -> fields, e.g. {1: ["pm1", "pm2"], 11: ["t", "h", "p"]}
+    def __init__(self, name: str, sensor_id: str, pins: dict, **kwargs):
+        super().__init__(name, **kwargs)
+        self.sc   = sink_class("sc")(sensor_id, timeout = self.timeout)
+        self.pins = {int(pin): fields for pin, fields in pins.items()}
+
+    # One payload per pin with at least one field present
+    def build(self, values: dict, sources: dict = None, ts: float = None) -> list:
+        sensor_json = sink_module("sc").sensor_json
+        result = []
+        for pin, fields in self.pins.items():
+            data = {k: values[k] for k in fields if k in values}
+            if data:
+                body = sensor_json(data, self.sc.software_version, self.sc.sampling_rate)
+                result.append((pin, {"pin": pin, "data": body}))
+        return result
+
+    def send(self, payload: dict, timeout: float = None) -> bool:
+        if self.sc.post(payload["pin"], payload["data"], timeout) is not None:
+            return True
+        check_response(self.sc.last_response)
+        return False
+
+
+class TmepSink(Sink):
+
+    def __init__(self, name: str, domain: str, fields: list, guid: str = "", **kwargs):
+        super().__init__(name, **kwargs)
+        self.tmep   = sink_class("tmep")(timeout = self.timeout)
+        self.domain = domain
+        self.guid   = guid
+        self.fields = fields
+
+    def build(self, values: dict, sources: dict = None, ts: float = None) -> list:
+        fields = [k for k in self.fields if k in values]
+        if not fields:
+            return []
+        return [(None, {"query": sink_module("tmep").query_str(fields, values)})]
+
+    def send(self, payload: dict, timeout: float = None) -> bool:
+        if self.tmep.push(self.domain, self.guid, payload["query"], timeout) is not None:
+            return True
+        check_response(self.tmep.last_response)
+        return False
+
+
+# JSON lines with timestamp, one line per reading set
+class FileSink(Sink):
+
+    timestamped = True
+
+    def __init__(self, name: str, filename: str, fields: list = None, **kwargs):
+        kwargs.setdefault("retries", 0)
+        super().__init__(name, **kwargs)
+        self.filename = filename
+        self.fields   = fields
+        self.file     = None
+        self.lock     = threading.Lock()
+
+    def build(self, values: dict, sources: dict = None, ts: float = None) -> list:
+        if self.fields is not None:
+            values = {k: values[k] for k in self.fields if k in values}
+        return [(None, {"line": json.dumps(dict(values, ts = time() if ts is None else ts))})] if values else []
+
+    def send(self, payload: dict, timeout: float = None) -> bool:
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.filename, "a")
+            self.file.write(payload["line"] + "\n")
+            self.file.flush()
+        return True
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class StdoutSink(FileSink):
+
+    def __init__(self, name: str, fields: list = None, stream = None, **kwargs):
+        super().__init__(name, None, fields, **kwargs)
+        self.stream = sys.stdout if stream is None else stream
+
+    def send(self, payload: dict, timeout: float = None) -> bool:
+        with self.lock:
+            self.stream.write(payload["line"] + "\n")
+            self.stream.flush()
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+# One message per field on <prefix>/<sensor id>/<field>, e.g. airq/sps30-9B7E4B5F/pm2
+# Messages are handed to MQTT client buffer, acknowledged asynchronously (QoS 1)
+class MqttSink(Sink):
+
+    def __init__(self, name: str, host: str, port: int = 1883, prefix: str = "airq",
+                       client_id: str = None, qos: int = 1, retain: bool = False,
+                       fields: list = None, **kwargs):
+        options = {k: kwargs.pop(k) for k in ("username", "password", "keepalive", "max_inflight", "max_buffer")
+                   if k in kwargs}
+        kwargs.setdefault("retries", 0)
+        super().__init__(name, **kwargs)
+        from mqtt.mqtt import MQTTClient
+        client_id   = client_id or f"airq-{os.uname().nodename}-{os.getpid()}"
+        self.client = MQTTClient(host, port, client_id, timeout = self.timeout, **options)
+        self.prefix = prefix
+        self.qos    = qos
+        self.retain = retain
+        self.fields = fields
+        self.client.start()
+
+    def build(self, values: dict, sources: dict = None, ts: float = None) -> list:
+        sources = sources or {}
+        return [(field, {"topic": f"{self.prefix}/{sources.get(field, 'station')}/{field}", "payload": str(value)})
+                for field, value in values.items() if self.fields is None or field in self.fields]
+
+    def send(self, payload: dict, timeout: float = None) -> bool:
+        return self.client.publish(payload["topic"], payload["payload"].encode(), self.qos, self.retain)
+
+    # Buffered messages get timeout to be acknowledged
+    def close(self) -> None:
+        self.client.flush(self.timeout)
+        self.client.close()
+
+
+SINKS = {
+    "sc":     ScSink,
+    "tmep":   TmepSink,
+    "file":   FileSink,
+    "stdout": StdoutSink,
+    "mqtt":   MqttSink,
+}
+
+
+# Sink from config dict, e.g. {"sink": "file", "filename": "readings.jsonl"}
+def create(config: dict, name: str = None) -> Sink:
+    args = {k: v for k, v in config.items() if k not in ("sink", "name")}
+    return SINKS[config["sink"]](name or config.get("name", config["sink"]), **args)
+
+
+class FanOut:
+
+    # on_failure - called as on_failure(sink name, key, payload) for every payload
+    #              not delivered (e.g. to persistent journal)
+    # backlog    - backlog(sink name) is True while older payloads of sink wait in
+    #              journal, new ones are handed to on_failure without sending
+    def __init__(self, sinks: list, on_failure = None, backlog = None):
+        self.sinks      = list(sinks)
+        self.on_failure = on_failure
+        self.backlog    = backlog
+        self.executor   = ThreadPoolExecutor(max_workers = max(len(self.sinks), 1),
+                                             thread_name_prefix = "sink")
+        self.dispatcher = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "fanout")
+        self.last       = None      # [s] duration of last delivery
+        self.closed     = False
+
+    def deliver_sink(self, sink: Sink, values: dict, sources: dict = None, ts: float = None) -> bool:
+        if self.on_failure is not None and self.backlog is not None and self.backlog(sink.name):
+            sink.health.skipped += 1
+            failed = list(sink.serialize(values, sources, ts))
+        else:
+            failed = sink.deliver(values, sources, ts)
+        if self.on_failure is not None:
+            for key, payload in failed:
+                self.on_failure(sink.name, key, payload)
+        return not failed
+
+    # Deliver to all sinks in parallel, returns {sink name: delivered}
+    def deliver(self, values: dict, sources: dict = None, ts: float = None) -> dict:
+        start   = monotonic()
+        futures = {self.executor.submit(self.deliver_sink, s, values, sources, ts): s.name for s in self.sinks}
+        wait(futures)
+        self.last = monotonic() - start
+        return {name: f.exception() is None and f.result() for f, name in futures.items()}
+
+    # Deliver in background, reading sets are delivered in submit order
+    # ts - wall clock time of reading, default submit time (not delivery time)
+    # After close() values are handed to on_failure (journal) right away
+    def submit(self, values: dict, sources: dict = None, ts: float = None):
+        if ts is None:
+            ts = time()
+        if self.closed:
+            if self.on_failure is not None:
+                for s in self.sinks:
+                    for key, payload in s.serialize(values, sources, ts):
+                        self.on_failure(s.name, key, payload)
+            return None
+        return self.dispatcher.submit(self.deliver, dict(values), sources, ts)
+
+    def health(self) -> dict:
+        return {s.name: s.health.snapshot() for s in self.sinks}
+
+    def close(self, wait: bool = True) -> None:
+        self.closed = True
+        self.dispatcher.shutdown(wait = wait)
+        self.executor.shutdown(wait = wait)
+        for s in self.sinks:
+            s.close()
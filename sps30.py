@@ -1,7 +1,11 @@
 import sys
+import struct
 from time import sleep
 from datetime import datetime
 from i2c.i2c import I2C
+from sensirion.crc import crc8, check_frame, add_crc
+from sensirion.codec import Field, FrameCodec
+from sensirion.ready import DataReady, NotReady
 
 # I2C commands
 CMD_START_MEASUREMENT      = [0x00, 0x10]
@@ -38,58 +42,86 @@ PACKET_SIZE = 3
 SIZE_FLOAT = 6  # IEEE754 float
 SIZE_INTEGER = 3  # unsigned 16 bit integer
 
+# Data-ready wait deadline [s], new values every 1s
+DATA_READY_TIMEOUT = 2.0
+
 # Error value
 SPS_DATA_ERR = [0xC2,0xFE,0x00,0x00]  #-127.0
 #[0xBF,0x80,0x00,0x00]  #-1.0
 
+# Measured values frame layout (IEEE754 float)
+FRAME_MEASURED_VALUES_FLOAT = [
+    Field("pm1",  2, 'f'),
+    Field("pm2",  2, 'f'),
+    Field("pm4",  2, 'f'),
+    Field("pm10", 2, 'f'),
+    Field("nc0",  2, 'f'),
+    Field("nc1",  2, 'f'),
+    Field("nc2",  2, 'f'),
+    Field("nc4",  2, 'f'),
+    Field("nc10", 2, 'f'),
+    Field("tps",  2, 'f')
+]
+MEASURED_VALUES_FLOAT = FrameCodec(FRAME_MEASURED_VALUES_FLOAT, bytes(SPS_DATA_ERR), 3)
+
+# Frame decoders of this driver (CRC error / frame counters, see metrics watch_driver)
+CODECS = (MEASURED_VALUES_FLOAT,)
+
 class SPS30:
 
 # Init I2C BUS
-    def __init__(self,  bus: int = 1, address: int = 0x69):
+    # cached - identity() of previous run, type and firmware are reused if serial matches
+    def __init__(self,  bus: int = 1, address: int = 0x69, cached: dict = None):
         self.cleaning    = 0
         self.cleaning_ts = 0
+        self.crc_errors  = 0
         self.i2c         = I2C(bus, address)
-        self.type        = self.product_type()
+        # preallocated response buffers, reused by every measurement read
+        self.buf         = bytearray(NBYTES_MEASURED_VALUES_FLOAT)
+        self.view        = memoryview(self.buf)
+        self.data_ready  = DataReady(self.read_data_ready_flag, DATA_READY_TIMEOUT)
+        self.payload     = bytearray(MEASURED_VALUES_FLOAT.words * 2)
         self.sn          = self.serial_number()
-        self.fw          = self.firmware_version()
+        if cached and cached.get("sn") == self.sn:
+            self.type    = cached["type"]
+            self.fw      = cached["fw"]
+        else:
+            self.type    = self.product_type()
+            self.fw      = self.firmware_version()
 
 # I2C commands BEGIN
     def serial_number(self) -> str:
-        self.i2c.write(CMD_SERIAL_NUMBER)
-        data = self.i2c.read(NBYTES_SERIAL_NUMBER)
+        data = self.i2c.transfer(CMD_SERIAL_NUMBER, NBYTES_SERIAL_NUMBER)
+        if self.check_frame(data):
+            return "CRC mismatch"
         result = ""
         for i in range(0, NBYTES_SERIAL_NUMBER, PACKET_SIZE):
-            if self.crc_calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatch"
             if(data[i:i+2] != [0x00, 0x00]):
                 result += "".join(map(chr, data[i:i+2]))
         return str(result)
 
     def firmware_version(self) -> str:
-        self.i2c.write(CMD_FIRMWARE_VERSION)
-        data = self.i2c.read(NBYTES_FIRMWARE_VERSION)
-        if self.crc_calc(data[:2]) != data[2]:
+        data = self.i2c.transfer(CMD_FIRMWARE_VERSION, NBYTES_FIRMWARE_VERSION)
+        if self.check_frame(data):
             return "CRC mismatch"
         return ".".join(map(str, data[:2]))
 
     def product_type(self) -> str:
-        self.i2c.write(CMD_PRODUCT_TYPE)
-        data = self.i2c.read(NBYTES_PRODUCT_TYPE)
+        data = self.i2c.transfer(CMD_PRODUCT_TYPE, NBYTES_PRODUCT_TYPE)
+        if self.check_frame(data):
+            return "CRC mismatch"
         result = ""
-        for i in range(0, NBYTES_PRODUCT_TYPE, 3):
-            if self.crc_calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatch"
+        for i in range(0, NBYTES_PRODUCT_TYPE, PACKET_SIZE):
             if(data[i:i+2] != [0x00, 0x00]):
                 result += "".join(map(chr, data[i:i+2]))
         return str(result)
 
     def read_status_register(self) -> dict:
-        self.i2c.write(CMD_READ_STATUS_REGISTER)
-        data = self.i2c.read(NBYTES_READ_STATUS_REGISTER)
+        data = self.i2c.transfer(CMD_READ_STATUS_REGISTER, NBYTES_READ_STATUS_REGISTER)
+        if self.check_frame(data):
+            return "CRC mismatch"
         status = []
         for i in range(0, NBYTES_READ_STATUS_REGISTER, PACKET_SIZE):
-            if self.crc_calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatch"
             status.extend(data[i:i+2])
         binary = '{:032b}'.format(
             status[0] << 24 | status[1] << 16 | status[2] << 8 | status[3])
@@ -110,9 +142,9 @@ class SPS30:
         self.i2c.write(CMD_CLEAR_STATUS_REGISTER)
 
     def read_data_ready_flag(self) -> bool:
-        self.i2c.write(CMD_READ_DATA_READY_FLAG)
-        data = self.i2c.read(NBYTES_READ_DATA_READY_FLAG)
-        if self.crc_calc(data[:2]) != data[2]:
+        data = self.view[:NBYTES_READ_DATA_READY_FLAG]
+        self.i2c.transfer_into(CMD_READ_DATA_READY_FLAG, data)
+        if self.check_frame(data):
             return False
         return True if data[1] == 1 else False
 
@@ -136,12 +168,11 @@ class SPS30:
             'h' : 60,
             's' : 1
         }
-        self.i2c.write(CMD_AUTO_CLEANING_INTERVAL)
-        data = self.i2c.read(NBYTES_AUTO_CLEANING_INTERVAL)
+        data = self.i2c.transfer(CMD_AUTO_CLEANING_INTERVAL, NBYTES_AUTO_CLEANING_INTERVAL)
+        if self.check_frame(data):
+            return "CRC mismatch"
         interval = []
-        for i in range(0, NBYTES_AUTO_CLEANING_INTERVAL, 3):
-            if self.crc_calc(data[i:i+2]) != data[i+2]:
-                return "CRC mismatch"
+        for i in range(0, NBYTES_AUTO_CLEANING_INTERVAL, PACKET_SIZE):
             interval.extend(data[i:i+2])
         ret = (interval[0] << 24 | interval[1] << 16 | interval[2] << 8 | interval[3])
         return ret / dividier[unit]
@@ -153,11 +184,7 @@ class SPS30:
         interval.append((seconds & 0x00ff0000) >> 16)
         interval.append((seconds & 0x0000ff00) >> 8)
         interval.append(seconds & 0x000000ff)
-        data = CMD_AUTO_CLEANING_INTERVAL
-        data.extend([interval[0], interval[1]])
-        data.append(self.crc_calc(data[2:4]))
-        data.extend([interval[2], interval[3]])
-        data.append(self.crc_calc(data[5:7]))
+        data = CMD_AUTO_CLEANING_INTERVAL + add_crc(interval)
         self.i2c.write(data)
         sleep(0.05)
         return self.read_auto_cleaning_interval()
@@ -173,43 +200,40 @@ class SPS30:
         self.i2c.write(CMD_STOP_MEASUREMENT)
 
     def start_measurement(self) -> None:
-        data = CMD_START_MEASUREMENT_IEE
-        data.append(self.crc_calc(data[2:4]))
+        data = CMD_START_MEASUREMENT_IEE[:2] + add_crc(CMD_START_MEASUREMENT_IEE[2:])
         self.i2c.write(data)
+        self.data_ready.start()
         sleep(0.05)
 
-    def read_measurement(self) -> list:
-        if not self.read_data_ready_flag():
-            sleep(1)
-        self.i2c.write(CMD_READ_MEASURED_VALUES)
-        data = self.i2c.read(NBYTES_MEASURED_VALUES_FLOAT)
-        return data
+    # Wait for data-ready flag, returns NotReady if no new data before timeout
+    def read_measurement_into(self, timeout: float = None) -> memoryview:
+        ready = self.data_ready.wait(timeout)
+        if not ready:
+            return ready
+        self.i2c.transfer_into(CMD_READ_MEASURED_VALUES, self.view)
+        return self.view
+
+    def read_measurement(self, timeout: float = None) -> list:
+        data = self.read_measurement_into(timeout)
+        return list(data) if data else data
 # I2C commands END
 #
 # Helper functions BEGIN
     def crc_calc(self, data: list) -> int:
-        crc = 0xFF
-        for i in range(2):
-            crc ^= data[i]
-            for _ in range(8, 0, -1):
-                if crc & 0x80:
-                    crc = (crc << 1) ^ 0x31
-                else:
-                    crc = crc << 1
-        return (crc & 0x0000FF)
+        return crc8(data)
+
+    # check_frame() counting responses with CRC mismatch (see metrics)
+    def check_frame(self, data, nbytes: int = -1) -> list:
+        bad = check_frame(data, nbytes)
+        if bad:
+            self.crc_errors += 1
+        return bad
 
     def ieee754_number_conversion(self, data: int) -> float:
-        binary = "{:032b}".format(data)
-        sign = int(binary[0:1])
-        exp = int(binary[1:9], 2) - 127
-        exp = 0 if exp < 0 else exp
-        mantissa = binary[9:]
-        real = int(('1' + mantissa[:exp]), 2)
-        decimal = mantissa[exp:]
-        dec = 0.0
-        for i in range(len(decimal)):
-            dec += int(decimal[i]) / (2**(i+1))
-        return round((((-1)**(sign) * real) + dec), 3)
+        return round(struct.unpack('>f', data.to_bytes(4, 'big'))[0], 3)
+
+    def identity(self) -> dict:
+        return {"type": self.type, "sn": self.sn, "fw": self.fw}
 
     def is_cleaning(self) -> int:
         return self.cleaning
@@ -218,30 +242,11 @@ class SPS30:
 #
 # Main functions
     def values_to_list(self, data: list) -> dict:
-        values = ["pm1", "pm2", "pm4", "pm10", "nc0", "nc1", "nc2", "nc4", "nc10", "tps"]
-        assoc = {
-              "pm1":  0.0,
-              "pm2":  0.0,
-              "pm4":  0.0,
-              "pm10": 0.0,
-              "nc0":  0.0,
-              "nc1":  0.0,
-              "nc2":  0.0,
-              "nc4":  0.0,
-              "nc10": 0.0,
-              "tps":  0.0
-        }
-        for block, (idx) in enumerate(values):
-            sensor_data = []
-            for i in range(0, SIZE_FLOAT, PACKET_SIZE):
-                offset = (block * SIZE_FLOAT) + i
-                if self.crc_calc(data[offset:offset+2]) != data[offset+2]:
-                    sensor_data.extend(SPS_DATA_ERR)
-                else:
-                    sensor_data.extend(data[offset:offset+2])
-            assoc[idx] = self.ieee754_number_conversion(
-                sensor_data[0] << 24 | sensor_data[1] << 16 | sensor_data[2] << 8 | sensor_data[3])
-        return assoc
+        return MEASURED_VALUES_FLOAT.decode(data, self.payload)
+
+    # read_values() result with data and without CRC error (see Acquisition.wait_ready)
+    def valid_values(self, values: dict) -> bool:
+        return MEASURED_VALUES_FLOAT.valid(values)
 
     def status_to_str(self, sps_status_register: dict) -> str:
         sps_info = ""
@@ -254,7 +259,10 @@ class SPS30:
         return sps_info
 
     def read_values(self) -> dict:
-        return self.values_to_list(self.read_measurement())
+        data = self.read_measurement_into()
+        if not data:
+            return {}
+        return self.values_to_list(data)
 
     def read_status(self) -> dict:
         sps_status_register = self.read_status_register()
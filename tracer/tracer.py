@@ -0,0 +1,119 @@
+import os
+import json
+import threading
+from collections import deque
+from time import perf_counter_ns
+
+# Phase tracer, exports Chrome trace-event JSON (chrome://tracing, ui.perfetto.dev)
+#
+#   from tracer.tracer import tracer
+#   tracer.enable()
+#   with tracer.span("sht40.read"):
+#       sht_sensor.read_values()
+#   read = tracer.wrap("sps30.read", sps_sensor.read_values)
+#   tracer.export("/tmp/airq-trace.json")
+#
+# Disabled tracer returns shared no-op span, cost is one attribute check per span.
+
+MAX_EVENTS = 100000
+
+
+class NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+
+    def __init__(self, tracer, name: str, cat: str, args: dict):
+        self.tracer = tracer
+        self.name   = name
+        self.cat    = cat
+        self.args   = args
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        end = perf_counter_ns()
+        self.tracer.add({
+            "name": self.name, "cat": self.cat, "ph": "X",
+            "ts": (self.start - self.tracer.origin) / 1000, "dur": (end - self.start) / 1000,
+            "pid": self.tracer.pid, "tid": threading.get_ident(),
+            "args": self.args
+        })
+
+
+class Tracer:
+
+    def __init__(self, enabled: bool = False, max_events: int = MAX_EVENTS):
+        self.enabled = enabled
+        self.events  = deque(maxlen = max_events)     # oldest events dropped
+        self.threads = {}                             # thread id -> name
+        self.origin  = perf_counter_ns()
+        self.pid     = os.getpid()
+        self.lock    = threading.Lock()
+
+    def enable(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+
+    def span(self, name: str, cat: str = "phase", **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, cat, args)
+
+    # Callable running func inside span
+    def wrap(self, name: str, func, cat: str = "phase"):
+        def traced(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            with Span(self, name, cat, {}):
+                return func(*args, **kwargs)
+        return traced
+
+    def instant(self, name: str, cat: str = "phase", **args) -> None:
+        if not self.enabled:
+            return
+        self.add({
+            "name": name, "cat": cat, "ph": "i", "s": "t",
+            "ts": (perf_counter_ns() - self.origin) / 1000,
+            "pid": self.pid, "tid": threading.get_ident(), "args": args
+        })
+
+    def add(self, event: dict) -> None:
+        tid = event["tid"]
+        with self.lock:
+            if tid not in self.threads:
+                self.threads[tid] = threading.current_thread().name
+            self.events.append(event)
+
+    def trace(self) -> dict:
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        meta = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                for tid, name in threads.items()]
+        return {"traceEvents": meta + events, "displayTimeUnit": "ms"}
+
+    # Atomic write (tmp + rename)
+    def export(self, filename: str) -> None:
+        tmp = filename + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.trace(), f)
+        os.replace(tmp, filename)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.events.clear()
+
+
+# Tracer shared by the process, disabled until enable()
+tracer = Tracer()
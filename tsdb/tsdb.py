@@ -0,0 +1,297 @@
+import os
+import json
+import mmap
+import math
+import heapq
+import struct
+import threading
+from time import time, monotonic
+
+# Local append-only time-series store
+#
+# Each reading set is one fixed-size little-endian record: float64 timestamp
+# followed by float32 per schema field (NaN = missing). Records are appended in
+# batches to segment files, every segment is sorted by time and is searched by
+# sparse index (every INDEX_STRIDE-th timestamp) + binary search over mmap.
+# Fields not in schema yet are appended to it, segments written before keep their
+# record layout (schema "widths") and read NaN for the new fields.
+# When clock goes back new segment is started, queries order segments by time and
+# merge records of overlapping ones.
+#
+#   db = TSDB("/home/pi/AirQmonitor/data", ["pm1", "pm2", "pm4", "pm10", "t", "h", "p"])
+#   db.append(time(), sps_sensor.read_values())
+#   for ts, values in db.query(start, end, ["pm2", "pm10"]): ...
+#   db.close()
+
+SCHEMA_FILE     = "schema.json"
+SEGMENT_SUFFIX  = ".seg"
+SEGMENT_RECORDS = 1 << 17    # records per segment file
+INDEX_STRIDE    = 256        # records per sparse index entry
+FLUSH_RECORDS   = 16         # buffered records written in one write()
+FLUSH_INTERVAL  = 300        # [s] max age of buffered records
+
+NAN = float("nan")
+
+
+def record_struct(width: int) -> struct.Struct:
+    return struct.Struct('<d' + 'f' * width)
+
+
+class Segment:
+
+    def __init__(self, filename: str, width: int):
+        self.filename = filename
+        self.width    = width    # fields per record, prefix of schema fields
+        self.record   = record_struct(width)
+        self.size     = 0        # mapped size [B]
+        self.map      = None
+        self.index    = []       # timestamp of every INDEX_STRIDE-th record
+        self.first    = None
+        self.last     = None
+        self.remap()
+
+    def __len__(self) -> int:
+        return self.size // self.record.size
+
+    def ts(self, idx: int) -> float:
+        return struct.unpack_from('<d', self.map, idx * self.record.size)[0]
+
+    # Map file again after append, extend sparse index
+    def remap(self) -> None:
+        size = os.path.getsize(self.filename)
+        size -= size % self.record.size    # ignore torn tail record
+        if size == self.size:
+            return
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.size = size
+        if size == 0:
+            return
+        with open(self.filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), size, access = mmap.ACCESS_READ)
+        for idx in range(len(self.index) * INDEX_STRIDE, len(self), INDEX_STRIDE):
+            self.index.append(self.ts(idx))
+        self.first = self.index[0]
+        self.last  = self.ts(len(self) - 1)
+
+    # Index of first record with timestamp >= ts
+    def lower_bound(self, ts: float) -> int:
+        lo, hi = 0, len(self.index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.index[mid] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return 0
+        lo, hi = (lo - 1) * INDEX_STRIDE, min(lo * INDEX_STRIDE, len(self))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts(mid) < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # Raw records in [start, end)
+    def slice(self, start: float, end: float) -> bytes:
+        if self.map is None or start > self.last or end <= self.first:
+            return b''
+        lo = self.lower_bound(start)
+        hi = self.lower_bound(end)
+        return self.map[lo * self.record.size:hi * self.record.size]
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class TSDB:
+
+    def __init__(self, directory: str, fields: list = None,
+                       segment_records: int = SEGMENT_RECORDS,
+                       flush_records: int = FLUSH_RECORDS, flush_interval: float = FLUSH_INTERVAL,
+                       fsync: bool = False):
+        self.directory       = directory
+        self.segment_records = segment_records
+        self.flush_records   = flush_records
+        self.flush_interval  = flush_interval
+        self.fsync           = fsync
+        self.lock            = threading.RLock()
+        os.makedirs(directory, exist_ok = True)
+
+        segment_names = sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+        self.schema_file = os.path.join(directory, SCHEMA_FILE)
+        if os.path.exists(self.schema_file):
+            with open(self.schema_file) as f:
+                schema = json.load(f)
+            schema.setdefault("widths", {})
+            new = [name for name in fields or [] if name not in schema["fields"]]
+            if new:
+                # schema evolution, existing segments keep their layout
+                for name in segment_names:
+                    schema["widths"].setdefault(name, len(schema["fields"]))
+                schema["fields"] = schema["fields"] + new
+                self.write_schema(schema)
+        elif fields is None:
+            raise ValueError(f"TSDB {directory}: no schema, fields required")
+        else:
+            schema = {"fields": list(fields), "widths": {}}
+            self.write_schema(schema)
+
+        self.fields    = schema["fields"]
+        self.field_idx = {name: idx for idx, name in enumerate(self.fields)}
+        self.record    = record_struct(len(self.fields))
+
+        self.segments   = [Segment(os.path.join(directory, name), schema["widths"].get(name, len(self.fields)))
+                           for name in segment_names]
+        self.buffer     = []          # packed records not yet written
+        self.buffer_ts  = []
+        self.flushed_at = monotonic()
+        self.file       = None        # active segment opened for append
+        self.reuse      = True        # append to last existing segment
+        self.last       = self.segments[-1].last if self.segments else None
+
+    def write_schema(self, schema: dict) -> None:
+        tmp = self.schema_file + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(schema, f)
+        os.replace(tmp, self.schema_file)
+
+    def pack(self, ts: float, values: dict) -> bytes:
+        row = [NAN] * len(self.fields)
+        for name, value in values.items():
+            idx = self.field_idx.get(name)
+            if idx is not None and value is not None:
+                row[idx] = value
+        return self.record.pack(ts, *row)
+
+    def append(self, ts: float, values: dict) -> None:
+        with self.lock:
+            if self.last is not None and ts < self.last:
+                # clock went back, keep every segment sorted
+                self.flush()
+                self.rotate()
+                self.reuse = False
+            self.buffer.append(self.pack(ts, values))
+            self.buffer_ts.append(ts)
+            self.last = ts
+            if len(self.buffer) >= self.flush_records or monotonic() - self.flushed_at >= self.flush_interval:
+                self.flush()
+
+    def rotate(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def active(self) -> Segment:
+        if (self.file is None and self.reuse and self.segments and len(self.segments[-1]) < self.segment_records
+                and self.segments[-1].width == len(self.fields)):
+            # continue last segment of previous run, drop torn tail record
+            segment = self.segments[-1]
+            self.file = open(segment.filename, 'ab')
+            self.file.truncate(segment.size)
+            return segment
+        if self.file is None or len(self.segments[-1]) >= self.segment_records:
+            self.rotate()
+            self.reuse = True
+            name = int(self.buffer_ts[0] * 1000)
+            while os.path.exists(filename := os.path.join(self.directory, f"{name:015d}{SEGMENT_SUFFIX}")):
+                name += 1
+            self.file = open(filename, 'ab')
+            self.segments.append(Segment(filename, len(self.fields)))
+        return self.segments[-1]
+
+    # Write buffered records, one write() per segment
+    def flush(self) -> None:
+        with self.lock:
+            while self.buffer:
+                segment = self.active()
+                room = self.segment_records - len(segment)
+                try:
+                    self.file.write(b''.join(self.buffer[:room]))
+                    self.file.flush()
+                    if self.fsync:
+                        os.fsync(self.file.fileno())
+                except OSError:
+                    # records stay buffered, segment is reopened and torn tail dropped on next flush
+                    try:
+                        self.file.close()
+                    except OSError:
+                        pass
+                    self.file = None
+                    raise
+                segment.remap()
+                del self.buffer[:room]
+                del self.buffer_ts[:room]
+            self.flushed_at = monotonic()
+
+    # (fields per record, record struct, raw records) in [start, end) in time order,
+    # segments (and buffered records) overlapping in time are merged into one chunk
+    def chunks(self, start: float, end: float) -> list:
+        parts = []      # (first ts, last ts, width, record, data)
+        with self.lock:
+            for segment in self.segments:
+                segment.remap()
+                data = segment.slice(start, end)
+                if data:
+                    parts.append((struct.unpack_from('<d', data)[0],
+                                  struct.unpack_from('<d', data, len(data) - segment.record.size)[0],
+                                  segment.width, segment.record, data))
+            buffered = [(rec, ts) for rec, ts in zip(self.buffer, self.buffer_ts) if start <= ts < end]
+            if buffered:
+                parts.append((buffered[0][1], buffered[-1][1], len(self.fields), self.record,
+                              b''.join(rec for rec, ts in buffered)))
+        parts.sort(key = lambda part: part[0])
+        groups, last = [], None
+        for part in parts:
+            if groups and part[0] < last:
+                groups[-1].append(part)
+                last = max(last, part[1])
+            else:
+                groups.append([part])
+                last = part[1]
+        return [group[0][2:] if len(group) == 1 else self.merge(group) for group in groups]
+
+    # One chunk of current layout from records of overlapping parts
+    def merge(self, parts: list) -> tuple:
+        width = len(self.fields)
+        rows  = [(rec + (NAN,) * (width - part_width) for rec in record.iter_unpack(data))
+                 for first, last, part_width, record, data in parts]
+        data  = b''.join(self.record.pack(*rec) for rec in heapq.merge(*rows, key = lambda rec: rec[0]))
+        return width, self.record, data
+
+    def count(self, start: float = 0, end: float = math.inf) -> int:
+        return sum(len(data) // record.size for _, record, data in self.chunks(start, end))
+
+    # Yields (ts, {field: value}) for records in [start, end), missing values skipped
+    def query(self, start: float = 0, end: float = math.inf, fields: list = None):
+        names = self.fields if fields is None else fields
+        pos   = [(name, self.field_idx[name] + 1) for name in names]
+        for width, record, data in self.chunks(start, end):
+            present = [(name, p) for name, p in pos if p <= width]
+            for rec in record.iter_unpack(data):
+                yield rec[0], {name: rec[p] for name, p in present if rec[p] == rec[p]}
+
+    # Column lists (NaN = missing) for records in [start, end)
+    def columns(self, start: float = 0, end: float = math.inf, fields: list = None) -> dict:
+        names = self.fields if fields is None else fields
+        rows  = []
+        for width, record, data in self.chunks(start, end):
+            pad = (NAN,) * (len(self.fields) - width)
+            rows.extend(rec + pad for rec in record.iter_unpack(data))
+        cols = list(zip(*rows)) if rows else [()] * (len(self.fields) + 1)
+        result = {"ts": list(cols[0])}
+        for name in names:
+            result[name] = list(cols[self.field_idx[name] + 1])
+        return result
+
+    def close(self) -> None:
+        with self.lock:
+            self.flush()
+            self.rotate()
+            for segment in self.segments:
+                segment.close()
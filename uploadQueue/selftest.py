@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+#
+# UploadQueue with sensor.community client against in-process HTTP API stand-in
+# (uploadQueue/sim.py)
+#
+#   python3 uploadQueue/selftest.py     # exit 1 when any check fails
+#
+# Checks in-order drain, dead rows for payloads refused with 4xx, retry (not dead row)
+# on 5xx and 429, dead row after max_attempts, ScSink send through journal, and FanOut
+# with journal as the only retry path (readings in order, each sent once).
+
+import io
+import os
+import json
+import sys
+import tempfile
+import contextlib
+
+sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from time import sleep, monotonic
+from uploadQueue.uploadQueue import UploadQueue, check_response
+from uploadQueue.worker import UploadWorker
+from uploadQueue.sim import SimHTTP
+from sensorComm.sensorComm import sensorCommunity
+from httpPool.httpPool import HTTPPool
+from sinks.sinks import ScSink, FanOut
+
+PATH = "/v1/push-sensor-data/"
+
+
+def journal(tmp: str, api: SimHTTP, name: str, **kwargs) -> UploadQueue:
+    sc = sensorCommunity("selftest", api_url = api.url(PATH), pool = HTTPPool(timeout = 2))
+    uq = UploadQueue(os.path.join(tmp, name + ".db"), **kwargs)
+    uq.register("sc", lambda p, timeout: send(sc, p, timeout), 2)
+    return uq
+
+
+def send(sc: sensorCommunity, p: dict, timeout: float) -> bool:
+    if sc.post(p["pin"], p["data"], timeout) is not None:
+        return True
+    check_response(sc.last_response)
+    return False
+
+
+def bodies(api: SimHTTP) -> list:
+    return [r[3].decode() for r in api.requests]
+
+
+def check_order(tmp: str, api: SimHTTP) -> str:
+    uq = journal(tmp, api, "order")
+    try:
+        for i in range(20):
+            uq.put("sc", {"pin": 1, "data": f"row{i}"})
+        assert uq.drain(max_batch = 50, now = 0) == 20, f"not drained, pending {uq.pending()}"
+        assert bodies(api) == [f"row{i}" for i in range(20)], "rows sent out of order"
+        assert uq.pending() == 0, "rows left in journal"
+        return "20 rows delivered in order"
+    finally:
+        uq.close()
+
+
+def check_rejected(tmp: str, api: SimHTTP) -> str:
+    uq = journal(tmp, api, "rejected")
+    api.respond = lambda method, path, headers, body: 400 if body == b"row3" else None
+    try:
+        for i in range(10):
+            uq.put("sc", {"pin": 1, "data": f"row{i}"})
+        assert uq.drain(now = 0) == 9, f"rows behind rejected row not sent, pending {uq.pending()}"
+        dead = uq.dead("sc")
+        assert [d[4]["data"] for d in dead] == ["row3"], f"dead rows: {dead}"
+        assert "400" in dead[0][3], f"reason: {dead[0][3]}"
+        assert uq.ready("sc", 0), "sink backed off after rejected row"
+        return "row refused with HTTP 400 moved to dead rows, 9 rows behind it delivered"
+    finally:
+        api.respond = None
+        uq.close()
+
+
+def check_retry(tmp: str, api: SimHTTP) -> str:
+    uq = journal(tmp, api, "retry")
+    try:
+        uq.put("sc", {"pin": 1, "data": "row0"})
+        uq.put("sc", {"pin": 1, "data": "row1"})
+        for status in (503, 429):
+            api.status = status
+            assert uq.drain(now = 0) == 0, f"sent with HTTP {status}"
+            assert not uq.dead("sc"), f"HTTP {status} row moved to dead rows"
+            assert not uq.ready("sc", 1), f"no backoff after HTTP {status}"
+            uq.retry_at.clear()
+        api.status = 200
+        assert uq.drain(now = 0) == 2, f"not sent after recovery, pending {uq.pending()}"
+        return "HTTP 503 and 429 kept in journal with backoff, sent after recovery"
+    finally:
+        api.status = 200
+        uq.close()
+
+
+def check_max_attempts(tmp: str, api: SimHTTP) -> str:
+    uq = journal(tmp, api, "attempts", max_attempts = 3, min_backoff = 1, max_backoff = 1)
+    try:
+        uq.put("sc", {"pin": 1, "data": "poison"})
+        uq.put("sc", {"pin": 1, "data": "row1"})
+        api.respond = lambda method, path, headers, body: 500 if body == b"poison" else None
+        now = 0
+        for i in range(3):
+            uq.drain(now = now)
+            now += 2
+        dead = uq.dead("sc")
+        assert [(d[4]["data"], d[2]) for d in dead] == [("poison", 3)], f"dead rows: {dead}"
+        assert uq.drain(now = now) == 1 and uq.pending() == 0, f"row behind not sent, pending {uq.pending()}"
+        return "row failing 3 times moved to dead rows, row behind it delivered"
+    finally:
+        api.respond = None
+        uq.close()
+
+
+def check_sink(tmp: str, api: SimHTTP) -> str:
+    sink = ScSink("sc", "selftest", {1: ["pm2"], 11: ["t"]}, timeout = 2)
+    sink.sc.api_url = api.url(PATH)
+    sink.sc.pool    = HTTPPool(timeout = 2)
+    uq = UploadQueue(os.path.join(tmp, "sink.db"))
+    uq.register("sc", sink.send, sink.timeout)
+    api.respond = lambda method, path, headers, body: 400 if headers["X-Pin"] == "11" else None
+    try:
+        for key, payload in sink.build({"pm2": 5.0, "t": 21.5}):
+            uq.put("sc", payload)
+        assert uq.drain(now = 0) == 1, f"pin 1 not sent, pending {uq.pending()}"
+        assert [d[4]["pin"] for d in uq.dead("sc")] == [11], f"dead rows: {uq.dead('sc')}"
+        return "ScSink.send raises Rejected on HTTP 400, pin 11 payload moved to dead rows"
+    finally:
+        api.respond = None
+        uq.close()
+
+
+def check_fanout(tmp: str, api: SimHTTP) -> str:
+    sink = ScSink("sc", "selftest", {1: ["pm2"]}, timeout = 2, retries = 0)
+    sink.sc.api_url = api.url(PATH)
+    sink.sc.pool    = HTTPPool(timeout = 2)
+    uq = UploadQueue(os.path.join(tmp, "fanout.db"), min_backoff = 0.2, max_backoff = 0.2)
+    uq.register("sc", sink.resend, sink.timeout)
+    worker = UploadWorker(uq, interval = 0.1)
+    fanout = FanOut([sink], lambda name, key, payload: worker.submit(name, payload, key), worker.backlog)
+    worker.start()
+    try:
+        api.status = 503
+        fanout.submit({"pm2": 1.0}).result()
+        assert worker.backlog("sc"), "failed payload not in journal backlog"
+        for i in range(2, 5):
+            fanout.submit({"pm2": float(i)}).result()
+        assert len(api.requests) <= 2, f"{len(api.requests)} requests, readings sent past journal"
+        assert sink.sc.data is None, "build changed shared client"
+        refused = len(api.requests)
+        api.status = 200
+        deadline = monotonic() + 5
+        while worker.backlog("sc") and monotonic() < deadline:
+            sleep(0.05)
+        assert not worker.backlog("sc"), f"backlog not drained, pending {uq.pending()}"
+        assert sink.health.failures == 0 and sink.health.last_ok, f"health: {sink.health.snapshot()}"
+        fanout.submit({"pm2": 5.0}).result()
+        accepted = [json.loads(body)["sensordatavalues"][0]["value"] for body in bodies(api)[refused:]]
+        assert accepted == [1.0, 2.0, 3.0, 4.0, 5.0], f"accepted {accepted}"
+        return "failed reading and readings behind it sent once, in order, by journal only"
+    finally:
+        api.status = 200
+        fanout.close()
+        worker.stop(2)
+        uq.close()
+
+
+def main() -> int:
+    api = SimHTTP().start()
+    failed = 0
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for check in (check_order, check_rejected, check_retry, check_max_attempts, check_sink,
+                          check_fanout):
+                api.requests.clear()
+                out = io.StringIO()
+                try:
+                    with contextlib.redirect_stdout(out):     # HTTP errors printed by client
+                        result = check(tmp, api)
+                    print("ok  ", result)
+                except AssertionError as e:
+                    failed += 1
+                    print("FAIL", e)
+    finally:
+        api.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
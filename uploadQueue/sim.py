@@ -0,0 +1,62 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# In-process HTTP API stand-in (sensor.community push, TMEP.cz GET)
+#
+#   api = SimHTTP()
+#   api.start()
+#   sc = sensorCommunity("raspi-test", api_url = api.url("/v1/push-sensor-data/"))
+#   ...
+#   api.requests                      # [(method, path, headers, body), ...]
+#   api.status = 503                  # every request fails
+#   api.respond = lambda method, path, headers, body: 400 if b"bad" in body else None
+#
+# Answers every request with status (or status returned by respond, None = status),
+# keeps connections alive like real API. See uploadQueue/selftest.py.
+
+
+class SimHTTP:
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, status: int = 200):
+        self.status   = status
+        self.respond  = None
+        self.requests = []
+        self.lock     = threading.Lock()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_request(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body   = self.rfile.read(length) if length else b""
+                with api.lock:
+                    api.requests.append((self.command, self.path, dict(self.headers), body))
+                    status = api.respond(self.command, self.path, self.headers, body) if api.respond else None
+                    status = api.status if status is None else status
+                reply = b"OK" if status < 400 else b"error"
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            do_GET  = handle_request
+            do_POST = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+
+    def url(self, path: str = "/") -> str:
+        return f"http://{self.host}:{self.port}{path}"
+
+    def start(self) -> "SimHTTP":
+        threading.Thread(target = self.server.serve_forever, name = "http-api", daemon = True).start()
+        return self
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
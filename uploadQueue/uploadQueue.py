@@ -0,0 +1,180 @@
+import json
+import sqlite3
+import threading
+from time import time
+
+# Persistent upload queue
+#
+# Every upload is appended to SQLite journal before the send attempt and deleted
+# only after the sink accepted it. Failed sink is retried with exponential backoff,
+# pending rows are sent oldest first in batches once the sink is reachable again.
+# Row refused for good (send raises Rejected, e.g. HTTP 400) or failed max_attempts
+# times is moved to dead table, so it does not block rows behind it.
+#
+#   uq = UploadQueue("/home/pi/AirQmonitor/upload.db")
+#   uq.register("sc", lambda p: sc.post(p["pin"], p["data"]) is not None)
+#   uq.put("sc", {"pin": 1, "data": sc.data})
+#   uq.drain()
+#   uq.dead("sc")           # [(id, ts, attempts, reason, payload)]
+
+MIN_BACKOFF = 30          # [s] first retry delay
+MAX_BACKOFF = 3600        # [s]
+MAX_BATCH   = 50          # rows sent per sink and drain()
+MAX_AGE     = 7 * 86400   # [s] older rows are dropped
+MAX_ROWS    = 100000      # rows kept per sink, oldest dropped
+MAX_ATTEMPTS = 24         # failed sends until row is moved to dead table (~18 h of backoff)
+
+# HTTP 4xx status repeated request can still pass (timeout, rate limit)
+RETRY_STATUS = (408, 425, 429)
+
+
+# Raised by send when sink refused payload and will refuse it again
+class Rejected(Exception):
+    pass
+
+
+# For send functions: raises Rejected when HTTP response (httpPool.Response, None
+# when request failed) refused payload for good
+def check_response(resp) -> None:
+    if resp is not None and 400 <= resp.status < 500 and resp.status not in RETRY_STATUS:
+        raise Rejected(f"HTTP {resp.status} {resp.reason}")
+
+
+class UploadQueue:
+
+    def __init__(self, filename: str, max_batch: int = MAX_BATCH,
+                       min_backoff: float = MIN_BACKOFF, max_backoff: float = MAX_BACKOFF,
+                       max_age: float = MAX_AGE, max_rows: int = MAX_ROWS,
+                       max_attempts: int = MAX_ATTEMPTS):
+        self.filename    = filename
+        self.max_batch   = max_batch
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_age     = max_age
+        self.max_rows    = max_rows
+        self.max_attempts = max_attempts
+        self.senders     = {}    # sink -> send(payload: dict[, timeout]) -> bool
+        self.timeouts    = {}    # sink -> timeout passed to send [s]
+        self.failures    = {}    # sink -> consecutive failures
+        self.retry_at    = {}    # sink -> time of next attempt
+        self.sent        = 0
+        self.dropped     = 0
+        self.rejected    = 0     # rows moved to dead table
+        self.lock        = threading.RLock()
+
+        self.db = sqlite3.connect(filename, check_same_thread = False, isolation_level = None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS queue (
+                             id       INTEGER PRIMARY KEY AUTOINCREMENT,
+                             sink     TEXT NOT NULL,
+                             ts       REAL NOT NULL,
+                             attempts INTEGER NOT NULL DEFAULT 0,
+                             payload  TEXT NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS queue_sink ON queue (sink, id)")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS dead (
+                             id       INTEGER PRIMARY KEY,
+                             sink     TEXT NOT NULL,
+                             ts       REAL NOT NULL,
+                             attempts INTEGER NOT NULL,
+                             reason   TEXT,
+                             payload  TEXT NOT NULL)""")
+
+    # send is called as send(payload), or send(payload, timeout) when timeout is set
+    def register(self, sink: str, send, timeout: float = None) -> None:
+        self.senders[sink]  = send
+        self.timeouts[sink] = timeout
+
+    # Append payload to journal, returns row id
+    def put(self, sink: str, payload: dict, ts: float = None) -> int:
+        with self.lock:
+            cur = self.db.execute("INSERT INTO queue (sink, ts, payload) VALUES (?, ?, ?)",
+                                  (sink, time() if ts is None else ts, json.dumps(payload)))
+            return cur.lastrowid
+
+    def pending(self, sink: str = None) -> int:
+        with self.lock:
+            if sink is None:
+                return self.db.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+            return self.db.execute("SELECT COUNT(*) FROM queue WHERE sink = ?", (sink,)).fetchone()[0]
+
+    # Rows moved to dead table, [(id, ts, attempts, reason, payload)]
+    def dead(self, sink: str) -> list:
+        with self.lock:
+            return [(row_id, ts, attempts, reason, json.loads(payload)) for row_id, ts, attempts, reason, payload in
+                    self.db.execute("SELECT id, ts, attempts, reason, payload FROM dead WHERE sink = ? ORDER BY id",
+                                    (sink,))]
+
+    def bury(self, row_id: int, reason: str) -> None:
+        self.db.execute("BEGIN")
+        self.db.execute("""INSERT INTO dead (id, sink, ts, attempts, reason, payload)
+                           SELECT id, sink, ts, attempts, ?, payload FROM queue WHERE id = ?""",
+                        (reason, row_id))
+        self.db.execute("DELETE FROM queue WHERE id = ?", (row_id,))
+        self.db.execute("COMMIT")
+        self.rejected += 1
+
+    # Drop too old rows and rows over limit (dead rows too)
+    def expire(self, now: float = None) -> int:
+        now = time() if now is None else now
+        with self.lock:
+            dropped = self.db.execute("DELETE FROM queue WHERE ts < ?", (now - self.max_age,)).rowcount
+            self.db.execute("DELETE FROM dead WHERE ts < ?", (now - self.max_age,))
+            for sink in self.senders:
+                dropped += self.db.execute("""DELETE FROM queue WHERE sink = ? AND id <= (
+                                                SELECT id FROM queue WHERE sink = ?
+                                                ORDER BY id DESC LIMIT 1 OFFSET ?)""",
+                                           (sink, sink, self.max_rows)).rowcount
+            self.dropped += dropped
+            return dropped
+
+    def backoff(self, sink: str, now: float) -> None:
+        self.failures[sink] = self.failures.get(sink, 0) + 1
+        delay = min(self.min_backoff * 2 ** (self.failures[sink] - 1), self.max_backoff)
+        self.retry_at[sink] = now + delay
+
+    def ready(self, sink: str, now: float = None) -> bool:
+        return (time() if now is None else now) >= self.retry_at.get(sink, 0)
+
+    # Send pending rows of every sink not waiting for backoff, returns number of sent rows
+    def drain(self, max_batch: int = None, now: float = None) -> int:
+        now = time() if now is None else now
+        max_batch = self.max_batch if max_batch is None else max_batch
+        sent = 0
+        with self.lock:
+            self.expire(now)
+            for sink, send in self.senders.items():
+                if not self.ready(sink, now):
+                    continue
+                rows = self.db.execute("SELECT id, payload FROM queue WHERE sink = ? ORDER BY id LIMIT ?",
+                                       (sink, max_batch)).fetchall()
+                timeout = self.timeouts.get(sink)
+                for row_id, payload in rows:
+                    reason = None
+                    try:
+                        if timeout is None:
+                            ok = send(json.loads(payload))
+                        else:
+                            ok = send(json.loads(payload), timeout)
+                    except Rejected as e:
+                        self.bury(row_id, str(e))
+                        continue
+                    except Exception as e:
+                        ok, reason = False, repr(e)
+                    if not ok:
+                        self.db.execute("UPDATE queue SET attempts = attempts + 1 WHERE id = ?", (row_id,))
+                        attempts = self.db.execute("SELECT attempts FROM queue WHERE id = ?", (row_id,)).fetchone()[0]
+                        if attempts >= self.max_attempts:
+                            self.bury(row_id, reason or f"{attempts} failed attempts")
+                        self.backoff(sink, now)
+                        break
+                    self.db.execute("DELETE FROM queue WHERE id = ?", (row_id,))
+                    self.failures[sink] = 0
+                    self.retry_at.pop(sink, None)
+                    sent += 1
+            self.sent += sent
+        return sent
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,127 @@
+import threading
+from collections import deque
+from time import time, monotonic
+
+# Background upload worker
+#
+# Sampling loop hands payloads to submit(), which never blocks and never touches
+# network or disk. Worker thread appends submitted payloads to UploadQueue journal
+# and drains it, so slow or unreachable sink does not shift sampling cadence.
+#
+#   worker = UploadWorker(uq)
+#   worker.start()
+#   worker.submit("sc", {"pin": 1, "data": sc.data}, key = 1)
+#   worker.stop()
+
+MAX_PENDING = 16     # payloads waiting for worker
+INTERVAL    = 30     # [s] drain period without new payloads (retry after backoff)
+
+# Policy when pending queue is full
+MERGE       = "merge"         # replace queued payload with same (sink, key), else drop oldest
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+class UploadWorker(threading.Thread):
+
+    def __init__(self, uq, maxsize: int = MAX_PENDING, policy: str = MERGE,
+                       interval: float = INTERVAL):
+        super().__init__(name = "upload", daemon = True)
+        self.uq        = uq
+        self.maxsize   = maxsize
+        self.policy    = policy
+        self.interval  = interval
+        self.pending   = deque()    # (sink, key, payload, ts)
+        self.backlogged = {sink for sink in uq.senders if uq.pending(sink)}
+        self.cond      = threading.Condition()
+        self.stopping  = False
+        self.submitted = 0
+        self.merged    = 0
+        self.dropped   = 0
+        self.uploaded  = 0
+        self.last_drain = None      # duration of last drain [s]
+        self.last_error = None
+
+    # Queue payload for upload, returns False when payload (or older one) was dropped
+    def submit(self, sink: str, payload: dict, key = None, ts: float = None) -> bool:
+        item = (sink, key, payload, time() if ts is None else ts)
+        with self.cond:
+            self.submitted += 1
+            accepted = True
+            if len(self.pending) >= self.maxsize:
+                if self.policy == MERGE and key is not None:
+                    for idx, (s, k, p, t) in enumerate(self.pending):
+                        if s == sink and k == key:
+                            del self.pending[idx]
+                            self.merged += 1
+                            break
+                if len(self.pending) >= self.maxsize:
+                    self.dropped += 1
+                    accepted = False
+                    if self.policy == DROP_NEWEST:
+                        return False
+                    self.pending.popleft()
+            self.pending.append(item)
+            self.backlogged.add(sink)
+            self.cond.notify()
+            return accepted
+
+    # Payloads of sink wait in pending queue or journal (new ones have to go after them),
+    # in-memory state, does not wait for drain holding the journal
+    def backlog(self, sink: str) -> bool:
+        with self.cond:
+            return sink in self.backlogged
+
+    # Sinks with rows left in journal after drain or payloads submitted meanwhile
+    def update_backlog(self) -> None:
+        left = {sink for sink in list(self.backlogged) if self.uq.pending(sink)}
+        with self.cond:
+            self.backlogged = left | {s for s, k, p, t in self.pending}
+
+    def take(self) -> list:
+        with self.cond:
+            if not self.pending and not self.stopping:
+                self.cond.wait(self.interval)
+            items = list(self.pending)
+            self.pending.clear()
+            return items
+
+    def flush(self, items: list) -> None:
+        for sink, key, payload, ts in items:
+            self.uq.put(sink, payload, ts)
+
+    def run(self) -> None:
+        while True:
+            items = self.take()
+            try:
+                self.flush(items)
+                if self.stopping:
+                    break
+                start = monotonic()
+                self.uploaded += self.uq.drain()
+                self.last_drain = monotonic() - start
+                self.update_backlog()
+            except Exception as e:
+                self.last_error = e
+
+    # Stop worker, not yet journaled payloads are written to journal
+    def stop(self, timeout: float = None) -> None:
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        if self.is_alive():
+            self.join(timeout)
+        if not self.is_alive():
+            self.flush(self.take())
+
+    def stats(self) -> dict:
+        with self.cond:
+            queued = len(self.pending)
+        return {
+            "queued":     queued,
+            "submitted":  self.submitted,
+            "merged":     self.merged,
+            "dropped":    self.dropped,
+            "uploaded":   self.uploaded,
+            "last_drain": self.last_drain
+        }